@@ -175,6 +175,9 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Precomputed analytics data (grade cube .npz files, see students/grade_cube.py)
+GRADE_CUBE_DIR = os.path.join(BASE_DIR, 'analytics_cache')
+
 # Email Backend Configuration
 EMAIL_HOST = os.getenv('EMAIL_HOST')
 if EMAIL_HOST:
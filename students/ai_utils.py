@@ -1,4 +1,5 @@
-from .models import SchoolMemory, SchoolSettings
+from .models import SchoolMemory
+from .settings_utils import get_school_settings
 import logging
 import os
 import random
@@ -20,6 +21,7 @@ logger = logging.getLogger(__name__)
 # OpenRouter: نموذج DeepSeek عبر الاشتراك
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_MODEL = "deepseek/deepseek-chat"
+OPENROUTER_BALANCE_INFO_CACHE_KEY = "openrouter_balance_info"
 
 
 class AIService:
@@ -30,7 +32,7 @@ class AIService:
 
     def __init__(self, user=None):
         self.user = user
-        self.settings = SchoolSettings.objects.first() if SchoolSettings.objects.exists() else None
+        self.settings = get_school_settings()
         self.openrouter_keys = self._load_keys("OPENROUTER_API_KEY")
         # مفتاح الإدارة (Management Key) لقراءة الرصيد من /credits
         self.openrouter_mgmt_keys = self._load_keys("OPENROUTER_MANAGEMENT_KEY")
@@ -107,7 +109,7 @@ class AIService:
         if not key_present and not mgmt_present:
             return {'ok': False, 'balance': None, 'message': 'لم يتم ضبط مفاتيح OpenRouter في ملف .env (OPENROUTER_API_KEY أو OPENROUTER_MANAGEMENT_KEY).', 'key_present': False}
 
-        cache_key_info = "openrouter_balance_info"
+        cache_key_info = OPENROUTER_BALANCE_INFO_CACHE_KEY
         cache_key_balance = "openrouter_balance"
         cached = cache.get(cache_key_info)
         if cached and isinstance(cached, dict) and 'ok' in cached:
@@ -347,6 +349,12 @@ class AIService:
         return None, False, last_error
 
 
+def get_cached_openrouter_balance_info():
+    """آخر معلومات رصيد محفوظة (بدون أي طلب شبكة) أو None. للعرض في لوحة القيادة."""
+    cached = cache.get(OPENROUTER_BALANCE_INFO_CACHE_KEY)
+    return cached if isinstance(cached, dict) and 'ok' in cached else None
+
+
 def analyze_assignment_document(a):
     pass
 
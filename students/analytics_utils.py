@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import logging
 from django.db.models import QuerySet
@@ -76,42 +77,158 @@ def _level_key(s):
     return None
 
 
+def format_class_names(levels, class_names):
+    """
+    نسخة متجهة من format_class_name لعمودين (Series): تُحسب النتيجة مرة واحدة لكل زوج
+    (مستوى، قسم) فريد عبر جدول بحث ثم تُنشر على كل الصفوف.
+    """
+    if len(levels) == 0:
+        return pd.Series([], index=levels.index, dtype=object)
+    level_codes, level_values = pd.factorize(levels, use_na_sentinel=False)
+    class_codes, class_values = pd.factorize(class_names, use_na_sentinel=False)
+    n_classes = len(class_values)
+    pairs, inverse = np.unique(level_codes.astype(np.int64) * n_classes + class_codes, return_inverse=True)
+    table = np.array(
+        [format_class_name(level_values[p // n_classes], class_values[p % n_classes]) for p in pairs],
+        dtype=object,
+    )
+    return pd.Series(table[inverse.ravel()], index=levels.index, dtype=object)
+
+
+def _strip_al(s):
+    return re.sub('^ال', '', s).strip()
+
+
+def exemption_mask(d, rules):
+    """
+    قناع منطقي واحد لكل قواعد الإعفاء (تلميذ/فوج/مستوى/مؤسسة).
+
+    الأعمدة (المادة، الفصل، الفوج الفعلي، مفتاح المستوى) تُرمَّز مرة واحدة (factorize)،
+    وكل قاعدة تُترجم إلى مجموعة مفاتيح صحيحة مركبة حسب نطاقها؛ ثم np.isin واحد لكل نطاق.
+    d يجب أن يحتوي '__class_code_effective' عند وجود قواعد فوج.
+    """
+    subj_codes, subj_values = pd.factorize(d['subject'].astype(str).str.strip())
+    term_codes, term_values = pd.factorize(d['term'].astype(str).str.strip())
+    subj_values = list(subj_values)
+    subj_alt = [_strip_al(v) for v in subj_values]
+    term_index = {v: i for i, v in enumerate(term_values)}
+    n_terms = max(len(term_values), 1)
+    # مفتاح (مادة، فصل) لكل صف
+    st_key = subj_codes.astype(np.int64) * n_terms + term_codes
+
+    def rule_keys(r_subj, r_term):
+        """المفاتيح (مادة، فصل) التي تطابق القاعدة: تطابق تام أو بعد إزالة "ال" من الطرفين."""
+        r_subj_norm = r_subj.replace('ال', '', 1) if r_subj.startswith('ال') else r_subj
+        wanted = {r_subj, r_subj_norm}
+        subjects = [i for i, (v, alt) in enumerate(zip(subj_values, subj_alt)) if v in wanted or alt in wanted]
+        if r_term:
+            if r_term not in term_index:
+                return []
+            terms = [term_index[r_term]]
+        else:
+            terms = range(len(term_values))
+        return [sc * n_terms + tc for sc in subjects for tc in terms]
+
+    school_keys, student_keys, class_keys, level_keys = [], [], [], []
+    for r in rules:
+        if not isinstance(r, dict):
+            continue
+        r_subj = str(r.get('subject') or '').strip()
+        if not r_subj:
+            continue
+        r_scope = str(r.get('scope_type') or '').strip()
+        r_term = str(r.get('term') or '').strip()
+
+        if r_scope == 'school':
+            school_keys.extend(rule_keys(r_subj, r_term))
+        elif r_scope == 'student':
+            sid = r.get('student_id')
+            if sid:
+                student_keys.extend((k, int(sid)) for k in rule_keys(r_subj, r_term))
+        elif r_scope == 'class':
+            cc = str(r.get('class_code') or '').strip()
+            if cc:
+                class_keys.extend((k, cc) for k in rule_keys(r_subj, r_term))
+        elif r_scope == 'level':
+            lvl = str(r.get('academic_year') or '').strip()
+            # مطابقة المستوى بمفتاح موحد (1،2،3،4) لأن القاعدة قد تكون "أولى متوسط" والبيانات "أولى" فقط
+            rule_level_key = _level_key(lvl) if lvl else None
+            if rule_level_key:
+                level_keys.extend((k, rule_level_key) for k in rule_keys(r_subj, r_term))
+
+    mask = np.zeros(len(d), dtype=bool)
+    if school_keys:
+        mask |= np.isin(st_key, school_keys)
+    if student_keys:
+        sid_codes, sid_values = pd.factorize(d['student__id'])
+        sid_index = {int(v): i for i, v in enumerate(sid_values)}
+        n_sid = len(sid_values) + 1
+        wanted = [k * n_sid + sid_index[sid] for k, sid in student_keys if sid in sid_index]
+        if wanted:
+            mask |= np.isin(st_key * n_sid + sid_codes, wanted)
+    if class_keys:
+        cls_codes, cls_values = pd.factorize(d['__class_code_effective'])
+        class_index = {v: i for i, v in enumerate(cls_values)}
+        n_cls = len(cls_values) + 1
+        wanted = [k * n_cls + class_index[cc] for k, cc in class_keys if cc in class_index]
+        if wanted:
+            mask |= np.isin(st_key * n_cls + cls_codes, wanted)
+    if level_keys:
+        lvl_codes, lvl_values = pd.factorize(d['student__academic_year'], use_na_sentinel=False)
+        # مفتاح المستوى يُحسب مرة لكل قيمة مستوى فريدة
+        key_of_value = np.array([int(_level_key(v) or 0) for v in lvl_values], dtype=np.int64)
+        row_level = key_of_value[lvl_codes]
+        wanted = [k * 5 + int(lk) for k, lk in level_keys]
+        mask |= np.isin(st_key * 5 + row_level, wanted)
+    return pd.Series(mask, index=d.index)
+
+
+def _grades_frame(source, fields):
+    """QuerySet من Grade أو DataFrame جاهز (GradeCube.to_frame) -> DataFrame بالأعمدة المطلوبة، أو None إن كان فارغاً."""
+    if isinstance(source, pd.DataFrame):
+        return source.loc[:, list(fields)].copy() if not source.empty else None
+    data = list(source.values(*fields))
+    return pd.DataFrame(data) if data else None
+
+
 def analyze_grades_locally(grades_qs: QuerySet, subject_filter=None, include_zeros=True, grades_qs_for_ranking=None, exempt_subjects=None, exemption_rules=None):
     """
     Takes a Django QuerySet of Grade objects and uses Pandas to perform local statistical analysis.
+    grades_qs / grades_qs_for_ranking may also be DataFrames already built from the grade cube (grade_cube.py).
     If grades_qs_for_ranking is provided (e.g. نفس الطلاب/الأفواج لكن كل المواد)، يُستخدم لحساب
     ترتيب التلاميذ والمعدل الفصلي الحقيقي (كل المواد) بدل معدل المواد المفلترة فقط.
     exempt_subjects: list of subject names to exclude from all calculations (المادة المعفاة من التحليل).
     """
-    if not grades_qs.exists():
+    if isinstance(grades_qs, pd.DataFrame):
+        if grades_qs.empty:
+            return None
+    elif not grades_qs.exists():
         return None
 
     exempt_set = set(str(s).strip() for s in (exempt_subjects or []) if s)
 
     try:
         # 1. Convert QuerySet to Pandas DataFrame
-        data = list(grades_qs.values('student__id', 'student__last_name', 'student__first_name', 'student__class_name', 'student__class_code', 'student__academic_year', 'student__gender', 'student__is_repeater', 'student__date_of_birth', 'subject', 'term', 'score'))
-        if not data:
+        df = _grades_frame(grades_qs, ('student__id', 'student__last_name', 'student__first_name', 'student__class_name', 'student__class_code', 'student__academic_year', 'student__gender', 'student__is_repeater', 'student__date_of_birth', 'subject', 'term', 'score'))
+        if df is None:
             return None
-        df = pd.DataFrame(data)
 
         # استبعاد المواد المعفاة من التحليل تماماً
         if exempt_set:
             df = df[~df['subject'].astype(str).str.strip().isin(exempt_set)]
 
         df_ranking = None
-        if grades_qs_for_ranking and grades_qs_for_ranking.exists():
-            data_rank = list(grades_qs_for_ranking.values('student__id', 'student__last_name', 'student__first_name', 'student__class_name', 'student__class_code', 'student__academic_year', 'subject', 'term', 'score'))
-            if data_rank:
-                df_ranking = pd.DataFrame(data_rank)
+        if grades_qs_for_ranking is not None:
+            df_ranking = _grades_frame(grades_qs_for_ranking, ('student__id', 'student__last_name', 'student__first_name', 'student__class_name', 'student__class_code', 'student__academic_year', 'subject', 'term', 'score'))
+            if df_ranking is not None:
                 if exempt_set:
                     df_ranking = df_ranking[~df_ranking['subject'].astype(str).str.strip().isin(exempt_set)]
                 df_ranking['student_name'] = df_ranking['student__last_name'].fillna('') + ' ' + df_ranking['student__first_name'].fillna('')
-                df_ranking['student__class_name'] = df_ranking.apply(lambda row: format_class_name(row['student__academic_year'], row['student__class_name']), axis=1)
+                df_ranking['student__class_name'] = format_class_names(df_ranking['student__academic_year'], df_ranking['student__class_name'])
 
         # Reconstruct full_name and format class — قبل فلتر الأصفار لاستخدام نفس البيانات للقائمة والترتيب
         df['student_name'] = df['student__last_name'].fillna('') + ' ' + df['student__first_name'].fillna('')
-        df['student__class_name'] = df.apply(lambda row: format_class_name(row['student__academic_year'], row['student__class_name']), axis=1)
+        df['student__class_name'] = format_class_names(df['student__academic_year'], df['student__class_name'])
 
         def apply_exemption_rules_to_frame(d):
             """تطبيق قواعد الإعفاء (تلميذ/فوج/مستوى/مؤسسة) على إطار البيانات."""
@@ -122,61 +239,12 @@ def analyze_grades_locally(grades_qs: QuerySet, subject_filter=None, include_zer
                 d['__class_code_effective'] = d['student__class_code'].fillna('')
                 needs = d['__class_code_effective'].astype(str).str.strip() == ''
                 if needs.any():
-                    d.loc[needs, '__class_code_effective'] = d.loc[needs].apply(
-                        lambda row: format_class_name(row['student__academic_year'], row['student__class_name']),
-                        axis=1
+                    d.loc[needs, '__class_code_effective'] = format_class_names(
+                        d.loc[needs, 'student__academic_year'], d.loc[needs, 'student__class_name']
                     )
                 d['__class_code_effective'] = d['__class_code_effective'].astype(str).str.strip()
 
-                subj_norm = d['subject'].astype(str).str.strip()
-                term_norm = d['term'].astype(str).str.strip()
-                mask_exempt = pd.Series(False, index=d.index)
-
-                for r in exemption_rules:
-                    if not isinstance(r, dict):
-                        continue
-                    r_subj = str(r.get('subject') or '').strip()
-                    if not r_subj:
-                        continue
-                    r_scope = str(r.get('scope_type') or '').strip()
-                    r_term = str(r.get('term') or '').strip()
-
-                    # مطابقة المادة: تطابق تام أو بعد إزالة "ال" من الطرفين
-                    r_subj_norm = r_subj.replace('ال', '', 1) if r_subj.startswith('ال') else r_subj
-                    subj_norm_alt = subj_norm.str.replace('^ال', '', regex=True).str.strip()
-                    m = (subj_norm == r_subj) | (subj_norm == r_subj_norm) | (subj_norm_alt == r_subj) | (subj_norm_alt == r_subj_norm)
-                    if r_term:
-                        m = m & (term_norm == r_term)
-
-                    if r_scope == 'student':
-                        sid = r.get('student_id')
-                        if sid:
-                            m = m & (d['student__id'] == int(sid))
-                        else:
-                            continue
-                    elif r_scope == 'class':
-                        cc = str(r.get('class_code') or '').strip()
-                        if not cc:
-                            continue
-                        m = m & (d['__class_code_effective'] == cc)
-                    elif r_scope == 'level':
-                        lvl = str(r.get('academic_year') or '').strip()
-                        if not lvl:
-                            continue
-                        rule_level_key = _level_key(lvl)
-                        if not rule_level_key:
-                            continue
-                        # مطابقة المستوى بمفتاح موحد (1،2،3،4) لأن القاعدة قد تكون "أولى متوسط" والبيانات "أولى" فقط
-                        d['__level_key'] = d['student__academic_year'].apply(lambda x: _level_key(x))
-                        m = m & (d['__level_key'] == rule_level_key)
-                        d.drop(columns=['__level_key'], inplace=True, errors='ignore')
-                    elif r_scope == 'school':
-                        pass
-                    else:
-                        continue
-
-                    mask_exempt = mask_exempt | m
-
+                mask_exempt = exemption_mask(d, exemption_rules)
                 if mask_exempt.any():
                     d = d[~mask_exempt]
                 return d
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 import os
 from django.conf import settings
 
@@ -6,6 +7,9 @@ class StudentsConfig(AppConfig):
     name = 'students'
 
     def ready(self):
+        # Rebuilding students_student in a later migration drops the search triggers
+        post_migrate.connect(_ensure_student_search_index, sender=self)
+
         # Ensure media directory for photos exists
         try:
             path = os.path.join(settings.MEDIA_ROOT, 'students_photos')
@@ -14,3 +18,9 @@ class StudentsConfig(AppConfig):
                 print(f"Created photos directory at {path}")
         except Exception as e:
             print(f"Warning: Could not create photos directory: {e}")
+
+
+def _ensure_student_search_index(using='default', **kwargs):
+    from django.db import connections
+    from .student_search import ensure_search_index
+    ensure_search_index(connections[using])
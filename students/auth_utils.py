@@ -3,7 +3,7 @@ import string
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
-from .models import SchoolSettings
+from .settings_utils import get_school_settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,7 +21,7 @@ def generate_random_password(length=12):
 def send_new_account_email(user, password):
     """Sends an email to the new user with their temporary password."""
     try:
-        settings_obj = SchoolSettings.objects.first()
+        settings_obj = get_school_settings()
         school_name = settings_obj.name if settings_obj else "Baza Systems"
 
         subject = f"Welcome to {school_name} - Your Account Credentials"
@@ -55,7 +55,7 @@ Administrator
 def send_password_reset_email(user, token):
     """Sends a password reset link."""
     try:
-        settings_obj = SchoolSettings.objects.first()
+        settings_obj = get_school_settings()
         school_name = settings_obj.name if settings_obj else "Baza Systems"
 
         link = f"{settings.APP_DOMAIN}/reset-password/{token}/"
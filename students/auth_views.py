@@ -10,11 +10,14 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.core.mail import send_mail
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from .models import EmployeeProfile, UserActivityLog, SchoolSettings, UserRole, Student
 from .serializers import UserRoleSerializer, StudentListSerializer
+from .settings_utils import get_school_settings
 from .auth_utils import send_password_reset_email, generate_random_password, send_new_account_email
+from .offline_sync import gzip_stream, ndjson_lines, parse_cursor, student_change_feed
 import secrets
 import pyotp
 import qrcode
@@ -253,9 +256,11 @@ def login_view(request):
         password = request.data.get('password')
 
         # --- Director Recovery Login ---
-        settings_obj = SchoolSettings.objects.first()
+        settings_obj = get_school_settings()
         if settings_obj and settings_obj.admin_email and username.strip().lower() == settings_obj.admin_email.strip().lower():
             if settings_obj.recovery_token and password.strip() == settings_obj.recovery_token:
+                # The cached row is shared and read-only: write through a fresh instance
+                settings_obj = SchoolSettings.objects.get(pk=settings_obj.pk)
                 settings_obj.recovery_token = None
                 settings_obj.save()
 
@@ -636,6 +641,9 @@ def offline_bootstrap(request):
     """
     نسخة محلية كاملة للتلاميذ فقط إن فعّل المدير للمستخدم صلاحية «العمل بالنسخة المحلية»
     مع وجود وصول لتسيير التلاميذ أو المطعم.
+
+    ?since=<cursor> (فارغ في أول مزامنة): بث NDJSON مضغوط بـ gzip بالتغييرات فقط منذ
+    المؤشر (انظر offline_sync.py). بدون since: الرد JSON الكامل القديم.
     """
     profile = getattr(request.user, 'profile', None)
     if not profile:
@@ -650,6 +658,18 @@ def offline_bootstrap(request):
     can_students = profile.has_perm('offline_cache_students') and (
         profile.has_perm('access_management') or profile.has_perm('access_canteen')
     )
+    if can_students and 'since' in request.query_params:
+        feed = ndjson_lines(student_change_feed(parse_cursor(request.query_params.get('since'))))
+        gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = StreamingHttpResponse(
+            gzip_stream(feed) if gzipped else feed, content_type='application/x-ndjson; charset=utf-8',
+        )
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = 'no-store'
+        return response
+
     if can_students:
         total = Student.objects.count()
         max_n = 12000
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس الباركود في الذاكرة لمسح بطاقات المطعم.
+
+- فهرس: باركود -> (النوع، المعرف، نظام التمدرس، الاسم، بيانات البطاقة)
+  يُبنى مرة واحدة لكل عملية ويُلغى عبر إشارات post_save/post_delete على Student وEmployee.
+- مصفوفة بتات يومية "أكل مسبقاً" متزامنة مع CanteenAttendance،
+  حتى يُحسم المسح في الذاكرة ثم يُتبع بعملية INSERT واحدة.
+
+الفهرس محلي لكل عملية (process-local)، لذلك نعيد بناءه دورياً (TTL) حتى تظهر
+تعديلات العمليات الأخرى، والقيد الفريد (student, date) يبقى الحكم النهائي عند الإدراج.
+"""
+import os
+import threading
+import time as _time
+from collections import namedtuple
+from datetime import date
+
+from django.conf import settings
+
+from .photo_variants import variant_url
+
+HALF_BOARD = 'نصف داخلي'
+
+# مدة صلاحية الفهرس ومصفوفة البتات بالثواني (لالتقاط تعديلات العمليات الأخرى)
+BARCODE_INDEX_TTL = 300
+ATE_BITSET_TTL = 60
+
+KIND_STUDENT = 'student'
+KIND_EMPLOYEE = 'employee'
+
+BarcodeEntry = namedtuple('BarcodeEntry', ['kind', 'id', 'attendance_system', 'name', 'card'])
+
+_lock = threading.RLock()
+_index = None
+_index_built_at = 0.0
+
+_ate_day = None
+_ate_bits = None
+_ate_built_at = 0.0
+
+
+def _photo_url(photo_name, student_id_number, photo_files):
+    """رابط الصورة بنفس منطق StudentSerializer.get_photo_url لكن بدون stat لكل تلميذ."""
+    if photo_name:
+        return f'{settings.MEDIA_URL}{photo_name}'
+    safe_id = str(student_id_number).replace('/', '_').replace('\\', '_').strip()
+    if f'{safe_id}.jpg' in photo_files:
+        return f'{settings.MEDIA_URL}students_photos/{safe_id}.jpg'
+    return None
+
+
+def _list_photo_files():
+    try:
+        with os.scandir(os.path.join(settings.MEDIA_ROOT, 'students_photos')) as it:
+            return {e.name for e in it if e.is_file()}
+    except OSError:
+        return set()
+
+
+def _build_index():
+    from .models import Student, Employee
+
+    photo_files = _list_photo_files()
+    index = {}
+
+    # الموظفون أولاً حتى يغلب التلميذ عند تطابق الرمز (نفس ترتيب scan_card)
+    for pk, code, last_name, first_name in Employee.objects.exclude(
+        employee_code__isnull=True
+    ).exclude(employee_code='').values_list('id', 'employee_code', 'last_name', 'first_name'):
+        index[str(code).strip()] = BarcodeEntry(
+            KIND_EMPLOYEE, pk, None, f"{first_name} {last_name}".strip(), None
+        )
+
+    for row in Student.objects.values(
+        'id', 'student_id_number', 'last_name', 'first_name', 'date_of_birth',
+        'academic_year', 'class_name', 'class_code', 'attendance_system', 'photo', 'photo_hash',
+    ):
+        barcode = str(row['student_id_number']).strip()
+        card = {
+            'id': row['id'],
+            'student_id_number': row['student_id_number'],
+            'last_name': row['last_name'],
+            'first_name': row['first_name'],
+            'date_of_birth': row['date_of_birth'].isoformat() if row['date_of_birth'] else None,
+            'academic_year': row['academic_year'],
+            'class_name': row['class_name'],
+            'class_code': row['class_code'],
+            'attendance_system': row['attendance_system'],
+            'photo': _photo_url(row['photo'], row['student_id_number'], photo_files),
+            'photo_thumb': variant_url(row['photo_hash'], 'scan') if row['photo_hash'] else None,
+        }
+        index[barcode] = BarcodeEntry(
+            KIND_STUDENT, row['id'], row['attendance_system'],
+            f"{row['last_name']} {row['first_name']}", card,
+        )
+    return index
+
+
+def get_barcode_index():
+    """يرجع الفهرس الحالي (ويبنيه عند الحاجة)."""
+    global _index, _index_built_at
+    with _lock:
+        if _index is None or _time.monotonic() - _index_built_at > BARCODE_INDEX_TTL:
+            _index = _build_index()
+            _index_built_at = _time.monotonic()
+        return _index
+
+
+def resolve_barcode(barcode):
+    """
+    باركود -> BarcodeEntry أو None.
+    عند عدم الإيجاد في الفهرس نعيد البناء مرة واحدة (سجل أُضيف من عملية أخرى).
+    """
+    barcode = str(barcode or '').strip()
+    if not barcode:
+        return None
+    entry = get_barcode_index().get(barcode)
+    if entry is None:
+        invalidate_barcode_index()
+        entry = get_barcode_index().get(barcode)
+    return entry
+
+
+def invalidate_barcode_index(**kwargs):
+    """يُستدعى من إشارات Student/Employee وبعد عمليات الاستيراد الجماعي (bulk)."""
+    global _index
+    with _lock:
+        _index = None
+
+
+def _load_ate_bits(day):
+    from .models import CanteenAttendance
+
+    ids = list(CanteenAttendance.objects.filter(date=day).values_list('student_id', flat=True))
+    bits = bytearray((max(ids) >> 3) + 1 if ids else 0)
+    for sid in ids:
+        bits[sid >> 3] |= 1 << (sid & 7)
+    return bits
+
+
+def _ensure_ate_bits(day):
+    global _ate_day, _ate_bits, _ate_built_at
+    if _ate_bits is None or _ate_day != day or _time.monotonic() - _ate_built_at > ATE_BITSET_TTL:
+        _ate_bits = _load_ate_bits(day)
+        _ate_day = day
+        _ate_built_at = _time.monotonic()
+    return _ate_bits
+
+
+def has_eaten(student_id, day=None):
+    """هل سُجّل حضور التلميذ في المطعم لهذا اليوم؟ (من الذاكرة)"""
+    day = day or date.today()
+    with _lock:
+        bits = _ensure_ate_bits(day)
+        byte = student_id >> 3
+        return byte < len(bits) and bool(bits[byte] & (1 << (student_id & 7)))
+
+
+def mark_eaten(student_id, day):
+    with _lock:
+        if _ate_bits is None or _ate_day != day:
+            return
+        byte = student_id >> 3
+        if byte >= len(_ate_bits):
+            _ate_bits.extend(bytes(byte - len(_ate_bits) + 1))
+        _ate_bits[byte] |= 1 << (student_id & 7)
+
+
+def unmark_eaten(student_id, day):
+    with _lock:
+        if _ate_bits is None or _ate_day != day:
+            return
+        byte = student_id >> 3
+        if byte < len(_ate_bits):
+            _ate_bits[byte] &= ~(1 << (student_id & 7)) & 0xFF
+
+
+def reset_canteen_index():
+    """تفريغ كل الحالة المحلية (الفهرس ومصفوفة البتات)."""
+    global _index, _ate_bits, _ate_day
+    with _lock:
+        _index = None
+        _ate_bits = None
+        _ate_day = None
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+إحصائيات لوحة القيادة (التلاميذ حسب المستوى ونظام التمدرس + حضور المطعم اليوم).
+
+كل العدادات تُحسب باستعلام تجميعي شرطي واحد، وتُحفظ في CACHES لبضع ثوانٍ،
+وتُلغى عند كل حفظ/حذف لـ Student أو CanteenAttendance (انظر models.py).
+المسارات الجماعية (bulk_create) تستدعي invalidate_dashboard_stats مباشرة.
+"""
+from datetime import date
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .canteen_utils import HALF_BOARD
+
+CACHE_TIMEOUT = 5
+
+
+def _cache_key(day):
+    return f'dashboard_stats:v1:{day.isoformat()}'
+
+
+def compute_dashboard_stats(day=None):
+    """حساب الإحصائيات من القاعدة (استعلام واحد مجمّع حسب المستوى)."""
+    from .models import CanteenAttendance, Student
+
+    day = day or date.today()
+    ate = Exists(CanteenAttendance.objects.filter(student=OuterRef('pk'), date=day))
+    rows = (
+        Student.objects.order_by().values('academic_year')
+        .annotate(
+            total=Count('id'),
+            half=Count('id', filter=Q(attendance_system=HALF_BOARD)),
+            present=Count('id', filter=Q(ate)),
+        )
+    )
+
+    stats_map = {}
+    present_today = 0
+    for item in rows:
+        lvl = item['academic_year'] or 'غير محدد'
+        entry = stats_map.setdefault(lvl, {'level': lvl, 'half': 0, 'ext': 0, 'total': 0})
+        entry['total'] += item['total']
+        entry['half'] += item['half']
+        entry['ext'] += item['total'] - item['half']
+        present_today += item['present']
+
+    total_students = sum(e['total'] for e in stats_map.values())
+    half_board_count = sum(e['half'] for e in stats_map.values())
+    return {
+        'total_students': total_students,
+        'half_board_count': half_board_count,
+        'ext_board_count': total_students - half_board_count,
+        'present_today': present_today,
+        'absent_today': half_board_count - present_today,
+        'detailed_stats': sorted(stats_map.values(), key=lambda x: x['level']),
+    }
+
+
+def get_dashboard_stats():
+    """الإحصائيات من الذاكرة المؤقتة (أو حسابها). للقراءة فقط."""
+    key = _cache_key(date.today())
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_dashboard_stats()
+        cache.set(key, stats, CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate_dashboard_stats(**kwargs):
+    cache.delete(_cache_key(date.today()))
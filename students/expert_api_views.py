@@ -1,19 +1,17 @@
 import django
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
-from .expert_utils import run_expert_engine
-from .models import ExpertAnalysisRun, StudentExpertData, CohortExpertData, SchoolSettings
-import threading
+from .expert_jobs import enqueue_expert_job, cancel_expert_job, job_to_dict, kick
+from .expert_utils import levels_matching
+from .models import ExpertAnalysisRun, ExpertJob, StudentExpertData, CohortExpertData, SchoolSettings
 from .ai_utils import AIService
-
-EXPERT_ENGINE_RUNNING_KEY = 'expert_engine_running'
+from .settings_utils import get_subject_coefficients_by_level
 
 @login_required
 def api_expert_run(request):
     """
-    Triggers the background engine to process data.
-    Sets cache key so frontend can poll run status.
+    Queues an expert engine job (see expert_jobs).
+    Identical requests already queued/running are merged; the frontend polls api_expert_run_status.
     """
     if not request.user.profile.has_perm('access_analytics'):
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
@@ -29,21 +27,10 @@ def api_expert_run(request):
             year_before_prev = get_school_year_before_prev(current_year)
             prev_years_extra = [year_before_prev] if year_before_prev and year_before_prev != prev_year else []
 
-            def background_task():
-                from django.db import connection
-                try:
-                    cache.set(EXPERT_ENGINE_RUNNING_KEY, True, timeout=600)
-                    run_expert_engine(current_year, current_term, prev_year, prev_years_extra=prev_years_extra)
-                finally:
-                    connection.close()
-                    cache.delete(EXPERT_ENGINE_RUNNING_KEY)
-
-            thread = threading.Thread(target=background_task)
-            thread.start()
-
-            return JsonResponse({'status': 'success', 'message': 'تم بدء تشغيل محرك الخبراء في الخلفية'})
+            job, created = enqueue_expert_job(current_year, current_term, prev_year, prev_years_extra, user=request.user)
+            message = 'تم بدء تشغيل محرك الخبراء في الخلفية' if created else 'المحرك قيد التشغيل بالفعل لنفس الطلب'
+            return JsonResponse({'status': 'success', 'message': message, 'created': created, 'job': job_to_dict(job)})
         except Exception as e:
-            cache.delete(EXPERT_ENGINE_RUNNING_KEY)
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
@@ -51,10 +38,21 @@ def api_expert_run(request):
 
 @login_required
 def api_expert_run_status(request):
-    """استعلام دوري: هل المحرك قيد التشغيل + آخر تشغيلة."""
+    """استعلام دوري: هل توجد مهمة نشطة (مع نسبة التقدم) + آخر تشغيلة. ?job_id= لمتابعة مهمة محددة."""
     if not request.user.profile.has_perm('access_analytics'):
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
-    running = cache.get(EXPERT_ENGINE_RUNNING_KEY, False)
+    job_id = request.GET.get('job_id')
+    if job_id:
+        job = ExpertJob.objects.filter(pk=job_id).first()
+    else:
+        job = (ExpertJob.objects.filter(status__in=ExpertJob.ACTIVE_STATUSES).order_by('created_at').first()
+               or ExpertJob.objects.order_by('-created_at').first())
+    running = ExpertJob.objects.filter(status__in=ExpertJob.ACTIVE_STATUSES).exists()
+    if job_id and job is not None:
+        running = job.status in ExpertJob.ACTIVE_STATUSES
+    if running and ExpertJob.objects.filter(status=ExpertJob.STATUS_QUEUED).exists():
+        # مهمة منتظرة قد تكون يتيمة (توقفت العملية التي أضافتها): نوقظ المجمع المحلي
+        kick()
     latest = ExpertAnalysisRun.objects.filter(status='completed').order_by('-run_date').first()
     last_run = None
     if latest:
@@ -67,20 +65,124 @@ def api_expert_run_status(request):
     return JsonResponse({
         'status': 'success',
         'running': bool(running),
+        'job': job_to_dict(job) if job else None,
         'last_run': last_run,
     })
 
 
+@login_required
+def api_expert_run_cancel(request):
+    """إلغاء مهمة محرك الخبراء (job_id، أو المهمة النشطة الحالية عند غيابه)."""
+    if not request.user.profile.has_perm('access_analytics'):
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    import json
+    try:
+        data = json.loads(request.body) if request.body else {}
+    except ValueError:
+        data = {}
+    job_id = data.get('job_id')
+    if not job_id:
+        job_id = ExpertJob.objects.filter(status__in=ExpertJob.ACTIVE_STATUSES).order_by('created_at').values_list('id', flat=True).first()
+    if not job_id or not cancel_expert_job(job_id):
+        return JsonResponse({'status': 'error', 'message': 'لا توجد مهمة نشطة لإلغائها'}, status=404)
+    return JsonResponse({'status': 'success', 'message': 'تم طلب إلغاء تشغيل المحرك', 'job': job_to_dict(ExpertJob.objects.get(pk=job_id))})
+
+
+# Student rows of api_expert_data: .values() columns and the accepted ?sort= keys
+EXPERT_STUDENT_FIELDS = (
+    'student_id', 'student__last_name', 'student__first_name', 'class_name', 'academic_year_level',
+    'residual', 'status_pattern', 'current_avg', 'predicted_avg', 'traffic_light', 'net_value_added', 'z_score',
+)
+EXPERT_SORT_FIELDS = {
+    'name': ('student__last_name', 'student__first_name'),
+    'level': ('academic_year_level',),
+    'class': ('class_name',),
+    'current_avg': ('current_avg',),
+    'predicted_avg': ('predicted_avg',),
+    'residual': ('residual',),
+    'z_score': ('z_score',),
+    'net_value_added': ('net_value_added',),
+}
+EXPERT_DEFAULT_ORDER = ('academic_year_level', 'class_name', 'id')
+EXPERT_MAX_PAGE_SIZE = 500
+
+
+def _expert_student_row(v, include_history):
+    row = {
+        'student_id': v['student_id'],
+        'student_name': f"{v['student__last_name']} {v['student__first_name']}",
+        'class_name': v['class_name'],
+        'level': v['academic_year_level'],
+        'residual': v['residual'],
+        'status_pattern': v['status_pattern'],
+        'current_avg': v['current_avg'],
+        'predicted_avg': v['predicted_avg'],
+        'traffic_light': v['traffic_light'],
+        'net_value_added': v['net_value_added'],
+        'z_score': v['z_score'],
+    }
+    if include_history:
+        row['trend_history'] = v['trend_history']
+    return row
+
+
+def _expert_cohort_rows(run, levels):
+    cohort_qs = CohortExpertData.objects.filter(run=run)
+    if levels is not None:
+        cohort_qs = cohort_qs.filter(academic_year_level__in=levels)
+    return [{
+        'level': c.academic_year_level,
+        'correlation_matrix': c.correlation_matrix,
+        'current_year_z_score_avg': c.current_year_z_score_avg,
+        'last_year_z_score_avg': c.last_year_z_score_avg,
+        'last_year_raw_avg': getattr(c, 'last_year_raw_avg', None),
+        'cohort_effect_analysis': c.cohort_effect_analysis,
+        'sensitivity_betas': c.sensitivity_betas,
+        'ruling_subject': c.ruling_subject
+    } for c in cohort_qs]
+
+
 @login_required
 def api_expert_data(request):
     """
     Returns the pre-calculated expert data for the dashboard.
+
+    Optional query parameters:
+    - level, traffic_light, status_pattern, class_name, student_id: filters
+    - sort: one of EXPERT_SORT_FIELDS, prefix with '-' for descending
+    - include_history=0: omit each student's trend_history
+    - page / page_size: paginate the students (cohorts are returned with every page)
+    - format=ndjson: stream one JSON object per line: a header line
+      ({"type": "run", "run_info", "cohorts", "total"}) then {"type": "student", ...} lines
     """
+    import json
     if not getattr(request.user, 'profile', None) or not request.user.profile.has_perm('access_analytics'):
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
 
     run_id = request.GET.get('run_id')
     level = request.GET.get('level')
+    include_history = request.GET.get('include_history', '1') not in ('0', 'false')
+
+    sort = (request.GET.get('sort') or '').strip()
+    if sort:
+        sort_fields = EXPERT_SORT_FIELDS.get(sort.lstrip('-'))
+        if sort_fields is None:
+            return JsonResponse({'status': 'error', 'message': f'Unknown sort field: {sort}'}, status=400)
+        order = [('-' + f if sort.startswith('-') else f) for f in sort_fields] + ['id']
+    else:
+        order = list(EXPERT_DEFAULT_ORDER)
+
+    page = page_size = None
+    if request.GET.get('page') or request.GET.get('page_size'):
+        try:
+            page = max(1, int(request.GET.get('page') or 1))
+            page_size = max(1, min(EXPERT_MAX_PAGE_SIZE, int(request.GET.get('page_size') or 100)))
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid page'}, status=400)
+    if request.GET.get('student_id') and not request.GET['student_id'].isdigit():
+        return JsonResponse({'status': 'error', 'message': 'Invalid student_id'}, status=400)
 
     if not run_id:
         latest_run = ExpertAnalysisRun.objects.filter(status='completed').order_by('-run_date').first()
@@ -91,57 +193,60 @@ def api_expert_data(request):
     try:
         run = ExpertAnalysisRun.objects.get(id=run_id)
 
-        # 1. Fetch Students Data
+        # Exact level values let the (run, academic_year_level) index serve the filter
+        levels = levels_matching(run, level) if level else None
+
+        # 1. Students: one query via .values() (student name joined in), no per-row lookups
         students_qs = StudentExpertData.objects.filter(run=run)
-        if level:
-            students_qs = students_qs.filter(academic_year_level__icontains=level)
-
-        students_data = []
-        for s in students_qs:
-            students_data.append({
-                'student_id': (s.student_id if s.student else None),
-                'student_name': (s.student.full_name if s.student else '—'),
-                'class_name': s.class_name,
-                'level': s.academic_year_level,
-                'residual': s.residual,
-                'status_pattern': s.status_pattern,
-                'current_avg': s.current_avg,
-                'predicted_avg': s.predicted_avg,
-                'traffic_light': s.traffic_light,
-                'net_value_added': s.net_value_added,
-                'z_score': s.z_score,
-                'trend_history': s.trend_history
-            })
-
-        # 2. Fetch Cohort Data
-        cohort_qs = CohortExpertData.objects.filter(run=run)
-        if level:
-            cohort_qs = cohort_qs.filter(academic_year_level__icontains=level)
-
-        cohort_data = []
-        for c in cohort_qs:
-            cohort_data.append({
-                'level': c.academic_year_level,
-                'correlation_matrix': c.correlation_matrix,
-                'current_year_z_score_avg': c.current_year_z_score_avg,
-                'last_year_z_score_avg': c.last_year_z_score_avg,
-                'last_year_raw_avg': getattr(c, 'last_year_raw_avg', None),
-                'cohort_effect_analysis': c.cohort_effect_analysis,
-                'sensitivity_betas': c.sensitivity_betas,
-                'ruling_subject': c.ruling_subject
-            })
+        if levels is not None:
+            students_qs = students_qs.filter(academic_year_level__in=levels)
+        for param, field in (('traffic_light', 'traffic_light'), ('status_pattern', 'status_pattern'),
+                             ('class_name', 'class_name'), ('student_id', 'student_id')):
+            value = request.GET.get(param)
+            if value:
+                students_qs = students_qs.filter(**{field: value})
+        fields = EXPERT_STUDENT_FIELDS + (('trend_history',) if include_history else ())
+        students_qs = students_qs.order_by(*order).values(*fields)
+
+        run_info = {
+            'id': run.id,
+            'date': run.run_date.strftime('%Y-%m-%d %H:%M'),
+            'academic_year': run.academic_year,
+            'term': run.term
+        }
+        # 2. Cohorts (one row per level)
+        cohort_data = _expert_cohort_rows(run, levels)
 
-        return JsonResponse({
+        if request.GET.get('format') == 'ndjson':
+            total = students_qs.count()
+
+            def stream():
+                yield json.dumps({'type': 'run', 'run_info': run_info, 'cohorts': cohort_data, 'total': total},
+                                 ensure_ascii=False) + '\n'
+                for v in students_qs.iterator(chunk_size=1000):
+                    row = _expert_student_row(v, include_history)
+                    row['type'] = 'student'
+                    yield json.dumps(row, ensure_ascii=False) + '\n'
+
+            return StreamingHttpResponse(stream(), content_type='application/x-ndjson; charset=utf-8')
+
+        payload = {
             'status': 'success',
-            'run_info': {
-                'id': run.id,
-                'date': run.run_date.strftime('%Y-%m-%d %H:%M'),
-                'academic_year': run.academic_year,
-                'term': run.term
-            },
-            'students': students_data,
-            'cohorts': cohort_data
-        })
+            'run_info': run_info,
+            'cohorts': cohort_data,
+        }
+        if page is not None:
+            total = students_qs.count()
+            offset = (page - 1) * page_size
+            rows = students_qs[offset:offset + page_size]
+            payload['pagination'] = {
+                'page': page, 'page_size': page_size, 'total': total,
+                'pages': (total + page_size - 1) // page_size,
+            }
+        else:
+            rows = students_qs.iterator(chunk_size=1000)
+        payload['students'] = [_expert_student_row(v, include_history) for v in rows]
+        return JsonResponse(payload)
 
     except ExpertAnalysisRun.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Run not found'}, status=404)
@@ -196,13 +301,7 @@ def api_expert_student_term_grades(request):
             return s
 
         level = _normalize_level_key(level_raw)
-        settings = SchoolSettings.objects.order_by('-id').first()
-        coefs_by_level = getattr(settings, 'subject_coefficients_by_level', {}) if settings else {}
-        if isinstance(coefs_by_level, str):
-            try:
-                coefs_by_level = json.loads(coefs_by_level) or {}
-            except Exception:
-                coefs_by_level = {}
+        coefs_by_level = get_subject_coefficients_by_level()
 
         coefs_raw = {}
         if isinstance(coefs_by_level, dict):
@@ -385,8 +484,7 @@ def api_expert_get_subject_coefficients(request):
     if not getattr(request.user, 'profile', None) or not request.user.profile.has_perm('access_analytics'):
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
     from .import_utils import get_deduplicated_subjects_from_grades
-    settings = SchoolSettings.objects.first()
-    coefs = getattr(settings, 'subject_coefficients_by_level', None) or {}
+    coefs = get_subject_coefficients_by_level()
     subjects_list = get_deduplicated_subjects_from_grades()
     return JsonResponse({'status': 'success', 'coefficients': coefs, 'subjects': subjects_list})
 
@@ -547,7 +645,7 @@ def api_import_historical_expert_data(request):
 
         from .import_utils import extract_rows_from_file
         from .models import Student, HistoricalStudent, HistoricalGrade, HistoricalImportFile, Grade, SchoolSettings
-        from .expert_import_utils import find_student_advanced, parse_date, normalize_gender
+        from .expert_import_utils import StudentMatchIndex, parse_date, normalize_gender
         import re
 
         # المطابقة مع التلاميذ الموجودين في ملف النتائج للسنة الحالية (من إعدادات المؤسسة)
@@ -573,6 +671,8 @@ def api_import_historical_expert_data(request):
                 'status': 'error',
                 'message': f"لا يوجد تلاميذ في لوحة تحليل النتائج للسنة الحالية. يرجى استيراد العلامات من لوحة تحليل النتائج (Executive) أولاً، ثم إعادة محاولة استيراد ملفات السنوات السابقة هنا."
             }, status=400)
+        # فهرس المطابقة يُبنى مرة واحدة لكل الملفات المرفوعة
+        student_matcher = StudentMatchIndex(current_students_list)
 
         total_students_processed = 0
         total_grades_added = 0
@@ -710,8 +810,7 @@ def api_import_historical_expert_data(request):
                     if not last_name and not first_name: continue
 
                     # البحث بالتطابق المتقدم في تلاميذ السنة الحالية (ملف النتائج)
-                    current_student = find_student_advanced(
-                        current_students_list,
+                    current_student = student_matcher.find(
                         last_name=last_name,
                         first_name=first_name,
                         date_of_birth=file_dob,
@@ -112,11 +112,18 @@ def find_student_advanced(candidates, last_name, first_name, date_of_birth=None,
     # تحويل إلى قائمة إن كان QuerySet
     cand_list = list(candidates) if hasattr(candidates, '__iter__') and not isinstance(candidates, (list, tuple)) else candidates
 
+    matches = [
+        s for s in cand_list
+        if _names_match(last_name, first_name, getattr(s, 'last_name', ''), getattr(s, 'first_name', ''))
+    ]
+    return _pick_match(matches, date_of_birth, gender)
+
+
+def _pick_match(matches, date_of_birth=None, gender=None):
+    """اختيار التلميذ من المطابقات الاسمية (بترتيب المرشحين) حسب تاريخ الميلاد والجنس."""
     # فلترة أولية بالجنس وتاريخ الميلاد إن وُجدا
     filtered = []
-    for s in cand_list:
-        if not _names_match(last_name, first_name, getattr(s, 'last_name', ''), getattr(s, 'first_name', '')):
-            continue
+    for s in matches:
         # التحقق من تاريخ الميلاد
         if date_of_birth:
             sdob = getattr(s, 'date_of_birth', None)
@@ -143,8 +150,79 @@ def find_student_advanced(candidates, last_name, first_name, date_of_birth=None,
                 return s
         return filtered[0]  # أي مطابقة
 
-    # إن لم نجد بعد الفلترة، نبحث بدون dob/gender (مطابقة اسمية فقط)
-    for s in cand_list:
-        if _names_match(last_name, first_name, getattr(s, 'last_name', ''), getattr(s, 'first_name', '')):
-            return s
-    return None
+    # إن لم نجد بعد الفلترة، نكتفي بالمطابقة الاسمية فقط
+    return matches[0] if matches else None
+
+
+MIN_CONTAINED_LENGTH = 4
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class StudentMatchIndex:
+    """
+    فهرس مطابقة يُبنى مرة واحدة لكل طلب استيراد، ويعطي نفس نتيجة find_student_advanced
+    بدون مقارنة كل صف بكل المرشحين:
+    - التطابقات التامة (الاسم الكامل بعد التطبيع، المعكوس، اللقب/الاسم المتبادلان): قواميس.
+    - الاحتواء (أحد الاسمين داخل الآخر): مجموعة مرشحين صغيرة من فهرس الثلاثيات (trigrams)
+      ثم تحقق نصي عليها فقط.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        self._full = {}        # الاسم الكامل بعد التطبيع -> مواضع
+        self._raw_full = {}    # الاسم الكامل الخام -> مواضع
+        self._parts = {}       # (لقب، اسم) بعد التطبيع -> مواضع
+        self._grams = {}       # ثلاثية -> مواضع (للأسماء الطويلة بما يكفي للاحتواء)
+        self._norm_full = []
+        self._gram_count = []
+        for pos, s in enumerate(self.candidates):
+            ln = normalize_name_part(getattr(s, 'last_name', ''))
+            fn = normalize_name_part(getattr(s, 'first_name', ''))
+            full = f"{ln} {fn}".strip()
+            n_full = normalize_arabic(full)
+            self._full.setdefault(n_full, []).append(pos)
+            self._raw_full.setdefault(full, []).append(pos)
+            self._parts.setdefault((normalize_arabic(ln), normalize_arabic(fn)), []).append(pos)
+            grams = _trigrams(n_full) if len(n_full) >= MIN_CONTAINED_LENGTH else set()
+            for g in grams:
+                self._grams.setdefault(g, []).append(pos)
+            self._norm_full.append(n_full)
+            self._gram_count.append(len(grams))
+
+    def match_positions(self, last_name, first_name):
+        """مواضع المرشحين الذين يطابقهم _names_match (مرتبة)."""
+        ln = normalize_name_part(last_name)
+        fn = normalize_name_part(first_name)
+        if not ln and not fn:
+            return []
+        full = f"{ln} {fn}".strip()
+        n_full = normalize_arabic(full)
+        hits = set(self._full.get(n_full, ()))
+        hits.update(self._raw_full.get(f"{fn} {ln}".strip(), ()))
+        hits.update(self._parts.get((normalize_arabic(fn), normalize_arabic(ln)), ()))
+
+        if len(n_full) >= MIN_CONTAINED_LENGTH:
+            grams = _trigrams(n_full)
+            # الاسم المبحوث داخل اسم المرشح: كل ثلاثياته عند المرشح، فتكفي أندر ثلاثية
+            rarest = min(grams, key=lambda g: len(self._grams.get(g, ())))
+            hits.update(p for p in self._grams.get(rarest, ()) if n_full in self._norm_full[p])
+            # اسم المرشح داخل الاسم المبحوث: كل ثلاثيات المرشح ضمن ثلاثيات الاسم
+            shared = {}
+            for g in grams:
+                for p in self._grams.get(g, ()):
+                    shared[p] = shared.get(p, 0) + 1
+            hits.update(
+                p for p, n in shared.items()
+                if n == self._gram_count[p] and self._norm_full[p] in n_full
+            )
+        return sorted(hits)
+
+    def find(self, last_name, first_name, date_of_birth=None, gender=None):
+        """نفس find_student_advanced على المرشحين المفهرسين."""
+        if not last_name and not first_name:
+            return None
+        matches = [self.candidates[p] for p in self.match_positions(last_name, first_name)]
+        return _pick_match(matches, date_of_birth, gender)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+مشغّل مهام محرك الخبراء.
+
+- كل طلب تشغيل يصبح صفاً في ExpertJob (الجدول مرئي لكل العمليات، بخلاف LocMemCache).
+- الطلبات المتطابقة (السنة، الفصل، السنوات السابقة) تُدمج في مهمة نشطة واحدة
+  (قيد فريد شرطي على dedupe_key).
+- عدد المحركات العاملة في نفس الوقت محدود بـ MAX_RUNNING_ENGINES عبر كل العمليات:
+  المهمة تحجز "خانة" (حقل slot فريد) قبل التشغيل.
+- كل عملية تملك مجمع خيوط محدوداً (POOL_SIZE) يسحب المهام المنتظرة من الجدول.
+- المحرك يبلّغ عن تقدمه بين المراحل؛ كل تبليغ يحدّث النسبة والنبضة ويتحقق من طلب
+  الإلغاء (إلغاء تعاوني عبر ExpertEngineCancelled).
+- مهمة "قيد التشغيل" بدون نبضة منذ STALE_AFTER تُعتبر متوقفة (توقف العملية) وتُحرَّر خانتها.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time as _time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .expert_utils import ExpertEngineCancelled, run_expert_engine
+from .models import ExpertJob
+
+logger = logging.getLogger(__name__)
+
+MAX_RUNNING_ENGINES = getattr(settings, 'EXPERT_MAX_RUNNING_ENGINES', 1)
+POOL_SIZE = 1
+# أقل مدة (ثواني) بين كتابتين للتقدم في القاعدة ما لم تتغير النسبة
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 600
+CLAIM_POLL_INTERVAL = 3
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+_lock = threading.Lock()
+_executor = None
+_active_drains = 0
+
+
+def make_dedupe_key(academic_year, term, prev_years):
+    return json.dumps([academic_year, term, list(prev_years)], ensure_ascii=False)
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'stage': job.stage,
+        'message': job.message,
+        'academic_year': job.academic_year,
+        'term': job.term,
+        'cancel_requested': job.cancel_requested,
+        'run_id': job.run_id,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M') if job.created_at else None,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M') if job.finished_at else None,
+    }
+
+
+def enqueue_expert_job(academic_year, term, prev_year, prev_years_extra=None, user=None):
+    """
+    إضافة مهمة للطابور، أو إرجاع المهمة النشطة المطابقة إن وُجدت.
+    يرجع (job, created).
+    """
+    prev_years = [prev_year] + list(prev_years_extra or [])
+    key = make_dedupe_key(academic_year, term, prev_years)
+
+    job = ExpertJob.objects.filter(dedupe_key=key, status__in=ExpertJob.ACTIVE_STATUSES).first()
+    if job is None:
+        try:
+            with transaction.atomic():
+                job = ExpertJob.objects.create(
+                    academic_year=academic_year, term=term, prev_years=prev_years, dedupe_key=key,
+                    requested_by=user if user is not None and user.is_authenticated else None,
+                )
+        except IntegrityError:
+            # طلب متزامن من عملية أخرى سبقنا
+            job = ExpertJob.objects.filter(dedupe_key=key, status__in=ExpertJob.ACTIVE_STATUSES).first()
+            if job is None:
+                raise
+        else:
+            transaction.on_commit(kick)
+            return job, True
+    kick()
+    return job, False
+
+
+def cancel_expert_job(job_id):
+    """إلغاء مهمة: فوري إن كانت منتظرة، وإلا يُطلب من المحرك التوقف عند أقرب مرحلة."""
+    now = timezone.now()
+    if ExpertJob.objects.filter(pk=job_id, status=ExpertJob.STATUS_QUEUED).update(
+        status=ExpertJob.STATUS_CANCELLED, cancel_requested=True, finished_at=now, stage='ملغاة',
+    ):
+        return True
+    return bool(ExpertJob.objects.filter(pk=job_id, status=ExpertJob.STATUS_RUNNING).update(cancel_requested=True))
+
+
+def reap_stale_jobs():
+    """تحرير خانات المهام التي توقفت عمليتها (بدون نبضة منذ STALE_AFTER)."""
+    cutoff = timezone.now() - timedelta(seconds=STALE_AFTER)
+    return ExpertJob.objects.filter(status=ExpertJob.STATUS_RUNNING, heartbeat_at__lt=cutoff).update(
+        status=ExpertJob.STATUS_FAILED, slot=None, finished_at=timezone.now(),
+        message='توقفت العملية المنفذة قبل انتهاء المهمة',
+    )
+
+
+def claim_next_job():
+    """حجز أقدم مهمة منتظرة إن توفرت خانة تشغيل. يرجع المهمة أو None."""
+    reap_stale_jobs()
+    job = ExpertJob.objects.filter(status=ExpertJob.STATUS_QUEUED).order_by('created_at', 'id').first()
+    if job is None:
+        return None
+    now = timezone.now()
+    for slot in range(1, MAX_RUNNING_ENGINES + 1):
+        try:
+            with transaction.atomic():
+                claimed = ExpertJob.objects.filter(pk=job.pk, status=ExpertJob.STATUS_QUEUED).update(
+                    status=ExpertJob.STATUS_RUNNING, slot=slot, started_at=now, heartbeat_at=now,
+                    worker=WORKER_ID, stage='بدء التشغيل', progress=0,
+                )
+        except IntegrityError:
+            continue  # الخانة مشغولة
+        if not claimed:
+            return None  # سبقتنا عملية أخرى أو أُلغيت المهمة
+        job.refresh_from_db()
+        return job
+    return None
+
+
+class _ProgressReporter:
+    """callback التقدم الممرَّر إلى run_expert_engine."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.run_id = None
+        self._last_percent = None
+        self._last_write = 0.0
+
+    def __call__(self, percent, stage, run=None):
+        changed = run is not None or percent != self._last_percent
+        if run is not None:
+            self.run_id = run.pk
+        if not changed and _time.monotonic() - self._last_write < HEARTBEAT_INTERVAL:
+            return
+        fields = {'progress': max(0, min(100, int(percent))), 'stage': stage[:100], 'heartbeat_at': timezone.now()}
+        if self.run_id is not None:
+            fields['run_id'] = self.run_id
+        # التحديث مشروط بعدم طلب الإلغاء (وبعدم تحرير المهمة كمتوقفة): 0 صفوف = توقف
+        if not ExpertJob.objects.filter(
+            pk=self.job_id, status=ExpertJob.STATUS_RUNNING, cancel_requested=False,
+        ).update(**fields):
+            raise ExpertEngineCancelled()
+        self._last_percent = percent
+        self._last_write = _time.monotonic()
+
+
+def run_job(job):
+    """تشغيل مهمة محجوزة (status=running) حتى النهاية وتحرير خانتها."""
+    reporter = _ProgressReporter(job.pk)
+    prev_years = list(job.prev_years or [None])
+    fields = {}
+    try:
+        ok = run_expert_engine(
+            job.academic_year, job.term, prev_years[0], prev_years_extra=prev_years[1:], progress=reporter,
+        )
+        if ok:
+            fields = {'status': ExpertJob.STATUS_COMPLETED, 'progress': 100, 'stage': 'اكتمل التحليل'}
+        else:
+            fields = {'status': ExpertJob.STATUS_FAILED, 'message': 'فشل المحرك (راجع حالة التشغيلة)'}
+    except ExpertEngineCancelled:
+        fields = {'status': ExpertJob.STATUS_CANCELLED, 'stage': 'ملغاة'}
+    except Exception as e:
+        logger.exception('Expert job %s failed', job.pk)
+        fields = {'status': ExpertJob.STATUS_FAILED, 'message': str(e)}
+    if reporter.run_id is not None:
+        fields['run_id'] = reporter.run_id
+    ExpertJob.objects.filter(pk=job.pk).update(slot=None, finished_at=timezone.now(), **fields)
+    return fields['status']
+
+
+def run_pending_jobs(wait=True):
+    """
+    تشغيل المهام المنتظرة واحدة تلو الأخرى.
+    wait=True: عند انشغال كل الخانات (محرك يعمل في عملية أخرى) ننتظر ثم نعيد المحاولة.
+    """
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if not wait or not ExpertJob.objects.filter(status=ExpertJob.STATUS_QUEUED).exists():
+                return count
+            _time.sleep(CLAIM_POLL_INTERVAL)
+            continue
+        run_job(job)
+        count += 1
+
+
+def _drain():
+    global _active_drains
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception('Expert job runner crashed')
+    finally:
+        connection.close()
+        with _lock:
+            _active_drains -= 1
+
+
+def kick():
+    """إيقاظ مجمع الخيوط المحلي لسحب المهام المنتظرة (بدون تجاوز POOL_SIZE)."""
+    global _executor, _active_drains
+    with _lock:
+        if _active_drains >= POOL_SIZE:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='expert-job')
+        _active_drains += 1
+        _executor.submit(_drain)
@@ -1,56 +1,188 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
-from sklearn.linear_model import LinearRegression
 import logging
 import json
-from .models import Grade, Student, ExpertAnalysisRun, StudentExpertData, CohortExpertData, HistoricalGrade, SchoolSettings
-from .import_utils import standardize_subject_name
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from .expert_compute import analyze_level
+from .models import Grade, Student, ExpertAnalysisRun, StudentExpertData, CohortExpertData, HistoricalGrade
+from .settings_utils import get_subject_coefficients_by_level
+from .import_utils import standardize_subject_name, standardize_subject_series
 
 logger = logging.getLogger(__name__)
 
 
-def _weighted_avg_per_row(row_series, coef_dict):
-    """متوسط مرجح لصف (سلسلة قيم المواد). coef_dict: {اسم_المادة: معامل}."""
-    if not coef_dict or row_series.empty:
-        return float(row_series.mean()) if not row_series.empty else 0.0
-    total = 0.0
-    wsum = 0.0
-    for subj, val in row_series.items():
-        if pd.isna(val):
-            continue
-        w = float(coef_dict.get(subj, 1.0))
-        total += val * w
-        wsum += w
-    return total / wsum if wsum > 0 else float(row_series.mean()) if not row_series.empty else 0.0
-
-
-def _term_weighted_avg(df_term, coef_dict):
-    """معدل فصلي مرجح لجدول (student, subject, score) لفصل واحد. يرجع عدد واحد."""
-    if df_term.empty:
-        return 0.0
-    if not coef_dict:
-        return float(df_term['score'].mean())
-    total = 0.0
-    wsum = 0.0
-    for _, row in df_term.iterrows():
-        s = row.get('subject')
-        sc = row.get('score', 0)
-        if pd.isna(sc):
-            continue
-        w = float(coef_dict.get(s, 1.0))
-        total += sc * w
-        wsum += w
-    return total / wsum if wsum > 0 else float(df_term['score'].mean())
-
-def run_expert_engine(current_academic_year, current_term, prev_academic_year, prev_years_extra=None):
+class ExpertEngineCancelled(Exception):
+    """يرفعها callback التقدم لإيقاف المحرك (إلغاء تعاوني، انظر expert_jobs)."""
+
+
+# يُرفع عند تغيير طريقة الحساب حتى لا تُنقل نتائج محسوبة بالطريقة القديمة
+ENGINE_VERSION = 1
+
+# حجم دفعات bulk_create عند حفظ نتائج تشغيلة
+BULK_BATCH_SIZE = 500
+# عدد التشغيلات المكتملة المحتفظ بها لكل (سنة، فصل)؛ None = بدون حذف
+DEFAULT_RUNS_TO_KEEP = 3
+
+
+def _frame_digest(df):
+    """بصمة محتوى إطار بيانات لا تتأثر بترتيب الصفوف."""
+    if df is None or df.empty:
+        return 'empty'
+    df = df[sorted(df.columns)].astype(str)
+    row_hashes = np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+
+def _level_input_hashes(df_level_curr, df_level_prev, df_prev, df_curr_with_avg, coefs, params):
+    """
+    بصمات مدخلات مستوى واحد: علامات السنة الحالية لكل فصل، علامات المستوى السابقة،
+    السجل السابق لتلاميذ المستوى، سطور "المعدل" الجاهزة، المعاملات ومعطيات التشغيل.
+    """
+    keys = set(df_level_curr['_match_key'])
+    hashes = {
+        'params': hashlib.sha256(
+            json.dumps([ENGINE_VERSION] + list(params) + sorted(coefs.items()), ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest(),
+        'prev_level': _frame_digest(df_level_prev),
+    }
+    for term, grp in df_level_curr.groupby('term'):
+        hashes[f'curr:{term}'] = _frame_digest(grp)
+    if not df_prev.empty and '_match_key' in df_prev.columns:
+        hashes['prev_students'] = _frame_digest(df_prev[df_prev['_match_key'].map(keys.__contains__)])
+    if df_curr_with_avg is not None and '_match_key' in df_curr_with_avg.columns:
+        subj = df_curr_with_avg['subject'].fillna('').astype(str).str.strip()
+        avg_rows = df_curr_with_avg[(subj.str.startswith('معدل') | subj.str.startswith('المعدل'))]
+        hashes['avg_rows'] = _frame_digest(avg_rows[avg_rows['_match_key'].map(keys.__contains__)])
+    return hashes
+
+
+def _carry_forward_level(base_cohort, run_record):
+    """
+    نسخ نتائج مستوى لم تتغير مدخلاته من تشغيلة سابقة إلى التشغيلة الجديدة.
+    يرجع (صف الفوج، صفوف التلاميذ) غير محفوظة؛ تُحفظ مع بقية التشغيلة في _save_run_rows.
+    """
+    level = base_cohort.academic_year_level
+    base_run_id = base_cohort.run_id
+    base_cohort.pk = None
+    base_cohort.run = run_record
+    students = list(StudentExpertData.objects.filter(run_id=base_run_id, academic_year_level=level))
+    for row in students:
+        row.pk = None
+        row.run = run_record
+    return base_cohort, students
+
+
+def _save_run_rows(run_record, cohorts, students):
+    """حفظ كل صفوف التشغيلة بدفعات bulk_create داخل معاملة واحدة، ثم تعليمها كمكتملة."""
+    with transaction.atomic():
+        CohortExpertData.objects.bulk_create(cohorts, batch_size=BULK_BATCH_SIZE)
+        StudentExpertData.objects.bulk_create(students, batch_size=BULK_BATCH_SIZE)
+        run_record.status = 'completed'
+        run_record.save(update_fields=['status'])
+
+
+def prune_expert_runs(academic_year, term, keep=None):
+    """
+    حذف التشغيلات القديمة لـ (سنة، فصل) مع الاحتفاظ بآخر keep تشغيلة مكتملة
+    (افتراضياً EXPERT_RUNS_TO_KEEP). التشغيلات غير المكتملة الأقدم من آخر تشغيلة محتفظ بها تُحذف أيضاً.
+    الحذف بالجملة (صفوف التلاميذ والأفواج ثم التشغيلات). يرجع عدد التشغيلات المحذوفة.
+    """
+    if keep is None:
+        keep = getattr(settings, 'EXPERT_RUNS_TO_KEEP', DEFAULT_RUNS_TO_KEEP)
+    if keep is None:
+        return 0
+    keep = max(1, int(keep))
+    runs = ExpertAnalysisRun.objects.filter(academic_year=academic_year, term=term)
+    kept = list(runs.filter(status='completed').order_by('-run_date', '-id').values_list('id', 'run_date')[:keep])
+    if len(kept) < keep:
+        return 0
+    oldest_id, oldest_date = kept[-1]
+    stale = list(
+        runs.exclude(id__in=[pk for pk, _ in kept])
+        .filter(Q(run_date__lt=oldest_date) | Q(run_date=oldest_date, id__lt=oldest_id))
+        .values_list('id', flat=True)
+    )
+    if not stale:
+        return 0
+    with transaction.atomic():
+        StudentExpertData.objects.filter(run_id__in=stale).delete()
+        CohortExpertData.objects.filter(run_id__in=stale).delete()
+        ExpertAnalysisRun.objects.filter(id__in=stale).delete()
+    return len(stale)
+
+
+def levels_matching(run, level):
+    """
+    المستويات المخزنة في التشغيلة التي تحتوي النص level (نفس منطق icontains السابق)،
+    لتصفية النتائج بـ academic_year_level__in عبر الفهرس (run, academic_year_level).
+    """
+    needle = str(level).strip().casefold()
+    stored = (
+        StudentExpertData.objects.filter(run=run)
+        .order_by().values_list('academic_year_level', flat=True).distinct()
+    )
+    return sorted({lvl for lvl in stored if needle in lvl.casefold()})
+
+
+def _rows_for_keys(df, keys):
+    """سطور إطار البيانات التي ينتمي مفتاح مطابقتها إلى keys."""
+    if df is None or df.empty or '_match_key' not in df.columns:
+        return df
+    return df[df['_match_key'].map(keys.__contains__)]
+
+
+def _engine_workers(task_count, row_count):
+    """
+    عدد العمليات لتحليل المستويات المتغيرة: EXPERT_ENGINE_WORKERS (افتراضياً عدد الأنوية).
+    تشغيل تسلسلي لمستوى واحد أو لبيانات صغيرة (أقل من EXPERT_PARALLEL_MIN_ROWS سطر)
+    حيث تكلفة تشغيل العمليات ونقل البيانات أكبر من الربح.
+    """
+    if task_count < 2 or row_count < getattr(settings, 'EXPERT_PARALLEL_MIN_ROWS', 5000):
+        return 1
+    workers = getattr(settings, 'EXPERT_ENGINE_WORKERS', None) or os.cpu_count() or 1
+    return max(1, min(int(workers), task_count))
+
+
+def _analyze_levels_in_pool(task_kwargs, workers):
+    """
+    تشغيل analyze_level لكل مستوى في عملية منفصلة (سياق spawn: لا نرث اتصالات القاعدة).
+    يولّد (level, result) بترتيب الانتهاء؛ عند التوقف (إلغاء/خطأ) تُلغى المستويات المنتظرة.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {pool.submit(analyze_level, **kw): kw['level'] for kw in task_kwargs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def run_expert_engine(current_academic_year, current_term, prev_academic_year, prev_years_extra=None, progress=None, incremental=True):
     """
     Deep Expert Analysis Engine.
 
     مراجع الحسابات:
     - السنة الحالية: من Grade (لوحة تحليل النتائج). نستخدم آخر فصل دراسي متاح.
     - السنوات الماضية: من HistoricalGrade (استيراد نتائج سابقة في تحليل الخبراء).
+
+    progress: callback اختياري progress(percent, stage, run=None) يُستدعى بين المراحل؛
+    قد يرفع ExpertEngineCancelled لإيقاف التشغيل.
+    incremental: المستويات التي لم تتغير مدخلاتها (بصمة المحتوى) منذ آخر تشغيلة مكتملة لنفس
+    السنة تُنقل نتائجها كما هي بدل إعادة حسابها.
+    المستويات المتبقية تُحلَّل بالتوازي في مجمع عمليات (انظر _engine_workers) ثم تُدرج نتائجها
+    دفعة واحدة لكل مستوى؛ عند تعذر المجمع يكمل التحليل تسلسلياً.
     """
+    def report(percent, stage, **kwargs):
+        if progress is not None:
+            progress(percent, stage, **kwargs)
+
     historical_years = [prev_academic_year] + (prev_years_extra or [])
     logger.info(f"Starting Expert Engine: {current_academic_year} {current_term} vs {historical_years}")
 
@@ -74,6 +206,7 @@ def run_expert_engine(current_academic_year, current_term, prev_academic_year, p
             term=effective_term,
             status='running'
         )
+        report(5, 'تحميل العلامات', run=run_record)
 
         # 2. Fetch previous years grades (من استيراد تحليل الخبراء فقط)
         prev_grades = HistoricalGrade.objects.filter(historical_year__in=historical_years).select_related('student')
@@ -91,16 +224,16 @@ def run_expert_engine(current_academic_year, current_term, prev_academic_year, p
             return False
 
         # Clean data (remove zeros and negative scores if they represent absence)
-        df_curr = df_curr[df_curr['score'] > 0]
+        df_curr = df_curr_all[df_curr_all['score'] > 0]
         if not df_prev.empty:
             df_prev = df_prev[df_prev['score'] > 0]
 
         # توحيد أسماء المواد لتفادي تشتت نفس المادة (فراغ/همزات/تاء...)
         df_curr = df_curr.copy()
-        df_curr['subject'] = df_curr['subject'].apply(standardize_subject_name)
+        df_curr['subject'] = standardize_subject_series(df_curr['subject'])
         if not df_prev.empty:
             df_prev = df_prev.copy()
-            df_prev['subject'] = df_prev['subject'].apply(standardize_subject_name)
+            df_prev['subject'] = standardize_subject_series(df_prev['subject'])
 
         # احتفظ بنسخة تتضمن سطور "المعدل ..." للاستفادة منها كمعدل جاهز من ملف Excel
         df_curr_with_avg = df_curr.copy()
@@ -139,14 +272,8 @@ def run_expert_engine(current_academic_year, current_term, prev_academic_year, p
                     break
             return s
 
-        settings = SchoolSettings.objects.order_by('-id').first()
-        all_coefs = getattr(settings, 'subject_coefficients_by_level', None) or {}
-        # أحياناً تُخزن كـ JSON نصي
-        if isinstance(all_coefs, str):
-            try:
-                all_coefs = json.loads(all_coefs) or {}
-            except Exception:
-                all_coefs = {}
+        # مُحلَّلة مسبقاً في settings_utils (قد تُخزن أحياناً كـ JSON نصي)
+        all_coefs = get_subject_coefficients_by_level()
         # بنِ قاموس معاملات بمفاتيح مستويات موحدة لتفادي عدم التطابق
         all_coefs_norm = {}
         if isinstance(all_coefs, dict):
@@ -180,8 +307,30 @@ def run_expert_engine(current_academic_year, current_term, prev_academic_year, p
         except Exception:
             pass
 
+        # آخر تشغيلة مكتملة لنفس السنة: مصدر نتائج المستويات غير المتغيرة
+        base_cohorts = {}
+        if incremental:
+            base_run = ExpertAnalysisRun.objects.filter(
+                academic_year=current_academic_year, status='completed'
+            ).exclude(pk=run_record.pk).order_by('-run_date', '-id').first()
+            if base_run is not None:
+                base_cohorts = {c.academic_year_level: c for c in base_run.cohort_data.all()}
+        run_params = [current_academic_year, prev_academic_year, effective_term, historical_years]
+        carried_levels = []
+        # صفوف التشغيلة (المنقولة والمحسوبة) تُحفظ دفعة واحدة في النهاية
+        cohort_rows = []
+        student_rows = []
+        # المستويات المتغيرة: (level, input_hashes, مدخلات analyze_level)
+        tasks = []
+        # سطور "المعدل ..." فقط (هي ما يُبحث عنه في df_curr_with_avg أثناء التحليل)
+        subj_avg = df_curr_with_avg['subject'].fillna('').astype(str).str.strip()
+        avg_rows = df_curr_with_avg[subj_avg.str.startswith('معدل') | subj_avg.str.startswith('المعدل')]
+
+        report(20, 'تحضير البيانات')
+
         # Group data by level for Cohort Analysis
-        for level in levels:
+        for level_idx, level in enumerate(levels):
+            level_start = 20 + 5 * level_idx / len(levels)
             level_key = _normalize_level_key(level)
             # جرب مفاتيح متعددة: كما هي + مطبّعة
             coefs_raw = {}
@@ -210,280 +359,78 @@ def run_expert_engine(current_academic_year, current_term, prev_academic_year, p
             if not df_prev.empty:
                 df_level_prev = df_prev[df_prev['student__academic_year'] == level].copy()
 
-            # --- A. Z-SCORE CALCULATION (Current Year) ---
-            # Z-Score helps unify the scale across different subjects and teachers.
-            # We calculate Z-Score per subject within the level.
-            df_level_curr['z_score'] = df_level_curr.groupby('subject')['score'].transform(lambda x: stats.zscore(x, ddof=1) if len(x) > 1 and x.std() > 0 else 0)
-
-            # --- B. CORRELATION MATRIX (Inter-Subject Heatmap) ---
-            pivot_curr = df_level_curr.pivot_table(index='student__id', columns='subject', values='score', aggfunc='mean')
-            # نحتفظ بنسب التغطية قبل التعويض
-            coverage = (1.0 - pivot_curr.isna().mean()).to_dict() if not pivot_curr.empty else {}
-            # استبعاد المواد ضعيفة التغطية أو ذات تباين معدوم (لتفادي "مادة حاكمة" غير منطقية)
-            keep_cols = []
-            for col in pivot_curr.columns:
-                cov = float(coverage.get(col, 0.0) or 0.0)
-                if cov < 0.60:
-                    continue
-                s = pivot_curr[col].dropna()
-                if len(s) < 8:
-                    continue
-                if float(s.std()) <= 1e-9:
-                    continue
-                keep_cols.append(col)
-            pivot_curr = pivot_curr[keep_cols] if keep_cols else pivot_curr
-
-            pivot_curr_filled = pivot_curr.fillna(pivot_curr.mean())
-            # إضافة عمود المعدل العام المرجح إن وُجدت معاملات المواد
-            if coefs and not pivot_curr_filled.empty:
-                pivot_curr_filled['المعدل العام'] = pivot_curr_filled.apply(lambda row: _weighted_avg_per_row(row, coefs), axis=1)
-            corr_matrix = pivot_curr_filled.corr().round(3)
-
-            # Replace NaNs in corr_matrix with 0 for JSON serialization
-            corr_matrix = corr_matrix.fillna(0)
-            corr_dict = corr_matrix.to_dict()
-
-            # --- C. SENSITIVITY ANALYSIS (Beta Coefficients) ---
-            # Multiple Regression to find the "Ruling Subject" (بيضة القبان)
-            # Dependent variable: General Average (المعدل العام) or mean of all subjects per student
-            betas = {}
-            ruling_subject = None
-
-            if 'المعدل العام' in pivot_curr_filled.columns:
-                y = pivot_curr_filled['المعدل العام']
-                X = pivot_curr_filled.drop(columns=['المعدل العام'])
-                if not X.empty and len(X.columns) > 1 and len(X) > 10:
-                    try:
-                        # معيارية X و y لجعل المقارنة بين المواد عادلة (تخفيض أثر اختلاف السلالم)
-                        Xs = (X - X.mean()) / X.std(ddof=0).replace(0, np.nan)
-                        ys = (y - y.mean()) / (y.std(ddof=0) if y.std(ddof=0) != 0 else 1.0)
-                        Xs = Xs.fillna(0.0)
-                        model = LinearRegression()
-                        model.fit(Xs, ys)
-                        for i, col in enumerate(Xs.columns):
-                            betas[col] = float(model.coef_[i])
-                        # المادة الحاكمة = أكبر تأثير مطلق (وليس أكبر موجب فقط)
-                        if betas:
-                            # ترجيح منطقي: لا نقبل مواد بمعامل ضعيف جداً إن كانت معاملات المواد متاحة
-                            candidates = list(betas.keys())
-                            if coefs and isinstance(coefs, dict):
-                                candidates = [s for s in candidates if float(coefs.get(s, 1.0)) >= 2.0]
-                                if not candidates:
-                                    candidates = [s for s in betas.keys() if float(coefs.get(s, 1.0)) >= 1.0]
-                            ruling_subject = max(candidates, key=lambda k: abs(betas.get(k, 0.0))) if candidates else max(betas, key=lambda k: abs(betas[k]))
-                    except Exception as e:
-                        logger.error(f"Error calculating sensitivity for {level}: {e}")
-            else:
-                # عند غياب عمود المعدل العام: احسب حساسية كل مادة للمعدل (انحدار بسيط: المعدل على المادة)
-                y_avg = pivot_curr_filled.mean(axis=1)
-                for col in pivot_curr_filled.columns:
-                    try:
-                        x_col = pivot_curr_filled[[col]]
-                        if x_col.notna().all().all() and len(x_col) > 1:
-                            model = LinearRegression()
-                            model.fit(x_col, y_avg)
-                            betas[col] = float(model.coef_[0])
-                    except Exception:
-                        pass
-                if betas:
-                    candidates = list(betas.keys())
-                    if coefs and isinstance(coefs, dict):
-                        candidates = [s for s in candidates if float(coefs.get(s, 1.0)) >= 2.0]
-                        if not candidates:
-                            candidates = [s for s in betas.keys() if float(coefs.get(s, 1.0)) >= 1.0]
-                    ruling_subject = max(candidates, key=lambda k: abs(betas.get(k, 0.0))) if candidates else max(betas, key=betas.get)
-
-            # --- D. COHORT EFFECT ---
-            curr_avg_z = 0.0
-            prev_avg_z = 0.0
-            last_year_raw_avg = None
-            cohort_effect = "لا توجد بيانات سابقة كافية"
-
-            if not df_level_prev.empty:
-                df_level_prev['z_score'] = df_level_prev.groupby('subject')['score'].transform(lambda x: stats.zscore(x, ddof=1) if len(x) > 1 and x.std() > 0 else 0)
-                subject_stats_prev = df_level_prev.groupby('subject')['score'].agg(['mean', 'std']).reset_index()
-                df_rel = pd.merge(df_level_curr, subject_stats_prev, on='subject', suffixes=('', '_prev'))
-                df_rel['rel_z_score'] = np.where(df_rel['std'] > 0, (df_rel['score'] - df_rel['mean']) / df_rel['std'], 0)
-                curr_avg_z = float(df_rel['rel_z_score'].mean())
-                if pd.isna(curr_avg_z): curr_avg_z = 0.0
-                prev_avg_z = 0.0  # معيار المقارنة = 0
-
-                try:
-                    if coefs:
-                        per_student_avg = df_level_prev.groupby('student__id').apply(
-                            lambda g: _term_weighted_avg(g, coefs), include_groups=False
-                        )
-                    else:
-                        per_student_avg = df_level_prev.groupby('student__id')['score'].mean()
-                    last_year_raw_avg = float(per_student_avg.mean())
-                    if pd.isna(last_year_raw_avg): last_year_raw_avg = None
-                except Exception:
-                    last_year_raw_avg = float(df_level_prev['score'].mean()) if not df_level_prev.empty else None
-
-                if curr_avg_z < -0.2:
-                    cohort_effect = "تراجع عام في المستوى (تأثير الفوج/المنهج)"
-                elif curr_avg_z > 0.2:
-                    cohort_effect = "تحسن عام في المستوى (تأثير الفوج/المنهج)"
-                else:
-                    cohort_effect = "مستوى الفوج مستقر مقارنة بالعام الماضي"
-
-            CohortExpertData.objects.create(
-                run=run_record,
-                academic_year_level=level,
-                correlation_matrix=corr_dict,
-                current_year_z_score_avg=curr_avg_z,
-                last_year_z_score_avg=prev_avg_z,
-                last_year_raw_avg=last_year_raw_avg,
-                cohort_effect_analysis=cohort_effect,
-                sensitivity_betas=betas,
-                ruling_subject=ruling_subject
-            )
-
-            # --- E. PATTERN FINDER & FUTURE FORECAST (Student Level) ---
             df_level_curr['_match_key'] = df_level_curr.apply(match_key, axis=1)
-            if not df_level_prev.empty:
-                df_level_prev['_match_key'] = df_level_prev.apply(match_key, axis=1)
-            # للمسار الفردي: مطابقة بكل السنوات والمستويات (نفس الشخص قد يكون أولى 2023 ثم ثانية 2024)
-            if not df_prev.empty:
-                df_prev = df_prev.copy()
-                df_prev['_match_key'] = df_prev.apply(match_key, axis=1)
-
-            students_in_level = df_level_curr['_match_key'].unique()
-
-            for mkey in students_in_level:
-                if mkey[0] == '' and mkey[1] == '': continue
-                student_curr = df_level_curr[df_level_curr['_match_key'] == mkey]
-                student_prev = pd.DataFrame()
-                if not df_level_prev.empty and '_match_key' in df_level_prev.columns:
-                    student_prev = df_level_prev[df_level_prev['_match_key'] == mkey]
-                # سجل التلميذ الكامل عبر كل السنوات (للمسار والتنبؤ)
-                student_prev_full = pd.DataFrame()
-                if not df_prev.empty and '_match_key' in df_prev.columns:
-                    student_prev_full = df_prev[df_prev['_match_key'] == mkey].copy()
-
-                # Combine history for trend (ترتيب زمني: الأقدم أولاً)
-                history = []
-                time_x = []
-                scores_y = []
-                term_counter = 1
-                term_order = {'الفصل الأول': 1, 'الفصل الثاني': 2, 'الفصل الثالث': 3}
-
-                # Process all previous years terms (معدل فصلي مرجح بالمعاملات)
-                if not student_prev_full.empty:
-                    prev_entries = []
-                    if 'historical_year' in student_prev_full.columns:
-                        for (yr, term_name), grp in student_prev_full.groupby(['historical_year', 'term']):
-                            avg_val = _term_weighted_avg(grp, coefs)
-                            prev_entries.append((str(yr), term_name, avg_val))
-                        prev_entries.sort(key=lambda e: (e[0], term_order.get(e[1], 99)))
-                    else:
-                        for term_name, grp in student_prev_full.groupby('term'):
-                            avg_val = _term_weighted_avg(grp, coefs)
-                            prev_entries.append((prev_academic_year, term_name, avg_val))
-                    for yr, term_name, avg_val in prev_entries:
-                        history.append({"term": f"{yr} - {term_name}", "score": round(avg_val, 2)})
-                        time_x.append(term_counter)
-                        scores_y.append(avg_val)
-                        term_counter += 1
-
-                # Process current year terms (معدل فصلي مرجح)
-                current_avg_score = 0
-                for term_name, grp in student_curr.groupby('term'):
-                    # إذا كان ملف Excel يحتوي على "المعدل ..." لهذا التلميذ/الفصل: استعمله مباشرة (أدق وموحّد مع الجدول)
-                    excel_avg_val = None
-                    try:
-                        g_all = df_curr_with_avg[
-                            (df_curr_with_avg['_match_key'] == mkey) &
-                            (df_curr_with_avg['term'] == term_name)
-                        ].copy()
-                        if not g_all.empty:
-                            subj_all = g_all['subject'].fillna('').astype(str).str.strip()
-                            g_avg = g_all[subj_all.str.startswith('معدل') | subj_all.str.startswith('المعدل')]
-                            if not g_avg.empty:
-                                excel_avg_val = float(g_avg['score'].dropna().iloc[0])
-                    except Exception:
-                        excel_avg_val = None
-
-                    avg_val = excel_avg_val if excel_avg_val is not None else _term_weighted_avg(grp, coefs)
-                    history.append({"term": f"{current_academic_year} - {term_name}", "score": round(avg_val, 2)})
-                    time_x.append(term_counter)
-                    scores_y.append(avg_val)
-                    if term_name == effective_term:
-                        current_avg_score = avg_val
-                    term_counter += 1
-
-                # Calculate Trend and Residual
-                predicted_avg = None
-                residual = None
-                status_pattern = "مستقر"
-                traffic_light = "yellow"
-
-                if len(time_x) >= 2:
-                    X_reg = np.array(time_x).reshape(-1, 1)
-                    y_reg = np.array(scores_y)
+            level_keys = set(df_level_curr['_match_key'])
+            input_hashes = _level_input_hashes(
+                df_level_curr, df_level_prev, df_prev,
+                df_curr_with_avg if 'df_curr_with_avg' in locals() else None, coefs, run_params,
+            )
+            base_cohort = base_cohorts.get(level)
+            if base_cohort is not None and base_cohort.input_hashes == input_hashes:
+                report(int(level_start), f'نقل نتائج المستوى {level} (بدون تغيير)')
+                cohort, students = _carry_forward_level(base_cohort, run_record)
+                cohort_rows.append(cohort)
+                student_rows.extend(students)
+                carried_levels.append(level)
+                continue
 
-                    try:
-                        model = LinearRegression()
-                        model.fit(X_reg, y_reg)
-
-                        # Predict next term (term_counter)
-                        predicted_avg = float(model.predict([[term_counter]])[0])
-
-                        # Calculate residual for current term: Actual - Predicted(for current term)
-                        # We trained on all data, so we check the residual of the last point
-                        pred_last = model.predict([[time_x[-1]]])[0]
-                        residual = float(scores_y[-1] - pred_last)
-
-                        if residual > 1.5:
-                            status_pattern = "قافز فجأة (أداء يفوق التوقع)"
-                        elif residual < -1.5:
-                            status_pattern = "متراجع فجأة (أداء أقل من التوقع)"
-
-                        if predicted_avg < 10:
-                            traffic_light = "red"
-                        elif predicted_avg >= 12:
-                            traffic_light = "green"
-
-                    except Exception as e:
-                        logger.error(f"Regression error for student {mkey}: {e}")
-                else:
-                    # Not enough data for regression
-                    predicted_avg = current_avg_score
-                    if predicted_avg < 10: traffic_light = "red"
-                    elif predicted_avg >= 12: traffic_light = "green"
-
-                # Average Z-Score for the student in current term
-                student_z_score = float(student_curr['z_score'].mean()) if 'z_score' in student_curr.columns else 0.0
-                if pd.isna(student_z_score): student_z_score = 0.0
-
-                # Prefer class_code for display/grouping if available
-                class_code_val = student_curr['student__class_code'].iloc[0] if 'student__class_code' in student_curr.columns and not pd.isna(student_curr['student__class_code'].iloc[0]) else None
-                class_name = class_code_val or (student_curr['student__class_name'].iloc[0] if not student_curr.empty else "غير معروف")
-
-                # student_id for StudentExpertData: use Student.id from curr
-                curr_student_id = student_curr['student__id'].iloc[0] if not student_curr.empty else None
-
-                # Save Student Data
-                StudentExpertData.objects.create(
-                    run=run_record,
-                    student_id=curr_student_id,
-                    class_name=class_name,
-                    academic_year_level=level,
-                    residual=residual,
-                    status_pattern=status_pattern,
-                    current_avg=current_avg_score,
-                    predicted_avg=predicted_avg,
-                    traffic_light=traffic_light,
-                    trend_history=history,
-                    net_value_added=residual, # Using residual as Net Value Added
-                    z_score=student_z_score
-                )
+            tasks.append((level, input_hashes, dict(
+                level=level, coefs=coefs, df_level_curr=df_level_curr, df_level_prev=df_level_prev,
+                df_prev=_rows_for_keys(df_prev, level_keys),
+                df_curr_with_avg=_rows_for_keys(avg_rows, level_keys),
+                current_academic_year=current_academic_year, prev_academic_year=prev_academic_year,
+                effective_term=effective_term,
+            )))
+
+        def store(level, input_hashes, result):
+            cohort, students = result
+            cohort_rows.append(CohortExpertData(run=run_record, input_hashes=input_hashes, **cohort))
+            student_rows.extend(StudentExpertData(run=run_record, **row) for row in students)
+
+        # المستويات المعاد حسابها تتقاسم المجال 25%..95%
+        workers = _engine_workers(len(tasks), sum(len(kw['df_level_curr']) for _, _, kw in tasks))
+        level_span = 70 / max(len(tasks), 1)
+        done = []
+        if workers > 1:
+            hashes_by_level = {level: input_hashes for level, input_hashes, _ in tasks}
+            try:
+                for level, result in _analyze_levels_in_pool([kw for _, _, kw in tasks], workers):
+                    store(level, hashes_by_level[level], result)
+                    done.append(level)
+                    report(int(25 + level_span * len(done)), f'اكتمل تحليل المستوى {level}')
+            except (OSError, BrokenProcessPool) as e:
+                logger.warning(f"Expert Engine process pool unavailable ({e}); continuing serially")
+        for level, input_hashes, kw in tasks:
+            if level in done:
+                continue
+            level_start = 25 + level_span * len(done)
+            report(int(level_start), f'تحليل المستوى {level}')
+            result = analyze_level(
+                **kw, progress=lambda f, s=level_start, lv=level: report(int(s + level_span * f), f'تحليل المستوى {lv}'),
+            )
+            store(level, input_hashes, result)
+            done.append(level)
 
-        run_record.status = 'completed'
-        run_record.save()
-        logger.info(f"Expert Engine completed successfully for {current_academic_year} {current_term}")
+        report(100, 'اكتمل التحليل')
+        _save_run_rows(run_record, cohort_rows, student_rows)
+        try:
+            pruned = prune_expert_runs(current_academic_year, effective_term)
+            if pruned:
+                logger.info(f"Pruned {pruned} old expert runs for {current_academic_year} {effective_term}")
+        except Exception as e:
+            logger.error(f"Expert run pruning failed: {e}")
+        logger.info(
+            f"Expert Engine completed successfully for {current_academic_year} {current_term} "
+            f"({len(levels) - len(carried_levels)} levels recomputed, {len(carried_levels)} carried forward)"
+        )
         return True
 
+    except ExpertEngineCancelled:
+        logger.info(f"Expert Engine cancelled for {current_academic_year} {current_term}")
+        if 'run_record' in locals():
+            run_record.status = 'cancelled'
+            run_record.save()
+        raise
     except Exception as e:
         logger.error(f"Expert Engine Error: {e}")
         import traceback
@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
 from django.contrib import messages
 from .models import ExpertAnalysisRun, StudentExpertData, CohortExpertData, SchoolSettings, HistoricalStudent, HistoricalGrade
+from .expert_utils import levels_matching
 import openpyxl
 from openpyxl.styles import Font, Alignment
 from openpyxl.utils import get_column_letter
@@ -91,12 +92,13 @@ def expert_export_excel(request):
         messages.warning(request, 'لا توجد بيانات خبراء معالجة للتصدير.')
         return redirect('expert_analysis_view')
     level = request.GET.get('level', '')
+    levels = levels_matching(latest_run, level) if level else None
     students_qs = StudentExpertData.objects.filter(run=latest_run).select_related('student')
     if level:
-        students_qs = students_qs.filter(academic_year_level__icontains=level)
+        students_qs = students_qs.filter(academic_year_level__in=levels)
     cohort_qs = CohortExpertData.objects.filter(run=latest_run)
     if level:
-        cohort_qs = cohort_qs.filter(academic_year_level__icontains=level)
+        cohort_qs = cohort_qs.filter(academic_year_level__in=levels)
 
     wb = openpyxl.Workbook()
     # ورقة كاشف الأنماط
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+أرشفة علامات السنة المنتهية عند تغيير السنة الدراسية في الإعدادات.
+
+- حفظ الإعدادات يضيف مهمة GradeArchiveJob فقط (بعد نجاح الحفظ)، والأرشفة تجري في الخلفية.
+- العلامات تُقرأ بدفعات values_list (بدون كائنات Grade/Student) مرتبة بالمفتاح؛ كل دفعة
+  تُنسخ إلى HistoricalGrade وتُحذف من Grade في معاملة قصيرة، فلا يُقفل ملف SQLite طويلاً.
+- المهمة قابلة للاستئناف: ما نُقل حُذف، فإعادة التشغيل تكمل بالعلامات المتبقية.
+  مهمة "قيد التنفيذ" بدون نبضة منذ STALE_AFTER تعود للانتظار (توقف العملية).
+- التقدم (archived/total) يُكتب بعد كل دفعة؛ انظر views.grade_archive_status (تستعلم عنه صفحة الإعدادات).
+- فتح صفحة الإعدادات أو الاستعلام عن الحالة يستأنف المهام اليتيمة (resume_stale_jobs).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .import_utils import standardize_subject_name
+from .models import Grade, GradeArchiveJob, HistoricalGrade, HistoricalStudent, Student
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CHUNK = 2000
+STALE_AFTER = 600
+
+_lock = threading.Lock()
+_executor = None
+_active_drains = 0
+
+
+def archive_job_to_dict(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'old_year': job.old_year,
+        'new_year': job.new_year,
+        'total': job.total,
+        'archived': job.archived,
+        'progress': round(100 * job.archived / job.total) if job.total else (100 if job.status == job.STATUS_COMPLETED else 0),
+        'message': job.message,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M') if job.finished_at else None,
+    }
+
+
+def enqueue_grade_archive(old_year, new_year, start=True):
+    """
+    إضافة مهمة أرشفة لسنة (أو إرجاع المهمة النشطة لنفس السنة). يرجع (job, created).
+    start=False: لا يوقظ خيط الخلفية (المستدعي ينفذ المهام بنفسه، مثل أمر archive_grades).
+    """
+    job = GradeArchiveJob.objects.filter(old_year=old_year, status__in=GradeArchiveJob.ACTIVE_STATUSES).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            job = GradeArchiveJob.objects.create(old_year=old_year, new_year=new_year)
+    except IntegrityError:
+        job = GradeArchiveJob.objects.filter(old_year=old_year, status__in=GradeArchiveJob.ACTIVE_STATUSES).first()
+        if job is None:
+            raise
+        return job, False
+    if start:
+        transaction.on_commit(kick)
+    return job, True
+
+
+def requeue_stale_jobs():
+    """مهام توقفت عمليتها أثناء التنفيذ تعود للانتظار لتُستأنف."""
+    cutoff = timezone.now() - timedelta(seconds=STALE_AFTER)
+    return GradeArchiveJob.objects.filter(status=GradeArchiveJob.STATUS_RUNNING, heartbeat_at__lt=cutoff).update(
+        status=GradeArchiveJob.STATUS_QUEUED,
+    )
+
+
+def resume_stale_jobs():
+    """إعادة المهام المتوقفة للانتظار وإيقاظ الخيط المحلي إن وُجدت مهمة منتظرة (من صفحة الإعدادات وحالة الأرشفة)."""
+    requeue_stale_jobs()
+    if GradeArchiveJob.objects.filter(status=GradeArchiveJob.STATUS_QUEUED).exists():
+        kick()
+
+
+def claim_next_job():
+    requeue_stale_jobs()
+    job = GradeArchiveJob.objects.filter(status=GradeArchiveJob.STATUS_QUEUED).order_by('created_at', 'id').first()
+    if job is None:
+        return None
+    now = timezone.now()
+    if not GradeArchiveJob.objects.filter(pk=job.pk, status=GradeArchiveJob.STATUS_QUEUED).update(
+        status=GradeArchiveJob.STATUS_RUNNING, started_at=now, heartbeat_at=now,
+    ):
+        return None  # سبقتنا عملية أخرى
+    job.refresh_from_db()
+    return job
+
+
+def ensure_historical_students(old_year):
+    """{student_id_number: HistoricalStudent pk} لتلاميذ علامات السنة، مع إنشاء الناقص."""
+    id_nums = list(
+        Grade.objects.filter(academic_year=old_year).order_by()
+        .values_list('student__student_id_number', flat=True).distinct()
+    )
+    id_nums = [x for x in id_nums if x]
+    existing = dict(
+        HistoricalStudent.objects.filter(historical_year=old_year, student_id_number__in=id_nums)
+        .values_list('student_id_number', 'pk')
+    )
+    to_create = []
+    for s in Student.objects.filter(student_id_number__in=id_nums).only(
+        'student_id_number', 'first_name', 'last_name', 'date_of_birth', 'academic_year', 'class_name', 'class_code',
+    ):
+        sid = (s.student_id_number or '').strip()
+        if not sid or sid in existing:
+            continue
+        to_create.append(HistoricalStudent(
+            student_id_number=sid,
+            first_name=s.first_name,
+            last_name=s.last_name,
+            date_of_birth=s.date_of_birth,
+            academic_year=s.academic_year or '',
+            class_name=s.class_name or '',
+            class_code=s.class_code or None,
+            historical_year=old_year,
+        ))
+    if to_create:
+        HistoricalStudent.objects.bulk_create(to_create, ignore_conflicts=True, batch_size=500)
+        existing = dict(
+            HistoricalStudent.objects.filter(historical_year=old_year, student_id_number__in=id_nums)
+            .values_list('student_id_number', 'pk')
+        )
+    return existing
+
+
+def archive_chunk(old_year, historical_ids, size=ARCHIVE_CHUNK):
+    """نقل أول `size` علامة متبقية للسنة ثم حذفها (معاملة واحدة). يرجع عدد العلامات المعالجة."""
+    rows = list(
+        Grade.objects.filter(academic_year=old_year).order_by('pk')
+        .values_list('pk', 'student__student_id_number', 'subject', 'term', 'score')[:size]
+    )
+    if not rows:
+        return 0
+    objs = []
+    for _, sid, subject, term, score in rows:
+        hs_id = historical_ids.get((sid or '').strip())
+        if hs_id is None:
+            continue  # تلميذ بدون رقم تعريف: لا يُؤرشف (ويُحذف كما في السابق)
+        objs.append(HistoricalGrade(
+            student_id=hs_id, subject=standardize_subject_name(subject), term=term, score=score,
+            historical_year=old_year,
+        ))
+    with transaction.atomic():
+        HistoricalGrade.objects.bulk_create(objs, ignore_conflicts=True, batch_size=500)
+        Grade.objects.filter(pk__in=[r[0] for r in rows]).delete()
+    return len(rows)
+
+
+def run_archive_job(job, chunk_size=ARCHIVE_CHUNK):
+    """تنفيذ مهمة محجوزة (status=running) حتى النهاية. يرجع الحالة النهائية."""
+    from .grade_cube import invalidate_grade_cube
+
+    try:
+        historical_ids = ensure_historical_students(job.old_year)
+        remaining = Grade.objects.filter(academic_year=job.old_year).count()
+        job.total = job.archived + remaining
+        GradeArchiveJob.objects.filter(pk=job.pk).update(total=job.total, heartbeat_at=timezone.now())
+        while True:
+            done = archive_chunk(job.old_year, historical_ids, chunk_size)
+            if not done:
+                break
+            job.archived += done
+            GradeArchiveJob.objects.filter(pk=job.pk).update(archived=job.archived, heartbeat_at=timezone.now())
+        fields = {'status': GradeArchiveJob.STATUS_COMPLETED, 'message': f'تمت أرشفة {job.archived} علامة للسنة {job.old_year}'}
+    except Exception as e:
+        logger.exception('Grade archive job %s failed', job.pk)
+        fields = {'status': GradeArchiveJob.STATUS_FAILED, 'message': str(e)}
+    invalidate_grade_cube(job.old_year)
+    GradeArchiveJob.objects.filter(pk=job.pk).update(finished_at=timezone.now(), **fields)
+    return fields['status']
+
+
+def run_pending_jobs():
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return count
+        run_archive_job(job)
+        count += 1
+
+
+def _drain():
+    global _active_drains
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception('Grade archive runner crashed')
+    finally:
+        connection.close()
+        with _lock:
+            _active_drains -= 1
+
+
+def kick():
+    """إيقاظ خيط الأرشفة المحلي لسحب المهام المنتظرة (خيط واحد لكل عملية)."""
+    global _executor, _active_drains
+    with _lock:
+        if _active_drains >= 1:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='grade-archive')
+        _active_drains += 1
+        _executor.submit(_drain)
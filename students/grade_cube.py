@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+مكعب العلامات (grade cube): نسخة عمودية مُحضَّرة مسبقاً من علامات سنة دراسية.
+
+بدل إعادة بناء DataFrame من Grade.objects.values(...) مع ربط التلميذ عند كل تحميل
+للوحة التحليل أو تغيير فلتر، نحفظ لكل سنة دراسية مصفوفات NumPy:
+- لكل علامة: معرف التلميذ، رمز المادة، رمز الفصل، رمز المستوى، رمز القسم، رمز class_code، العلامة
+- قواميس (categorical) تحول الرموز إلى النصوص الأصلية
+- جدول صغير لبيانات التلاميذ (اللقب، الاسم، الجنس، معيد، تاريخ الميلاد)
+
+يُحفظ المكعب على القرص (.npz) ويُعاد بناؤه بعد كل استيراد علامات، ويُلغى عبر إشارات
+Grade/Student (انظر models.py). فلاتر لوحة التحليل (كائنات Q) تُقيَّم على القواميس الصغيرة
+ثم تُطبَّق كأقنعة منطقية (boolean masks) على المصفوفات.
+"""
+import os
+import re
+import threading
+import time as _time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Q
+
+CUBE_VERSION = 1
+# حد أقصى لعمر الملف (ثواني) كشبكة أمان لتعديلات لا تمر عبر الإشارات (مثل .update())
+CUBE_MAX_AGE = 6 * 3600
+
+# الحقول التي يُرجعها to_frame (نفس أسماء Grade.objects.values(...) في analytics_utils)
+FRAME_FIELDS = (
+    'student__id', 'student__last_name', 'student__first_name', 'student__class_name',
+    'student__class_code', 'student__academic_year', 'student__gender', 'student__is_repeater',
+    'student__date_of_birth', 'subject', 'term', 'score',
+)
+
+# حقل الاستعلام -> عمود مُرمَّز في المكعب
+_CODED_FIELDS = {
+    'subject': 'subject',
+    'term': 'term',
+    'student__academic_year': 'level',
+    'student__class_name': 'class_name',
+    'student__class_code': 'class_code',
+}
+_ID_FIELDS = {'student', 'student_id', 'student__id', 'student__pk'}
+
+_lock = threading.Lock()
+_memo = {}  # year -> (mtime, GradeCube)
+
+
+class UnsupportedCubeFilter(ValueError):
+    """فلتر لا يستطيع المكعب تقييمه؛ على المستدعي الرجوع إلى ORM."""
+
+
+def _text_match(value, lookup, arg):
+    # NULL لا يطابق أي شرط نصي (نفس سلوك SQL)
+    if value is None or arg is None:
+        return False
+    if lookup == 'in':
+        return value in {str(a) for a in arg if a is not None}
+    arg = str(arg)
+    if lookup == 'exact':
+        return value == arg
+    if lookup == 'iexact':
+        return value.casefold() == arg.casefold()
+    if lookup == 'contains':
+        return arg in value
+    if lookup == 'icontains':
+        return arg.casefold() in value.casefold()
+    if lookup == 'startswith':
+        return value.startswith(arg)
+    if lookup == 'istartswith':
+        return value.casefold().startswith(arg.casefold())
+    if lookup == 'endswith':
+        return value.endswith(arg)
+    if lookup == 'iendswith':
+        return value.casefold().endswith(arg.casefold())
+    raise UnsupportedCubeFilter(lookup)
+
+
+def _decode(dictionary, codes):
+    """رموز -> نصوص (الرمز -1 يعني NULL)."""
+    values = np.empty(len(dictionary) + 1, dtype=object)
+    values[:-1] = dictionary
+    values[-1] = None
+    return values[codes]
+
+
+class GradeCube:
+    def __init__(self, arrays):
+        self.student_id = arrays['student_id']
+        self.subject = arrays['subject']
+        self.term = arrays['term']
+        self.level = arrays['level']
+        self.class_name = arrays['class_name']
+        self.class_code = arrays['class_code']
+        self.score = arrays['score']
+        self.dictionaries = {
+            'subject': arrays['subject_values'].tolist(),
+            'term': arrays['term_values'].tolist(),
+            'level': arrays['level_values'].tolist(),
+            'class_name': arrays['class_name_values'].tolist(),
+            'class_code': arrays['class_code_values'].tolist(),
+        }
+        # جدول التلاميذ (مرتب حسب المعرف) + موضع كل علامة فيه
+        self.students = arrays['students']
+        self.last_names = arrays['last_names']
+        self.first_names = arrays['first_names']
+        self.genders = arrays['genders']
+        self.repeaters = arrays['repeaters']
+        self.births = arrays['births']
+        self._student_pos = np.searchsorted(self.students, self.student_id)
+
+    def __len__(self):
+        return len(self.score)
+
+    def _lookup_mask(self, key, arg):
+        field, _, lookup = key.partition('__')
+        if field == 'student' and lookup:
+            # student__academic_year__icontains -> (student__academic_year, icontains)
+            sub, _, lookup = lookup.partition('__')
+            field = f'student__{sub}'
+        lookup = lookup or 'exact'
+
+        if field in _ID_FIELDS:
+            if lookup == 'exact':
+                return self.student_id == int(arg)
+            if lookup == 'in':
+                return np.isin(self.student_id, [int(a) for a in arg])
+            raise UnsupportedCubeFilter(key)
+
+        column = _CODED_FIELDS.get(field)
+        if column is None:
+            raise UnsupportedCubeFilter(key)
+        # تقييم الشرط على القاموس الصغير ثم نشره على الصفوف؛ الخانة الأخيرة لـ NULL (-1)
+        hits = np.array(
+            [_text_match(v, lookup, arg) for v in self.dictionaries[column]] + [False], dtype=bool
+        )
+        return hits[getattr(self, column)]
+
+    def _q_mask(self, q):
+        if q.negated:
+            raise UnsupportedCubeFilter('negated Q')
+        result = None
+        for child in q.children:
+            m = self._q_mask(child) if isinstance(child, Q) else self._lookup_mask(*child)
+            if result is None:
+                result = m
+            elif q.connector == Q.OR:
+                result = result | m
+            else:
+                result = result & m
+        return np.ones(len(self), dtype=bool) if result is None else result
+
+    def mask(self, *filters, **lookups):
+        """نفس دلالة QuerySet.filter(*filters, **lookups) لكن كقناع منطقي."""
+        result = np.ones(len(self), dtype=bool)
+        for q in list(filters) + ([Q(**lookups)] if lookups else []):
+            result &= self._q_mask(q)
+        return result
+
+    def to_frame(self, mask=None):
+        """DataFrame بأعمدة FRAME_FIELDS للصفوف المحددة بالقناع (كل الصفوف عند غيابه)."""
+        idx = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        pos = self._student_pos[idx]
+        births = self.births[pos].astype(object)
+        births[births == ''] = None
+        return pd.DataFrame({
+            'student__id': self.student_id[idx],
+            'student__last_name': self.last_names[pos].astype(object),
+            'student__first_name': self.first_names[pos].astype(object),
+            'student__class_name': _decode(self.dictionaries['class_name'], self.class_name[idx]),
+            'student__class_code': _decode(self.dictionaries['class_code'], self.class_code[idx]),
+            'student__academic_year': _decode(self.dictionaries['level'], self.level[idx]),
+            'student__gender': self.genders[pos].astype(object),
+            'student__is_repeater': self.repeaters[pos],
+            'student__date_of_birth': births,
+            'subject': _decode(self.dictionaries['subject'], self.subject[idx]),
+            'term': _decode(self.dictionaries['term'], self.term[idx]),
+            'score': self.score[idx],
+        }, columns=list(FRAME_FIELDS))
+
+
+class _Encoder:
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def values(self):
+        return np.array(list(self.codes), dtype=str)
+
+
+def build_grade_cube(year):
+    """بناء المكعب من استعلام واحد (العلامة + بيانات التلميذ)."""
+    from .models import Grade
+
+    rows = Grade.objects.filter(academic_year=year).order_by('id').values_list(
+        'student_id', 'subject', 'term', 'score',
+        'student__academic_year', 'student__class_name', 'student__class_code',
+        'student__last_name', 'student__first_name', 'student__gender',
+        'student__is_repeater', 'student__date_of_birth',
+    )
+    enc = {name: _Encoder() for name in ('subject', 'term', 'level', 'class_name', 'class_code')}
+    n = len(rows)
+    student_id = np.empty(n, dtype=np.int64)
+    score = np.empty(n, dtype=np.float64)
+    codes = {name: np.empty(n, dtype=np.int32) for name in enc}
+    students = {}
+
+    for i, (sid, subject, term, sc, level, cls, code, last, first, gender, rep, dob) in enumerate(rows):
+        student_id[i] = sid
+        score[i] = sc
+        codes['subject'][i] = enc['subject'](subject)
+        codes['term'][i] = enc['term'](term)
+        codes['level'][i] = enc['level'](level)
+        codes['class_name'][i] = enc['class_name'](cls)
+        codes['class_code'][i] = enc['class_code'](code)
+        if sid not in students:
+            students[sid] = (last or '', first or '', gender or '', bool(rep), dob.isoformat() if dob else '')
+
+    ids = sorted(students)
+    table = [students[s] for s in ids]
+    arrays = {
+        'student_id': student_id,
+        'score': score,
+        'students': np.array(ids, dtype=np.int64),
+        'last_names': np.array([t[0] for t in table], dtype=str),
+        'first_names': np.array([t[1] for t in table], dtype=str),
+        'genders': np.array([t[2] for t in table], dtype=str),
+        'repeaters': np.array([t[3] for t in table], dtype=bool),
+        'births': np.array([t[4] for t in table], dtype=str),
+    }
+    for name, encoder in enc.items():
+        arrays[name] = codes[name]
+        arrays[f'{name}_values'] = encoder.values()
+    return GradeCube(arrays), arrays
+
+
+def _cube_dir():
+    return getattr(settings, 'GRADE_CUBE_DIR', os.path.join(settings.BASE_DIR, 'analytics_cache'))
+
+
+def _cube_path(year):
+    safe = re.sub(r'[^0-9A-Za-z_-]', '_', str(year))
+    return os.path.join(_cube_dir(), f'grades_{safe}.npz')
+
+
+def _save(path, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, version=np.array(CUBE_VERSION), **arrays)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != CUBE_VERSION:
+            return None
+        return GradeCube({k: data[k] for k in data.files})
+
+
+def rebuild_grade_cube(year):
+    """إعادة البناء والحفظ على القرص (تُستدعى بعد استيراد العلامات)."""
+    cube, arrays = build_grade_cube(year)
+    path = _cube_path(year)
+    try:
+        _save(path, arrays)
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    with _lock:
+        _memo[year] = (mtime, cube)
+    return cube
+
+
+def get_grade_cube(year):
+    """المكعب الحالي للسنة: من الذاكرة، أو من الملف، أو يُبنى عند غيابه/قِدمه."""
+    path = _cube_path(year)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+
+    with _lock:
+        cached = _memo.get(year)
+    if mtime is not None and _time.time() - mtime < CUBE_MAX_AGE:
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            cube = _read(path)
+        except (OSError, ValueError, KeyError):
+            cube = None
+        if cube is not None:
+            with _lock:
+                _memo[year] = (mtime, cube)
+            return cube
+    return rebuild_grade_cube(year)
+
+
+def invalidate_grade_cube(year=None, **kwargs):
+    """حذف المكعب (لسنة واحدة أو للكل). تُستدعى من إشارات Grade/Student وبعد التعديلات الجماعية."""
+    with _lock:
+        if year is None:
+            _memo.clear()
+        else:
+            _memo.pop(year, None)
+    if year is None:
+        try:
+            names = [n for n in os.listdir(_cube_dir()) if n.startswith('grades_') and n.endswith('.npz')]
+        except OSError:
+            return
+        paths = [os.path.join(_cube_dir(), n) for n in names]
+    else:
+        paths = [_cube_path(year)]
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
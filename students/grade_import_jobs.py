@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+استيراد ملفات علامات عدة أقسام دفعة واحدة في الخلفية.
+
+- الطلب يحفظ الملفات المؤقتة وينشئ GradeImportSession ثم يرجع فوراً؛ الواجهة تستعلم
+  عن التقدم ونتيجة كل ملف (بدل حجز عامل gunicorn طوال الاستيراد).
+- قراءة الملفات (تحليل xlsx/xls/html بايثون، مقيد بالـ GIL) في مجمع عمليات بطريقة
+  spawn: العمليات لا ترث اتصال القاعدة ولا خيوط العملية الأم، ولا تلمس القاعدة.
+- الكتابة في القاعدة عبر كاتب واحد: خيط الجلسة يعالج الملفات واحداً تلو الآخر بترتيب
+  انتهاء قراءتها. الجلسة تحجز خانة الكتابة (حقل slot فريد) قبل التنفيذ، فلا تكتب جلستان
+  في نفس الوقت حتى من عمليتين مختلفتين؛ الجلسة التالية تنتظر تحرر الخانة.
+- بعد كل ملف تُحدَّث نتيجته والعدادات والنبضة في الجلسة، ويُعاد بناء مكعب العلامات مرة واحدة في النهاية.
+- جلسة "قيد التنفيذ" بدون نبضة منذ STALE_AFTER تُعتبر متوقفة (توقف العملية): تفشل وتُحذف
+  ملفاتها المؤقتة وتُحرَّر خانتها (انظر ui_views.grade_import_session_status).
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time as _time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .grade_importer import process_grades_file, process_grades_file_ai
+from .import_utils import read_rows_from_path
+from .models import GradeImportSession
+
+logger = logging.getLogger(__name__)
+
+WRITER_SLOT = 1
+STALE_AFTER = 600
+CLAIM_POLL_INTERVAL = 3
+
+_lock = threading.Lock()
+_writer = None
+_active_drains = 0
+
+
+def _workers():
+    return getattr(settings, 'GRADE_IMPORT_WORKERS', None) or min(4, os.cpu_count() or 1)
+
+
+def session_to_dict(session):
+    return {
+        'id': session.id,
+        'status': session.status,
+        'term': session.term,
+        'total_files': session.total_files,
+        'done_files': session.done_files,
+        'grades_count': session.grades_count,
+        'progress': round(100 * session.done_files / session.total_files) if session.total_files else 100,
+        'message': session.message,
+        'files': [{k: f.get(k) for k in ('name', 'status', 'count', 'message')} for f in session.files],
+    }
+
+
+def create_import_session(files, term, import_mode='local', subject_mappings=None, user=None):
+    """files: [(اسم الملف، المسار المؤقت)]. ينشئ الجلسة ويبدأ تنفيذها بعد الـ commit."""
+    session = GradeImportSession.objects.create(
+        term=term, import_mode=import_mode, subject_mappings=subject_mappings or None,
+        files=[{'name': name, 'path': path, 'status': 'queued', 'count': 0, 'message': ''} for name, path in files],
+        total_files=len(files),
+        requested_by=user if user is not None and user.is_authenticated else None,
+    )
+    transaction.on_commit(kick)
+    return session
+
+
+def iter_parsed_files(paths, workers=None):
+    """يرجع (index, rows, error) لكل ملف بترتيب انتهاء القراءة."""
+    workers = min(workers or _workers(), len(paths))
+    if workers <= 1:
+        for idx, path in enumerate(paths):
+            try:
+                yield idx, read_rows_from_path(path), None
+            except Exception as e:
+                yield idx, None, e
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(read_rows_from_path, path): idx for idx, path in enumerate(paths)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def _import_one(session, path, rows):
+    if session.import_mode == 'ai':
+        return process_grades_file_ai(path, session.term, rows=rows, rebuild_cube=False)
+    return process_grades_file(path, session.term, subject_mappings=session.subject_mappings,
+                               rows=rows, rebuild_cube=False)
+
+
+def reap_stale_sessions():
+    """جلسات توقفت عمليتها (بدون نبضة منذ STALE_AFTER): تفشل وتُحذف ملفاتها وتُحرَّر خانتها."""
+    cutoff = timezone.now() - timedelta(seconds=STALE_AFTER)
+    reaped = 0
+    for session in GradeImportSession.objects.filter(status=GradeImportSession.STATUS_RUNNING, heartbeat_at__lt=cutoff):
+        files = [
+            dict(f, status='failed', message='توقف الاستيراد قبل معالجة الملف') if f.get('status') == 'queued' else f
+            for f in session.files
+        ]
+        if GradeImportSession.objects.filter(pk=session.pk, status=GradeImportSession.STATUS_RUNNING).update(
+            status=GradeImportSession.STATUS_FAILED, slot=None, files=files, finished_at=timezone.now(),
+            message='توقفت العملية المنفذة قبل انتهاء الاستيراد',
+        ):
+            reaped += 1
+            for entry in files:
+                _remove(entry.get('path'))
+    return reaped
+
+
+def claim_session(session_id=None):
+    """حجز جلسة منتظرة (أو أقدمها) إن كانت خانة الكتابة حرة. يرجع الجلسة أو None."""
+    reap_stale_sessions()
+    queued = GradeImportSession.objects.filter(status=GradeImportSession.STATUS_QUEUED)
+    session = queued.filter(pk=session_id).first() if session_id else queued.order_by('created_at', 'id').first()
+    if session is None:
+        return None
+    try:
+        with transaction.atomic():
+            claimed = GradeImportSession.objects.filter(pk=session.pk, status=GradeImportSession.STATUS_QUEUED).update(
+                status=GradeImportSession.STATUS_RUNNING, slot=WRITER_SLOT, heartbeat_at=timezone.now(),
+            )
+    except IntegrityError:
+        return None  # جلسة أخرى تكتب (ربما في عملية أخرى)
+    if not claimed:
+        return None  # سبقتنا عملية أخرى
+    session.refresh_from_db()
+    return session
+
+
+def run_import_session(session_id, workers=None):
+    """حجز جلسة منتظرة وتنفيذها حتى النهاية (هذا الخيط هو الكاتب الوحيد). يرجع الحالة النهائية."""
+    session = claim_session(session_id)
+    if session is None:
+        return None
+    paths = [f['path'] for f in session.files]
+    status = GradeImportSession.STATUS_COMPLETED
+    try:
+        for idx, rows, error in iter_parsed_files(paths, workers):
+            entry = session.files[idx]
+            count, message = 0, ''
+            if error is None:
+                try:
+                    count, message = _import_one(session, entry['path'], rows)
+                except Exception as e:
+                    logger.exception('Grade import session %s: %s failed', session_id, entry['name'])
+                    error = e
+            entry.update(
+                status='done' if count > 0 else 'failed', count=count,
+                message=message if error is None else f"خطأ: {error}",
+            )
+            session.done_files += 1
+            session.grades_count += count
+            session.heartbeat_at = timezone.now()
+            session.save(update_fields=['files', 'done_files', 'grades_count', 'heartbeat_at', 'updated_at'])
+            _remove(entry['path'])
+    except Exception as e:
+        logger.exception('Grade import session %s failed', session_id)
+        status = GradeImportSession.STATUS_FAILED
+        session.message = str(e)
+    if session.grades_count:
+        from .grade_cube import rebuild_grade_cube
+        from .school_year_utils import get_current_school_year
+        try:
+            rebuild_grade_cube(get_current_school_year())
+        except Exception:
+            logger.exception('Grade cube rebuild after import session %s failed', session_id)
+    session.status = status
+    session.slot = None
+    session.finished_at = timezone.now()
+    if status == GradeImportSession.STATUS_COMPLETED:
+        session.message = f'اكتمل الاستيراد! تم استيراد {session.grades_count} علامة إجمالاً.'
+    session.save(update_fields=['status', 'slot', 'finished_at', 'message', 'updated_at'])
+    for entry in session.files:
+        _remove(entry['path'])
+    return status
+
+
+def _remove(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def run_pending_sessions(wait=True):
+    """
+    تنفيذ الجلسات المنتظرة بالترتيب.
+    wait=True: إن كانت خانة الكتابة مشغولة (جلسة في عملية أخرى) ننتظر ثم نعيد المحاولة.
+    """
+    count = 0
+    while True:
+        session = GradeImportSession.objects.filter(
+            status=GradeImportSession.STATUS_QUEUED,
+        ).order_by('created_at', 'id').first()
+        if session is None:
+            return count
+        if run_import_session(session.pk) is None:
+            if not wait:
+                return count
+            _time.sleep(CLAIM_POLL_INTERVAL)
+            continue
+        count += 1
+
+
+def _drain():
+    global _active_drains
+    try:
+        run_pending_sessions()
+    except Exception:
+        logger.exception('Grade import runner crashed')
+    finally:
+        connection.close()
+        with _lock:
+            _active_drains -= 1
+
+
+def kick():
+    """إيقاظ خيط الكاتب المحلي لسحب الجلسات المنتظرة (خيط واحد لكل عملية)."""
+    global _writer, _active_drains
+    with _lock:
+        if _active_drains >= 1:
+            return
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='grade-import')
+        _active_drains += 1
+        _writer.submit(_drain)
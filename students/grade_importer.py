@@ -1,15 +1,137 @@
 
 import re
+from django.db import transaction
+from django.utils import timezone
 from .models import Grade, Student, ClassAlias
+from .grade_cube import invalidate_grade_cube, rebuild_grade_cube
+from .import_utils import read_rows_from_path
 
-def process_grades_file(file_path, term, subject_mappings=None):
-    from .import_utils import extract_rows_from_file
+GRADE_UNIQUE_FIELDS = ['student', 'subject', 'term', 'academic_year']
+GRADE_BATCH_SIZE = 500
+
+
+def _schedule_grade_cube_rebuild(academic_year):
+    """إعادة بناء مكعب العلامات مرة واحدة بعد الاستيراد (بعد الـ commit إن وُجدت معاملة)."""
+    transaction.on_commit(lambda: rebuild_grade_cube(academic_year))
+
+
+def _name_key(text):
+    from .expert_import_utils import normalize_arabic, normalize_name_part
+    return normalize_arabic(normalize_name_part(text))
+
+
+class ClassNameIndex:
+    """
+    فهرس أسماء تلاميذ القسم، يُبنى مرة واحدة لكل ملف (المسار العادي ومسار الذكاء الاصطناعي):
+    - مفتاح الاسم الكامل (لقب اسم) ومفتاحه المعكوس (اسم لقب) بعد التطبيع: مطابقة O(1).
+    - فهرس الكلمات للبحث الاحتياطي بالاحتواء: لا يُفحص إلا التلاميذ الذين يشتركون في كلمة مع الاسم.
+    الأسماء غير المطابقة والملتبسة (أكثر من تلميذ) تُجمع في unmatched وambiguous.
+    """
+
+    def __init__(self, students):
+        self.students = list(students)
+        self._full = {}      # مفتاح الاسم الكامل -> مواضع
+        self._reversed = {}  # مفتاح "اسم لقب" -> مواضع
+        self._tokens = {}    # كلمة -> مواضع
+        self._keys = []
+        for pos, s in enumerate(self.students):
+            key = _name_key(f"{s.last_name} {s.first_name}")
+            self._keys.append(key)
+            self._full.setdefault(key, []).append(pos)
+            self._reversed.setdefault(_name_key(f"{s.first_name} {s.last_name}"), []).append(pos)
+            for token in set(key.split()):
+                self._tokens.setdefault(token, []).append(pos)
+        self.unmatched = []
+        self.ambiguous = []
+
+    def _contained(self, key):
+        parts = key.split()
+        if len(parts) < 2:
+            return []
+        rev_key = f"{parts[1]} {parts[0]}"
+        candidates = sorted({pos for token in set(parts) for pos in self._tokens.get(token, ())})
+        return [pos for pos in candidates if rev_key in self._keys[pos] or self._keys[pos] in key]
+
+    def match(self, student_name):
+        """التلميذ المطابق لاسم من الملف (أول تلميذ بترتيب القسم عند الالتباس) أو None."""
+        key = _name_key(student_name)
+        if not key:
+            return None
+        positions = self._full.get(key) or self._reversed.get(key) or self._contained(key)
+        if not positions:
+            self.unmatched.append(student_name)
+            return None
+        if len(positions) > 1:
+            self.ambiguous.append(student_name)
+        return self.students[positions[0]]
+
+    def report(self):
+        """ملخص يُضاف لرسالة الاستيراد (فارغ إن طابقت كل الأسماء)."""
+        notes = []
+        if self.unmatched:
+            notes.append(f"{len(self.unmatched)} اسم غير مطابق: {'، '.join(self.unmatched[:10])}")
+        if self.ambiguous:
+            notes.append(f"{len(self.ambiguous)} اسم ملتبس: {'، '.join(self.ambiguous[:10])}")
+        return f" ({' — '.join(notes)})" if notes else ''
+
+
+def save_class_grades(cells, repeaters, academic_year):
+    """
+    كتابة علامات ملف قسم كاملة دفعة واحدة بدل update_or_create لكل خلية.
+    cells: {(student_pk, subject, term): score} — آخر قيمة للخلية تغلب.
+    repeaters: {student_pk: (student, is_repeater)}.
+    العلامات الموجودة للتلاميذ تُقرأ باستعلام واحد، ولا يُكتب إلا الجديد أو المتغير
+    (bulk_create مع update_conflicts)، وحالة الإعادة بـ bulk_update واحد، والكل في معاملة.
+    يرجع عدد العلامات المكتوبة.
+    """
+    student_pks = {pk for pk, _, _ in cells} | set(repeaters)
+    existing = {
+        (pk, subject, term): score
+        for pk, subject, term, score in Grade.objects.filter(
+            student_id__in=student_pks, academic_year=academic_year,
+        ).values_list('student_id', 'subject', 'term', 'score').order_by()
+    }
+    changed = [
+        Grade(student_id=pk, subject=subject, term=term, academic_year=academic_year, score=score)
+        for (pk, subject, term), score in cells.items()
+        if existing.get((pk, subject, term)) != score
+    ]
+    now = timezone.now()
+    flipped = []
+    for student, is_repeater in repeaters.values():
+        if student.is_repeater != is_repeater:
+            student.is_repeater = is_repeater
+            student.updated_at = now  # bulk_update skips auto_now (offline change feed)
+            flipped.append(student)
+
+    with transaction.atomic():
+        if changed:
+            Grade.objects.bulk_create(
+                changed, batch_size=GRADE_BATCH_SIZE, update_conflicts=True,
+                unique_fields=GRADE_UNIQUE_FIELDS, update_fields=['score'],
+            )
+        if flipped:
+            Student.objects.bulk_update(flipped, ['is_repeater', 'updated_at'], batch_size=GRADE_BATCH_SIZE)
+
+    # bulk_create/bulk_update don't send post_save signals
+    if flipped:
+        invalidate_grade_cube()
+        transaction.on_commit(invalidate_grade_cube)
+    elif changed:
+        invalidate_grade_cube(academic_year)
+    return len(changed)
+
+def process_grades_file(file_path, term, subject_mappings=None, rows=None, rebuild_cube=True):
+    """
+    rows: صفوف الملف إن قُرئت مسبقاً (انظر grade_import_jobs)، وإلا يُقرأ الملف هنا.
+    rebuild_cube=False: المستدعي يعيد بناء مكعب العلامات مرة واحدة بعد كل الملفات.
+    """
     from .mapping_views import resolve_class_alias
     from .school_year_utils import get_current_school_year
 
     academic_year = get_current_school_year()
-    with open(file_path, 'rb') as f:
-        rows = list(extract_rows_from_file(f, override_filename=file_path))
+    if rows is None:
+        rows = read_rows_from_path(file_path)
 
     if not rows or len(rows) < 7:
         return 0, 'الملف فارغ أو لا يحتوي على بنية علامات صحيحة'
@@ -248,6 +370,8 @@ def process_grades_file(file_path, term, subject_mappings=None):
         repeater_idx = 4
 
     grades_created = 0
+    cells, repeaters = {}, {}
+    name_index = ClassNameIndex(students_in_class)
     # Process students starting from row index 6 — تجاهل السطر الأخير إذا كان "معدل المواد" (خلايا مدمجة)
     data_rows = rows[6:]
     for row in data_rows:
@@ -258,32 +382,15 @@ def process_grades_file(file_path, term, subject_mappings=None):
         if 'معدل المواد' in student_name or student_name.strip() in ('معدل المواد', 'معدل المادة', 'المعدل العام للمواد'):
             continue
 
-        # Find student
-        student = None
-        # Fast exact match
-        for s in students_in_class:
-            if s.full_name == student_name or f"{s.last_name} {s.first_name}" == student_name:
-                student = s
-                break
-
-        # If not exact match, skip or try fuzzy (for now exact/reverse exact)
-        if not student:
-            parts = student_name.split()
-            if len(parts) >= 2:
-                rev_name = f"{parts[1]} {parts[0]}"
-                for s in students_in_class:
-                    if rev_name in s.full_name or s.full_name in student_name:
-                        student = s
-                        break
+        # Find student: exact / reversed name, then containment among students sharing a word
+        student = name_index.match(student_name)
 
         if student:
             # Update Repeater Status
             if repeater_idx != -1 and len(row) > repeater_idx:
                 rep_val = str(row[repeater_idx]).strip()
                 is_repeater = bool(rep_val and rep_val not in ['0', 'لا', 'False', 'false', 'غ'])
-                if student.is_repeater != is_repeater:
-                    student.is_repeater = is_repeater
-                    student.save(update_fields=['is_repeater'])
+                repeaters[student.pk] = (student, is_repeater)
 
             for (subject, sub_term), col_idx in subject_indices_multi.items():
                 if len(row) > col_idx:
@@ -296,38 +403,35 @@ def process_grades_file(file_path, term, subject_mappings=None):
                             else:
                                 score = float(score_val)
 
-                            # Update or create using the specific term found for this column
-                            Grade.objects.update_or_create(
-                                student=student,
-                                subject=subject,
-                                term=sub_term,
-                                academic_year=academic_year,
-                                defaults={'score': score}
-                            )
+                            # Collected per (student, subject, term); written once for the whole file
+                            cells[(student.pk, subject, sub_term)] = score
                             grades_created += 1
                         except ValueError:
                             pass # Ignore other empty or invalid strings
 
-    return grades_created, f'تم استيراد {grades_created} علامة بنجاح للقسم {lvl} {cls}.'
+    save_class_grades(cells, repeaters, academic_year)
+    if grades_created and rebuild_cube:
+        _schedule_grade_cube_rebuild(academic_year)
+
+    return grades_created, f'تم استيراد {grades_created} علامة بنجاح للقسم {lvl} {cls}.' + name_index.report()
 
 
-def process_grades_file_ai(file_path, term):
+def process_grades_file_ai(file_path, term, rows=None, rebuild_cube=True):
     """
     Sends the extracted text from the Excel/PDF file to the LLM (AIService)
     to intelligently extract grades and student data into JSON format.
     """
     import os
     import json
-    from .import_utils import extract_rows_from_file
     from .ai_utils import AIService
 
     # 1. Extract raw text from file
     raw_text = ""
     try:
-        with open(file_path, 'rb') as f:
-            rows = list(extract_rows_from_file(f, override_filename=file_path))
-            for row in rows[:100]: # Limit to avoid massive token payload
-                raw_text += " | ".join([str(c) for c in row if c]) + "\n"
+        if rows is None:
+            rows = read_rows_from_path(file_path)
+        for row in rows[:100]: # Limit to avoid massive token payload
+            raw_text += " | ".join([str(c) for c in row if c]) + "\n"
     except Exception as e:
         return 0, f"خطأ في قراءة الملف محلياً قبل إرساله للذكاء الاصطناعي: {str(e)}"
 
@@ -390,6 +494,8 @@ def process_grades_file_ai(file_path, term):
         return 0, f"القسم {lvl} {cls} غير موجود في قاعدة البيانات أو ليس به تلاميذ."
 
     grades_created = 0
+    cells, repeaters = {}, {}
+    name_index = ClassNameIndex(students_in_class)
 
     for s_data in students_data:
         student_name = s_data.get('student_name', '').strip()
@@ -398,27 +504,11 @@ def process_grades_file_ai(file_path, term):
 
         if not student_name: continue
 
-        # Find student by fuzzy matching
-        student = None
-        for s in students_in_class:
-            if s.full_name == student_name or f"{s.last_name} {s.first_name}" == student_name:
-                student = s
-                break
-
-        # Reverse name logic
-        if not student:
-            parts = student_name.split()
-            if len(parts) >= 2:
-                rev_name = f"{parts[1]} {parts[0]}"
-                for s in students_in_class:
-                    if rev_name in s.full_name or s.full_name in student_name:
-                        student = s
-                        break
+        # Find student by exact, reversed, then contained name
+        student = name_index.match(student_name)
 
         if student:
-            if student.is_repeater != is_repeater:
-                student.is_repeater = is_repeater
-                student.save(update_fields=['is_repeater'])
+            repeaters[student.pk] = (student, is_repeater)
 
             for subject, score in grades.items():
                 try:
@@ -427,15 +517,13 @@ def process_grades_file_ai(file_path, term):
                     else:
                         score_val = float(score)
 
-                    Grade.objects.update_or_create(
-                        student=student,
-                        subject=subject,
-                        term=term,
-                        academic_year=academic_year,
-                        defaults={'score': score_val}
-                    )
+                    cells[(student.pk, subject, term)] = score_val
                     grades_created += 1
                 except (ValueError, TypeError):
                     pass
 
-    return grades_created, f"تم استيراد {grades_created} علامة بنجاح للقسم {lvl} {cls} باستخدام الذكاء الاصطناعي."
+    save_class_grades(cells, repeaters, academic_year)
+    if grades_created and rebuild_cube:
+        _schedule_grade_cube_rebuild(academic_year)
+
+    return grades_created, f"تم استيراد {grades_created} علامة بنجاح للقسم {lvl} {cls} باستخدام الذكاء الاصطناعي." + name_index.report()
@@ -3,6 +3,7 @@ import xlrd
 from bs4 import BeautifulSoup
 from docx import Document
 from PyPDF2 import PdfReader
+import functools
 import re
 from datetime import datetime, date
 
@@ -61,6 +62,14 @@ def extract_rows_from_file(file, override_filename=None):
         except:
             pass
 
+def read_rows_from_path(file_path):
+    """
+    All rows of a file on disk (see extract_rows_from_file).
+    Touches no Django state, so it can run in spawned parser processes.
+    """
+    with open(file_path, 'rb') as f:
+        return list(extract_rows_from_file(f, override_filename=file_path))
+
 def _parse_html_table(content):
     soup = BeautifulSoup(content, 'html.parser')
     table = soup.find('table')
@@ -349,45 +358,76 @@ def parse_hr_file(file_path, override_header_indices=None):
 
     return employees
 
+# Official subject name -> spellings found in result files (matched as substrings, in this order)
+SUBJECT_VARIANTS = {
+    'الرياضيات': ['رياضيات', 'الرياضيات', 'ماده الرياضيات', 'الرياصيات'],
+    'اللغة العربية': ['لغة عربية', 'اللغه العربيه', 'عربية', 'العربية', 'لغه عربيه', 'اللغة العربية', 'الغه العربيه'],
+    'التربية الإسلامية': ['تربية اسلامية', 'التربيه الاسلاميه', 'إسلامية', 'اسلامية', 'التربية الاسلامية'],
+    'اللغة الفرنسية': ['لغة فرنسية', 'اللغه الفرنسيه', 'فرنسية', 'الفرنسية', 'الفرنسيه'],
+    'اللغة الإنجليزية': ['لغة انجليزية', 'اللغه الانجليزيه', 'انجليزية', 'الانجليزية', 'الانجليزيه', 'لغة إنجليزية'],
+    'التربية المدنية': ['تربية مدنية', 'التربيه المدنيه', 'مدنية', 'المدنية'],
+    'التاريخ والجغرافيا': ['تاريخ وجغرافيا', 'التاريخ والجغرافيا', 'تاريخ', 'جغرافيا', 'اجتماعيات', 'الاجتماعيات'],
+    'ع الطبيعة والحياة': ['علوم طبيعية', 'علوط طبيعية', 'العلوم الطبيعية', 'علوم طبيعة', 'ع طبيعة وحياة', 'العلوم الطبيعيه', 'علوم'],
+    'ع الفيزيائية والتكنولوجيا': ['فيزياء', 'الفيزياء', 'علوم فيزيائية', 'ع فيزيائية وتكنولوجيا', 'العلوم الفيزيائية', 'فيزيا'],
+    'المعلوماتية': ['اعلام آلي', 'الاعلام الآلي', 'معلوماتية', 'المعلوماتية', 'اعلام الي', 'إعلام آلي'],
+    'التربية التشكيلية': ['تربية فنية', 'التربيه الفنيه', 'رسم', 'الرسم', 'تربية تشكيلية', 'التربيه التشكيليه'],
+    'التربية البدنية': ['تربية بدنية', 'التربيه البدنيه', 'رياضة', 'الرياضة', 'تربية رياضية']
+}
+
+_SPACES_RE = re.compile(r'\s+')
+_ALEF_RE = re.compile(r'[إأآا]')
+
+
+def _match_form(text):
+    """Alef variants and Ta Marbuta folded, as used for subject matching."""
+    return _ALEF_RE.sub('ا', text).replace('ة', 'ه')
+
+
+# Variants normalized once, at import: [(normalized variant, official name)]
+_SUBJECT_PATTERNS = [
+    (_match_form(variant).lower(), official_name)
+    for official_name, variants in SUBJECT_VARIANTS.items()
+    for variant in variants
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def _standardize_subject(name):
+    # 1. Clean spaces and normalize some arabic letters
+    name = _match_form(_SPACES_RE.sub(' ', name.strip()))
+    lowered = name.lower()
+    for v_norm, official_name in _SUBJECT_PATTERNS:
+        if v_norm in lowered:
+            return official_name
+    return name  # Return cleaned original if no match found
+
+
 def standardize_subject_name(raw_name):
     """
     Standardizes subject names to fix common typos, variations, and trailing spaces.
     e.g. 'علوط طبيعية' -> 'ع الطبيعة والحياة'
+    Results are cached per distinct raw name.
     """
     if not raw_name:
         return ""
+    return _standardize_subject(str(raw_name))
 
-    # 1. Clean spaces and normalize some arabic letters
-    name = str(raw_name).strip()
-    name = re.sub(r'\s+', ' ', name) # Remove multiple spaces
-
-    # Simple normalizations (Alef variants)
-    name = re.sub(r'[إأآا]', 'ا', name)
-    name = name.replace('ة', 'ه') # Normalize Ta Marbuta just for matching, we will return the official name
-
-    mapping = {
-        'الرياضيات': ['رياضيات', 'الرياضيات', 'ماده الرياضيات', 'الرياصيات'],
-        'اللغة العربية': ['لغة عربية', 'اللغه العربيه', 'عربية', 'العربية', 'لغه عربيه', 'اللغة العربية', 'الغه العربيه'],
-        'التربية الإسلامية': ['تربية اسلامية', 'التربيه الاسلاميه', 'إسلامية', 'اسلامية', 'التربية الاسلامية'],
-        'اللغة الفرنسية': ['لغة فرنسية', 'اللغه الفرنسيه', 'فرنسية', 'الفرنسية', 'الفرنسيه'],
-        'اللغة الإنجليزية': ['لغة انجليزية', 'اللغه الانجليزيه', 'انجليزية', 'الانجليزية', 'الانجليزيه', 'لغة إنجليزية'],
-        'التربية المدنية': ['تربية مدنية', 'التربيه المدنيه', 'مدنية', 'المدنية'],
-        'التاريخ والجغرافيا': ['تاريخ وجغرافيا', 'التاريخ والجغرافيا', 'تاريخ', 'جغرافيا', 'اجتماعيات', 'الاجتماعيات'],
-        'ع الطبيعة والحياة': ['علوم طبيعية', 'علوط طبيعية', 'العلوم الطبيعية', 'علوم طبيعة', 'ع طبيعة وحياة', 'العلوم الطبيعيه', 'علوم'],
-        'ع الفيزيائية والتكنولوجيا': ['فيزياء', 'الفيزياء', 'علوم فيزيائية', 'ع فيزيائية وتكنولوجيا', 'العلوم الفيزيائية', 'فيزيا'],
-        'المعلوماتية': ['اعلام آلي', 'الاعلام الآلي', 'معلوماتية', 'المعلوماتية', 'اعلام الي', 'إعلام آلي'],
-        'التربية التشكيلية': ['تربية فنية', 'التربيه الفنيه', 'رسم', 'الرسم', 'تربية تشكيلية', 'التربيه التشكيليه'],
-        'التربية البدنية': ['تربية بدنية', 'التربيه البدنيه', 'رياضة', 'الرياضة', 'تربية رياضية']
-    }
-
-    for official_name, variants in mapping.items():
-        for variant in variants:
-            # Normalize variant for matching
-            v_norm = re.sub(r'[إأآا]', 'ا', variant).replace('ة', 'ه').lower()
-            if v_norm in name.lower():
-                return official_name
 
-    return name  # Return cleaned original if no match found
+def standardize_subject_series(subjects):
+    """
+    standardize_subject_name over a pandas Series, computed once per distinct value
+    (same result as subjects.apply(standardize_subject_name)).
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(subjects)
+    values = np.array([standardize_subject_name(u) for u in uniques] + [None], dtype=object)
+    out = values[codes]  # NA values have code -1 (the placeholder above)
+    missing = codes == -1
+    if missing.any():
+        out[missing] = [standardize_subject_name(v) for v in subjects[missing]]
+    return pd.Series(out, index=subjects.index, name=subjects.name)
 
 
 def normalize_subject_for_dedup(name):
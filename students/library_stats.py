@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+إحصائيات المكتبة.
+
+- جدول LibraryLoanDailyStats: صف لكل يوم (عدد الإعارات حسب loan_date والإرجاعات حسب
+  actual_return_date)، يُحدَّث تدريجياً من create_loan وreturn_book، ويُطرح منه عند حذف
+  تلميذ (إشارة pre_delete) أو مسح سجل الإعارات. نوافذ اليوم/الأسبوع/الشهر/الفصل/السنة
+  تُجمع من حوالي 365 صفاً صغيراً مهما طال سجل الإعارات.
+- rebuild_library_daily_stats يعيد بناء الجدول من LibraryLoan (الترحيل وأمر الصيانة).
+"""
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, DurationField, ExpressionWrapper, Exists, F, OuterRef, Q, Sum, Value
+
+# النوافذ بالأيام (من اليوم نحو الماضي، كما في العدّ السابق loan_date__gte=today-N)
+STAT_WINDOWS = (('daily', 0), ('weekly', 7), ('monthly', 30), ('quarterly', 90), ('yearly', 365))
+
+
+def _bump(day, **deltas):
+    from .models import LibraryLoanDailyStats
+
+    if day is None:
+        return
+    updates = {field: F(field) + n for field, n in deltas.items()}
+    if LibraryLoanDailyStats.objects.filter(date=day).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            LibraryLoanDailyStats.objects.create(date=day, **deltas)
+    except IntegrityError:
+        # أنشأته عملية أخرى في نفس اللحظة
+        LibraryLoanDailyStats.objects.filter(date=day).update(**updates)
+
+
+def record_loan(day, count=1):
+    _bump(day, loans=count)
+
+
+def record_return(day, count=1):
+    _bump(day, returns=count)
+
+
+def forget_student_loans(student_id):
+    """طرح إعارات/إرجاعات تلميذ من الجدول اليومي (قبل حذفها بالتتابع)."""
+    from .models import LibraryLoan
+
+    loans = LibraryLoan.objects.filter(student_id=student_id)
+    for row in loans.values('loan_date').annotate(n=Count('id')).order_by():
+        record_loan(row['loan_date'], -row['n'])
+    returned = loans.filter(is_returned=True, actual_return_date__isnull=False)
+    for row in returned.values('actual_return_date').annotate(n=Count('id')).order_by():
+        record_return(row['actual_return_date'], -row['n'])
+
+
+def rebuild_library_daily_stats():
+    """إعادة بناء الجدول اليومي بالكامل من LibraryLoan. يرجع عدد الأيام."""
+    from .models import LibraryLoan, LibraryLoanDailyStats
+
+    days = {}
+    for row in LibraryLoan.objects.values('loan_date').annotate(n=Count('id')).order_by():
+        days.setdefault(row['loan_date'], [0, 0])[0] = row['n']
+    returned = LibraryLoan.objects.filter(is_returned=True, actual_return_date__isnull=False)
+    for row in returned.values('actual_return_date').annotate(n=Count('id')).order_by():
+        days.setdefault(row['actual_return_date'], [0, 0])[1] = row['n']
+    with transaction.atomic():
+        LibraryLoanDailyStats.objects.all().delete()
+        LibraryLoanDailyStats.objects.bulk_create(
+            [LibraryLoanDailyStats(date=d, loans=l, returns=r) for d, (l, r) in days.items() if d is not None],
+            batch_size=500,
+        )
+    return len(days)
+
+
+def loan_window_counts(today=None):
+    """عدد الإعارات لكل نافذة من الجدول اليومي (استعلام واحد)."""
+    from .models import LibraryLoanDailyStats
+
+    today = today or date.today()
+    oldest = today - timedelta(days=max(days for _, days in STAT_WINDOWS))
+    totals = LibraryLoanDailyStats.objects.filter(date__gte=oldest).aggregate(**{
+        name: Sum('loans', filter=Q(date=today) if days == 0 else Q(date__gte=today - timedelta(days=days)))
+        for name, days in STAT_WINDOWS
+    })
+    return {name: totals[name] or 0 for name, _ in STAT_WINDOWS}
+
+
+def overdue_loans(today=None):
+    """الإعارات المتأخرة مع عدد أيام التأخير، في استعلام واحد."""
+    from .models import LibraryLoan
+
+    today = today or date.today()
+    rows = (
+        LibraryLoan.objects.filter(is_returned=False, expected_return_date__lt=today)
+        .annotate(overdue=ExpressionWrapper(
+            Value(today, output_field=DateField()) - F('expected_return_date'), output_field=DurationField(),
+        ))
+        .values('student__last_name', 'student__first_name', 'student__class_name', 'book_title',
+                'loan_date', 'expected_return_date', 'overdue')
+    )
+    return [{
+        'student_name': f"{r['student__last_name']} {r['student__first_name']}",
+        'student_class': r['student__class_name'],
+        'book_title': r['book_title'],
+        'loan_date': r['loan_date'],
+        'expected_return': r['expected_return_date'],
+        'days_overdue': r['overdue'].days,
+    } for r in rows]
+
+
+def borrower_distributions():
+    """
+    عدد القرّاء وتوزيعهم حسب القسم والمستوى من استعلام واحد على التلاميذ
+    (EXISTS على الإعارات بدل التجميع على كامل سجل الإعارات).
+    """
+    from .models import LibraryLoan, Student
+
+    borrowers = list(
+        Student.objects.filter(Exists(LibraryLoan.objects.filter(student=OuterRef('pk'))))
+        .values_list('class_name', 'academic_year')
+    )
+    by_class, by_level = {}, {}
+    for class_name, level in borrowers:
+        by_class[class_name] = by_class.get(class_name, 0) + 1
+        by_level[level] = by_level.get(level, 0) + 1
+
+    def _sorted(counts, key):
+        # مرتبة بالقيمة (القيم الفارغة None في النهاية)
+        return [{key: k, 'count': counts[k]} for k in sorted(counts, key=lambda k: (k is None, k or ''))]
+
+    return len(borrowers), _sorted(by_class, 'student__class_name'), _sorted(by_level, 'student__academic_year')
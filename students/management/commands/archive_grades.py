@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from students.grade_archive import enqueue_grade_archive, run_pending_jobs
+from students.models import Grade, GradeArchiveJob
+from students.school_year_utils import get_current_school_year
+
+
+class Command(BaseCommand):
+    help = 'Run (or resume) pending grade archival jobs; --year queues the archival of a past school year first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', default=None, help='Past school year whose remaining grades should be archived')
+
+    def handle(self, *args, **options):
+        year = options['year']
+        if year:
+            if year == get_current_school_year():
+                self.stderr.write(self.style.ERROR(f"{year} is the current school year."))
+                return
+            if Grade.objects.filter(academic_year=year).exists():
+                enqueue_grade_archive(year, get_current_school_year(), start=False)
+        count = run_pending_jobs()
+        for job in GradeArchiveJob.objects.filter(status=GradeArchiveJob.STATUS_FAILED).order_by('-finished_at')[:count]:
+            self.stderr.write(self.style.WARNING(f"{job.old_year}: {job.message}"))
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} grade archive job(s)."))
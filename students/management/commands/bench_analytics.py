@@ -0,0 +1,128 @@
+import random
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from students.analytics_utils import format_class_name, format_class_names, exemption_mask, _level_key
+
+LEVELS = ['أولى', 'ثانية', 'ثالثة متوسط', 'رابعة', '4 متوسط']
+SUBJECTS = ['اللغة العربية', 'الرياضيات', 'اللغة الفرنسية', 'اللغة الإنجليزية', 'التربية الإسلامية',
+            'التربية المدنية', 'التاريخ والجغرافيا', 'العلوم الطبيعية', 'العلوم الفيزيائية',
+            'المعلوماتية', 'التربية التشكيلية', 'التربية الموسيقية', 'التربية البدنية', 'الأمازيغية']
+TERMS = ['الفصل الأول', 'الفصل الثاني', 'الفصل الثالث']
+
+
+def legacy_format_class_names(d):
+    """التنفيذ السابق (سطراً بسطر) — مرجع للمقارنة."""
+    return d.apply(lambda row: format_class_name(row['student__academic_year'], row['student__class_name']), axis=1)
+
+
+def legacy_exemption_mask(d, rules):
+    """التنفيذ السابق: حلقة على القواعد مع إعادة تطبيع المادة و_level_key لكل صف في كل قاعدة."""
+    subj_norm = d['subject'].astype(str).str.strip()
+    term_norm = d['term'].astype(str).str.strip()
+    mask_exempt = pd.Series(False, index=d.index)
+    for r in rules:
+        if not isinstance(r, dict):
+            continue
+        r_subj = str(r.get('subject') or '').strip()
+        if not r_subj:
+            continue
+        r_scope = str(r.get('scope_type') or '').strip()
+        r_term = str(r.get('term') or '').strip()
+        r_subj_norm = r_subj.replace('ال', '', 1) if r_subj.startswith('ال') else r_subj
+        subj_norm_alt = subj_norm.str.replace('^ال', '', regex=True).str.strip()
+        m = (subj_norm == r_subj) | (subj_norm == r_subj_norm) | (subj_norm_alt == r_subj) | (subj_norm_alt == r_subj_norm)
+        if r_term:
+            m = m & (term_norm == r_term)
+        if r_scope == 'student':
+            sid = r.get('student_id')
+            if not sid:
+                continue
+            m = m & (d['student__id'] == int(sid))
+        elif r_scope == 'class':
+            cc = str(r.get('class_code') or '').strip()
+            if not cc:
+                continue
+            m = m & (d['__class_code_effective'] == cc)
+        elif r_scope == 'level':
+            lvl = str(r.get('academic_year') or '').strip()
+            rule_level_key = _level_key(lvl) if lvl else None
+            if not rule_level_key:
+                continue
+            m = m & (d['student__academic_year'].apply(lambda x: _level_key(x)) == rule_level_key)
+        elif r_scope != 'school':
+            continue
+        mask_exempt = mask_exempt | m
+    return mask_exempt
+
+
+def synthetic_grades(students=900, seed=1):
+    rnd = random.Random(seed)
+    rows = []
+    for sid in range(1, students + 1):
+        level = rnd.choice(LEVELS)
+        class_name = str(rnd.randint(1, 6))
+        for term in TERMS:
+            for subject in SUBJECTS:
+                rows.append({
+                    'student__id': sid,
+                    'student__academic_year': level,
+                    'student__class_name': class_name,
+                    'student__class_code': None,
+                    'subject': subject,
+                    'term': term,
+                    'score': round(rnd.uniform(0, 20), 2),
+                })
+    return pd.DataFrame(rows)
+
+
+def synthetic_rules(count=40, students=900, seed=2):
+    rnd = random.Random(seed)
+    rules = []
+    for _ in range(count):
+        scope = rnd.choice(['student', 'class', 'level', 'school'])
+        rules.append({
+            'subject': rnd.choice(SUBJECTS).replace('ال', '', 1) if rnd.random() < 0.3 else rnd.choice(SUBJECTS),
+            'scope_type': scope,
+            'student_id': rnd.randint(1, students) if scope == 'student' else None,
+            'academic_year': rnd.choice(LEVELS) if scope == 'level' else '',
+            'class_code': f"{rnd.randint(1, 4)}م{rnd.randint(1, 6)}" if scope == 'class' else '',
+            'term': rnd.choice(TERMS + ['']),
+        })
+    return rules
+
+
+class Command(BaseCommand):
+    help = 'Benchmark class-name formatting and exemption rules in analyze_grades_locally (before/after)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=900)
+        parser.add_argument('--rules', type=int, default=40)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def _best(self, fn, repeat):
+        best, result = None, None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        d = synthetic_grades(options['students'])
+        rules = synthetic_rules(options['rules'], options['students'])
+        self.stdout.write(f"{len(d)} grade rows, {len(rules)} exemption rules")
+
+        t_old, old = self._best(lambda: legacy_format_class_names(d), options['repeat'])
+        t_new, new = self._best(lambda: format_class_names(d['student__academic_year'], d['student__class_name']), options['repeat'])
+        assert old.tolist() == new.tolist()
+        self.stdout.write(f"format_class_name: before {t_old * 1000:.1f} ms, after {t_new * 1000:.1f} ms (x{t_old / t_new:.0f})")
+
+        d['__class_code_effective'] = new
+        t_old, old = self._best(lambda: legacy_exemption_mask(d, rules), options['repeat'])
+        t_new, new = self._best(lambda: exemption_mask(d, rules), options['repeat'])
+        assert old.tolist() == new.tolist()
+        self.stdout.write(f"exemption rules:   before {t_old * 1000:.1f} ms, after {t_new * 1000:.1f} ms (x{t_old / t_new:.0f}), {int(new.sum())} rows exempt")
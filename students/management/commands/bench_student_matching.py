@@ -0,0 +1,99 @@
+import random
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from students.expert_import_utils import StudentMatchIndex, find_student_advanced
+
+LAST_NAMES = ['بن علي', 'بوزيد', 'حمادي', 'قاسمي', 'مسعودي', 'زروقي', 'بلقاسم', 'عبد الرحمان', 'سعيدي',
+              'بن يحيى', 'عمراني', 'شريف', 'منصوري', 'بوعلام', 'رحماني', 'خليفة', 'العربي', 'بن عيسى']
+FIRST_NAMES = ['محمد', 'أحمد', 'فاطمة الزهراء', 'إيمان', 'ياسين', 'أسامة', 'مريم', 'عبد الله', 'خديجة',
+               'إسلام', 'آية', 'رانية', 'يوسف', 'إبراهيم', 'سارة', 'هاجر', 'أمين', 'نور الهدى', 'رقية']
+GENDERS = ['ذكر', 'أنثى']
+
+
+def _spelling_variant(rnd, name):
+    """اختلافات الكتابة الشائعة بين ملفات السنوات (همزات، تاء مربوطة، ياء/ألف مقصورة)."""
+    for a, b in (('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ة', 'ه'), ('ي', 'ى')):
+        if a in name and rnd.random() < 0.3:
+            name = name.replace(a, b)
+    return name
+
+
+def synthetic_students(count=1000, seed=1):
+    rnd = random.Random(seed)
+    students = []
+    for pk in range(1, count + 1):
+        students.append(SimpleNamespace(
+            pk=pk,
+            last_name=rnd.choice(LAST_NAMES),
+            first_name=rnd.choice(FIRST_NAMES),
+            date_of_birth=date(2008, 1, 1) + timedelta(days=rnd.randint(0, 5 * 365)),
+            gender=rnd.choice(GENDERS),
+        ))
+    return students
+
+
+def synthetic_files(students, files=20, rows=100, seed=2):
+    """صفوف (لقب، اسم، تاريخ ميلاد، جنس) لكل ملف: أسماء بكتابة مختلفة، معكوسة، ناقصة، أو مجهولة."""
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(files):
+        sheet = []
+        for _ in range(rows):
+            s = rnd.choice(students)
+            ln, fn = _spelling_variant(rnd, s.last_name), _spelling_variant(rnd, s.first_name)
+            r = rnd.random()
+            if r < 0.1:
+                ln, fn = fn, ln
+            elif r < 0.15:
+                fn = fn.split()[0]
+            elif r < 0.2:
+                ln, fn = rnd.choice(LAST_NAMES) + ' ' + rnd.choice(LAST_NAMES), rnd.choice(FIRST_NAMES)
+            dob = s.date_of_birth if rnd.random() < 0.8 else None
+            gender = s.gender if rnd.random() < 0.7 else None
+            sheet.append((ln, fn, dob, gender))
+        out.append(sheet)
+    return out
+
+
+class Command(BaseCommand):
+    help = 'Benchmark student matching in api_import_historical_expert_data (before/after)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--files', type=int, default=20)
+        parser.add_argument('--rows', type=int, default=50, help='rows per file (a class list)')
+        parser.add_argument('--repeat', type=int, default=1)
+
+    def _best(self, fn, repeat):
+        best, result = None, None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        students = synthetic_students(options['students'])
+        files = synthetic_files(students, options['files'], options['rows'])
+        self.stdout.write(f"{len(students)} students, {len(files)} files x {options['rows']} rows")
+
+        def legacy():
+            return [getattr(find_student_advanced(students, ln, fn, dob, g), 'pk', None)
+                    for sheet in files for ln, fn, dob, g in sheet]
+
+        def indexed():
+            matcher = StudentMatchIndex(students)  # مرة واحدة لكل طلب استيراد
+            return [getattr(matcher.find(ln, fn, dob, g), 'pk', None)
+                    for sheet in files for ln, fn, dob, g in sheet]
+
+        t_old, old = self._best(legacy, options['repeat'])
+        t_new, new = self._best(indexed, options['repeat'])
+        assert old == new
+        matched = sum(1 for pk in new if pk)
+        self.stdout.write(f"student matching: before {t_old * 1000:.1f} ms, after {t_new * 1000:.1f} ms "
+                          f"(x{t_old / t_new:.0f}), {matched}/{len(new)} rows matched")
@@ -1,4 +1,8 @@
 from django.core.management.base import BaseCommand
+from django.utils import timezone
+from students.canteen_utils import invalidate_barcode_index
+from students.dashboard_stats import invalidate_dashboard_stats
+from students.grade_cube import invalidate_grade_cube
 from students.models import Student
 from bs4 import BeautifulSoup
 import openpyxl
@@ -107,6 +111,7 @@ class Command(BaseCommand):
         to_update = []
         processed_ids = set()
         existing_map = {s.student_id_number: s for s in Student.objects.all()}
+        now = timezone.now()
 
         found_any = False
         error_count = 0
@@ -167,9 +172,13 @@ class Command(BaseCommand):
                         for key, value in student_data.items():
                             if key != 'student_id_number':
                                 setattr(student, key, value)
+                        student.refresh_search_key()
+                        student.updated_at = now  # bulk_update skips auto_now
                         to_update.append(student)
                 else:
-                    to_create.append(Student(**student_data))
+                    student = Student(**student_data)
+                    student.refresh_search_key()
+                    to_create.append(student)
 
             except Exception as e:
                 # Log error but CONTINUE
@@ -186,9 +195,15 @@ class Command(BaseCommand):
             Student.objects.bulk_update(to_update, [
                 'last_name', 'first_name', 'gender', 'date_of_birth', 'place_of_birth',
                 'academic_year', 'class_name', 'attendance_system', 'enrollment_number',
-                'enrollment_date'
+                'enrollment_date', 'search_key', 'updated_at'
             ])
 
+        if to_create or to_update:
+            # Bulk writes send no Student signals: drop the derived caches ourselves
+            invalidate_barcode_index()
+            invalidate_grade_cube()
+            invalidate_dashboard_stats()
+
         if found_any:
             msg = f'Imported: {len(to_create)} New, {len(to_update)} Updated ({mode}). Errors: {error_count}'
             self.stdout.write(self.style.SUCCESS(msg))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from students.expert_utils import prune_expert_runs
+from students.models import ExpertAnalysisRun
+
+
+class Command(BaseCommand):
+    help = 'Delete old expert analysis runs, keeping the last N completed runs per (academic year, term)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=None, help='Completed runs to keep (default: EXPERT_RUNS_TO_KEEP)')
+
+    def handle(self, *args, **options):
+        total = 0
+        pairs = ExpertAnalysisRun.objects.order_by().values_list('academic_year', 'term').distinct()
+        for academic_year, term in list(pairs):
+            total += prune_expert_runs(academic_year, term, keep=options['keep'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} old expert runs."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from students.library_stats import rebuild_library_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily library loan rollup (LibraryLoanDailyStats) from LibraryLoan'
+
+    def handle(self, *args, **options):
+        days = rebuild_library_daily_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt library stats for {days} days."))
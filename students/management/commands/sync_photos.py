@@ -1,13 +1,13 @@
 from django.core.management.base import BaseCommand
-from students.models import Student
-import os
-from django.conf import settings
 
 from students.utils_sync import sync_photos_logic
 
 class Command(BaseCommand):
     help = 'Syncs student photos from media/students_photos based on Student ID'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--no-thumbnails', action='store_true', help='Skip generating card/list thumbnails')
+
     def handle(self, *args, **options):
-        count = sync_photos_logic()
+        count = sync_photos_logic(thumbnails=not options['no_thumbnails'])
         self.stdout.write(self.style.SUCCESS(f"Successfully synced {count} photos."))
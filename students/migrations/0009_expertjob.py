@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0008_employee_remaining_meals"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExpertJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("academic_year", models.CharField(max_length=20, verbose_name="السنة الدراسية")),
+                ("term", models.CharField(max_length=50, verbose_name="الفصل")),
+                ("prev_years", models.JSONField(default=list, verbose_name="السنوات السابقة")),
+                ("dedupe_key", models.CharField(max_length=200, verbose_name="مفتاح منع التكرار")),
+                ("status", models.CharField(choices=[("queued", "في الانتظار"), ("running", "قيد التشغيل"), ("completed", "مكتملة"), ("failed", "فشلت"), ("cancelled", "ملغاة")], db_index=True, default="queued", max_length=20, verbose_name="الحالة")),
+                ("slot", models.PositiveSmallIntegerField(blank=True, null=True, unique=True, verbose_name="خانة التشغيل")),
+                ("progress", models.PositiveSmallIntegerField(default=0, verbose_name="نسبة التقدم")),
+                ("stage", models.CharField(blank=True, default="", max_length=100, verbose_name="المرحلة")),
+                ("message", models.TextField(blank=True, default="", verbose_name="رسالة")),
+                ("cancel_requested", models.BooleanField(default=False, verbose_name="طلب إلغاء")),
+                ("worker", models.CharField(blank=True, default="", max_length=100, verbose_name="العملية المنفذة")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")),
+                ("started_at", models.DateTimeField(blank=True, null=True, verbose_name="تاريخ البدء")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="تاريخ الانتهاء")),
+                ("heartbeat_at", models.DateTimeField(blank=True, null=True, verbose_name="آخر نبضة")),
+                ("requested_by", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name="طلب من طرف")),
+                ("run", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="jobs", to="students.expertanalysisrun", verbose_name="التشغيلة")),
+            ],
+            options={
+                "verbose_name": "مهمة محرك الخبراء",
+                "verbose_name_plural": "مهام محرك الخبراء",
+                "ordering": ["-created_at"],
+                "constraints": [
+                    models.UniqueConstraint(condition=models.Q(("status__in", ["queued", "running"])), fields=("dedupe_key",), name="unique_active_expert_job"),
+                ],
+            },
+        ),
+    ]
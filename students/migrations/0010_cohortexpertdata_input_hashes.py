@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0009_expertjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cohortexpertdata",
+            name="input_hashes",
+            field=models.JSONField(blank=True, default=dict, verbose_name="بصمات المدخلات"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0010_cohortexpertdata_input_hashes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="studentexpertdata",
+            index=models.Index(fields=["run", "academic_year_level"], name="student_expert_run_level_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="cohortexpertdata",
+            index=models.Index(fields=["run", "academic_year_level"], name="cohort_expert_run_level_idx"),
+        ),
+    ]
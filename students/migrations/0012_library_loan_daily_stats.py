@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_daily_stats(apps, schema_editor):
+    LibraryLoan = apps.get_model("students", "LibraryLoan")
+    LibraryLoanDailyStats = apps.get_model("students", "LibraryLoanDailyStats")
+    days = {}
+    for row in LibraryLoan.objects.values("loan_date").annotate(n=Count("id")).order_by():
+        days.setdefault(row["loan_date"], [0, 0])[0] = row["n"]
+    returned = LibraryLoan.objects.filter(is_returned=True, actual_return_date__isnull=False)
+    for row in returned.values("actual_return_date").annotate(n=Count("id")).order_by():
+        days.setdefault(row["actual_return_date"], [0, 0])[1] = row["n"]
+    LibraryLoanDailyStats.objects.bulk_create(
+        [LibraryLoanDailyStats(date=d, loans=l, returns=r) for d, (l, r) in days.items() if d is not None],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0011_expert_run_level_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LibraryLoanDailyStats",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField(unique=True, verbose_name="التاريخ")),
+                ("loans", models.IntegerField(default=0, verbose_name="الإعارات")),
+                ("returns", models.IntegerField(default=0, verbose_name="الإرجاعات")),
+            ],
+            options={
+                "verbose_name": "إحصائيات المكتبة اليومية",
+                "verbose_name_plural": "إحصائيات المكتبة اليومية",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="libraryloan",
+            index=models.Index(fields=["is_returned", "expected_return_date"], name="library_loan_overdue_idx"),
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+from students.student_search import drop_search_index, ensure_search_index, student_search_key
+
+
+def backfill_search_key(apps, schema_editor):
+    Student = apps.get_model("students", "Student")
+    batch = []
+    for s in Student.objects.only("id", "last_name", "first_name", "student_id_number").iterator(chunk_size=1000):
+        s.search_key = student_search_key(s.last_name, s.first_name, s.student_id_number)
+        batch.append(s)
+        if len(batch) >= 1000:
+            Student.objects.bulk_update(batch, ["search_key"])
+            batch = []
+    if batch:
+        Student.objects.bulk_update(batch, ["search_key"])
+
+
+def create_search_index(apps, schema_editor):
+    ensure_search_index(schema_editor.connection)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0012_library_loan_daily_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="student",
+            name="search_key",
+            field=models.CharField(blank=True, default="", editable=False, max_length=250, verbose_name="مفتاح البحث"),
+        ),
+        migrations.RunPython(backfill_search_key, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
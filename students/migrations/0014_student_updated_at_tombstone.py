@@ -0,0 +1,31 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0013_student_search_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="student",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name="آخر تعديل"),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name="StudentTombstone",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("student_pk", models.BigIntegerField(verbose_name="معرّف التلميذ")),
+                ("student_id_number", models.CharField(max_length=16, verbose_name="رقم التعريف")),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="تاريخ الحذف")),
+            ],
+            options={
+                "verbose_name": "تلميذ محذوف",
+                "verbose_name_plural": "التلاميذ المحذوفون",
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0014_student_updated_at_tombstone"),
+    ]
+
+    operations = [
+        # Filled by Student.save and the sync_photos command (content hashes are not computed here)
+        migrations.AddField(
+            model_name="student",
+            name="photo_hash",
+            field=models.CharField(blank=True, db_index=True, default="", editable=False, max_length=40, verbose_name="بصمة الصورة"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0015_student_photo_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GradeImportSession",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("term", models.CharField(max_length=50, verbose_name="الفصل")),
+                ("import_mode", models.CharField(default="local", max_length=20, verbose_name="طريقة الاستيراد")),
+                ("subject_mappings", models.JSONField(blank=True, null=True, verbose_name="ربط المواد")),
+                ("status", models.CharField(choices=[("queued", "في الانتظار"), ("running", "قيد التنفيذ"), ("completed", "مكتملة"), ("failed", "فشلت")], db_index=True, default="queued", max_length=20, verbose_name="الحالة")),
+                ("files", models.JSONField(default=list, verbose_name="الملفات")),
+                ("total_files", models.PositiveIntegerField(default=0, verbose_name="عدد الملفات")),
+                ("done_files", models.PositiveIntegerField(default=0, verbose_name="الملفات المعالجة")),
+                ("grades_count", models.PositiveIntegerField(default=0, verbose_name="العلامات المستوردة")),
+                ("message", models.TextField(blank=True, default="", verbose_name="رسالة")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="آخر تحديث")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="تاريخ الانتهاء")),
+                ("requested_by", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name="طلب من طرف")),
+            ],
+            options={
+                "verbose_name": "جلسة استيراد العلامات",
+                "verbose_name_plural": "جلسات استيراد العلامات",
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0016_gradeimportsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GradeArchiveJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("old_year", models.CharField(max_length=20, verbose_name="السنة المؤرشفة")),
+                ("new_year", models.CharField(max_length=20, verbose_name="السنة الجديدة")),
+                ("status", models.CharField(choices=[("queued", "في الانتظار"), ("running", "قيد التنفيذ"), ("completed", "مكتملة"), ("failed", "فشلت")], db_index=True, default="queued", max_length=20, verbose_name="الحالة")),
+                ("total", models.PositiveIntegerField(default=0, verbose_name="عدد العلامات")),
+                ("archived", models.PositiveIntegerField(default=0, verbose_name="العلامات المؤرشفة")),
+                ("message", models.TextField(blank=True, default="", verbose_name="رسالة")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")),
+                ("started_at", models.DateTimeField(blank=True, null=True, verbose_name="تاريخ البدء")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="تاريخ الانتهاء")),
+                ("heartbeat_at", models.DateTimeField(blank=True, null=True, verbose_name="آخر نبضة")),
+            ],
+            options={
+                "verbose_name": "مهمة أرشفة العلامات",
+                "verbose_name_plural": "مهام أرشفة العلامات",
+                "ordering": ["-created_at"],
+                "constraints": [
+                    models.UniqueConstraint(condition=models.Q(("status__in", ["queued", "running"])), fields=("old_year",), name="unique_active_grade_archive_job"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("students", "0017_gradearchivejob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gradeimportsession",
+            name="slot",
+            field=models.PositiveSmallIntegerField(blank=True, null=True, unique=True, verbose_name="خانة الكتابة"),
+        ),
+        migrations.AddField(
+            model_name="gradeimportsession",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="آخر نبضة"),
+        ),
+    ]
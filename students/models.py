@@ -37,6 +37,12 @@ class Student(models.Model):
     address = models.TextField(null=True, blank=True, verbose_name="عنوان السكن")
     guardian_phone = models.CharField(max_length=20, null=True, blank=True, verbose_name="رقم هاتف الولي")
     photo = models.ImageField(upload_to=student_photo_path, null=True, blank=True, verbose_name="الصورة")
+    # الاسم الكامل ورقم التعريف بعد التوحيد، مفهرس للبحث (انظر student_search.py)
+    search_key = models.CharField(max_length=250, blank=True, default='', editable=False, verbose_name="مفتاح البحث")
+    # آخر تعديل: مؤشر المزامنة التفاضلية للنسخة المحلية (انظر offline_sync.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="آخر تعديل")
+    # بصمة محتوى الصورة: اسم نسخها المصغّرة (انظر photo_variants.py)
+    photo_hash = models.CharField(max_length=40, blank=True, default='', editable=False, db_index=True, verbose_name="بصمة الصورة")
 
     @property
     def full_name(self):
@@ -64,15 +70,46 @@ class Student(models.Model):
             return f"{level_num}م{class_num}"
         return class_str # Fallback to original if can't parse
 
+    def refresh_search_key(self):
+        from .student_search import student_search_key
+        self.search_key = student_search_key(self.last_name, self.first_name, self.student_id_number)
+
+    def refresh_photo_hash(self, old_photo_name=None):
+        """حساب بصمة الصورة إن تغيرت (رفع جديد أو ملف آخر). يرجع True إن تغيرت البصمة."""
+        from .photo_variants import photo_content_hash
+        if not self.photo or 'data:image' in (self.photo.name or ''):
+            changed = bool(self.photo_hash)
+            self.photo_hash = ''
+            return changed
+        if self.photo._committed and self.photo.name == old_photo_name and self.photo_hash:
+            return False
+        try:
+            digest = photo_content_hash(self.photo)
+        except (OSError, ValueError):
+            digest = ''
+        finally:
+            if self.photo._committed:
+                self.photo.close()
+        changed = digest != self.photo_hash
+        self.photo_hash = digest
+        return changed
+
     def save(self, *args, **kwargs):
         # Auto-generate class code
         if not self.class_code or self.class_code == "":
             self.class_code = self.generate_class_code()
 
+        self.refresh_search_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'search_key', 'updated_at', 'photo_hash'}
+
         # Handle Force Photo Replacement and Renaming
+        old_photo_name = None
         if self.pk:
             try:
                 old = Student.objects.get(pk=self.pk)
+                old_photo_name = old.photo.name
 
                 # Case 1: Photo Replacement (Delete old file)
                 if old.photo and self.photo and old.photo != self.photo:
@@ -106,8 +143,15 @@ class Student(models.Model):
             except Student.DoesNotExist:
                 pass
 
+        photo_changed = self.refresh_photo_hash(old_photo_name)
         super().save(*args, **kwargs)
 
+        if photo_changed and self.photo_hash:
+            from django.db import transaction
+            from .photo_variants import generate_variants
+            sources = {self.photo_hash: self.photo.path}
+            transaction.on_commit(lambda: generate_variants(sources))
+
     class Meta:
         verbose_name = "تلميذ"
         verbose_name_plural = "التلاميذ"
@@ -115,6 +159,20 @@ class Student(models.Model):
     def __str__(self):
         return f"{self.last_name} {self.first_name}"
 
+
+class StudentTombstone(models.Model):
+    """أثر تلميذ محذوف، لتبليغ النسخ المحلية بالحذف (انظر offline_sync.py)."""
+    student_pk = models.BigIntegerField(verbose_name="معرّف التلميذ")
+    student_id_number = models.CharField(max_length=16, verbose_name="رقم التعريف")
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="تاريخ الحذف")
+
+    class Meta:
+        verbose_name = "تلميذ محذوف"
+        verbose_name_plural = "التلاميذ المحذوفون"
+
+    def __str__(self):
+        return f"{self.student_id_number} ({self.deleted_at:%Y-%m-%d})"
+
 class CanteenAttendance(models.Model):
     REG_SCAN = 'scan'
     REG_MANUAL = 'manual'
@@ -187,10 +245,27 @@ class LibraryLoan(models.Model):
     class Meta:
         verbose_name = "إعارة كتاب"
         verbose_name_plural = "إعارات الكتب"
+        indexes = [
+            models.Index(fields=['is_returned', 'expected_return_date'], name='library_loan_overdue_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.book_title}"
 
+
+class LibraryLoanDailyStats(models.Model):
+    """عدد الإعارات والإرجاعات لكل يوم (تُحدَّث تدريجياً، انظر library_stats.py)."""
+    date = models.DateField(unique=True, verbose_name="التاريخ")
+    loans = models.IntegerField(default=0, verbose_name="الإعارات")
+    returns = models.IntegerField(default=0, verbose_name="الإرجاعات")
+
+    class Meta:
+        verbose_name = "إحصائيات المكتبة اليومية"
+        verbose_name_plural = "إحصائيات المكتبة اليومية"
+
+    def __str__(self):
+        return f"{self.date}: {self.loans}/{self.returns}"
+
 class SchoolSettings(models.Model):
     name = models.CharField(max_length=200, null=True, blank=True, verbose_name="اسم المؤسسة")
     academic_year = models.CharField(max_length=50, null=True, blank=True, verbose_name="السنة الدراسية")
@@ -609,6 +684,9 @@ class StudentExpertData(models.Model):
     class Meta:
         verbose_name = "بيانات التلميذ (الخبراء)"
         verbose_name_plural = "بيانات التلاميذ (الخبراء)"
+        indexes = [
+            models.Index(fields=['run', 'academic_year_level'], name='student_expert_run_level_idx'),
+        ]
 
 class CohortExpertData(models.Model):
     run = models.ForeignKey(ExpertAnalysisRun, on_delete=models.CASCADE, related_name='cohort_data', verbose_name="التشغيلة")
@@ -627,9 +705,113 @@ class CohortExpertData(models.Model):
     sensitivity_betas = models.JSONField(default=dict, verbose_name="معاملات الحساسية (Beta)")
     ruling_subject = models.CharField(max_length=100, null=True, blank=True, verbose_name="المادة الحاكمة")
 
+    # بصمات مدخلات المستوى (انظر expert_utils._level_input_hashes) لإعادة الحساب التزايدي
+    input_hashes = models.JSONField(default=dict, blank=True, verbose_name="بصمات المدخلات")
+
     class Meta:
         verbose_name = "بيانات الفوج (الخبراء)"
         verbose_name_plural = "بيانات الأفواج (الخبراء)"
+        indexes = [
+            models.Index(fields=['run', 'academic_year_level'], name='cohort_expert_run_level_idx'),
+        ]
+
+class ExpertJob(models.Model):
+    """
+    مهمة تشغيل محرك الخبراء (انظر expert_jobs.py).
+    الجدول مشترك بين كل العمليات (workers): التقدم والإلغاء ومنع التكرار تمر عبره.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'في الانتظار'),
+        (STATUS_RUNNING, 'قيد التشغيل'),
+        (STATUS_COMPLETED, 'مكتملة'),
+        (STATUS_FAILED, 'فشلت'),
+        (STATUS_CANCELLED, 'ملغاة'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    academic_year = models.CharField(max_length=20, verbose_name="السنة الدراسية")
+    term = models.CharField(max_length=50, verbose_name="الفصل")
+    prev_years = models.JSONField(default=list, verbose_name="السنوات السابقة")
+    # مفتاح منع التكرار: نفس (السنة، الفصل، السنوات السابقة) لا تُشغَّل مرتين معاً
+    dedupe_key = models.CharField(max_length=200, verbose_name="مفتاح منع التكرار")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True, verbose_name="الحالة")
+    # خانة التشغيل (1..N): قيد فريد يضمن ألا يتجاوز عدد المحركات العاملة N عبر كل العمليات
+    slot = models.PositiveSmallIntegerField(null=True, blank=True, unique=True, verbose_name="خانة التشغيل")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="نسبة التقدم")
+    stage = models.CharField(max_length=100, blank=True, default='', verbose_name="المرحلة")
+    message = models.TextField(blank=True, default='', verbose_name="رسالة")
+    cancel_requested = models.BooleanField(default=False, verbose_name="طلب إلغاء")
+    run = models.ForeignKey(ExpertAnalysisRun, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs', verbose_name="التشغيلة")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="طلب من طرف")
+    worker = models.CharField(max_length=100, blank=True, default='', verbose_name="العملية المنفذة")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ البدء")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ الانتهاء")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="آخر نبضة")
+
+    class Meta:
+        verbose_name = "مهمة محرك الخبراء"
+        verbose_name_plural = "مهام محرك الخبراء"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_expert_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.academic_year} - {self.term} ({self.status} {self.progress}%)"
+
+
+class GradeImportSession(models.Model):
+    """
+    جلسة استيراد ملفات العلامات دفعة واحدة (انظر grade_import_jobs.py).
+    التقدم ونتيجة كل ملف تُكتب هنا، والواجهة تستعلم عنها دورياً بدل انتظار الطلب.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'في الانتظار'),
+        (STATUS_RUNNING, 'قيد التنفيذ'),
+        (STATUS_COMPLETED, 'مكتملة'),
+        (STATUS_FAILED, 'فشلت'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    term = models.CharField(max_length=50, verbose_name="الفصل")
+    import_mode = models.CharField(max_length=20, default='local', verbose_name="طريقة الاستيراد")
+    subject_mappings = models.JSONField(null=True, blank=True, verbose_name="ربط المواد")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True, verbose_name="الحالة")
+    # [{'name', 'path', 'status', 'count', 'message'}] بترتيب الرفع
+    files = models.JSONField(default=list, verbose_name="الملفات")
+    total_files = models.PositiveIntegerField(default=0, verbose_name="عدد الملفات")
+    done_files = models.PositiveIntegerField(default=0, verbose_name="الملفات المعالجة")
+    grades_count = models.PositiveIntegerField(default=0, verbose_name="العلامات المستوردة")
+    message = models.TextField(blank=True, default='', verbose_name="رسالة")
+    # خانة الكاتب الوحيد عبر كل العمليات (فريدة؛ تُحرَّر عند الانتهاء)
+    slot = models.PositiveSmallIntegerField(null=True, blank=True, unique=True, verbose_name="خانة الكتابة")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="آخر نبضة")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="طلب من طرف")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخر تحديث")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ الانتهاء")
+
+    class Meta:
+        verbose_name = "جلسة استيراد العلامات"
+        verbose_name_plural = "جلسات استيراد العلامات"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.term} ({self.status} {self.done_files}/{self.total_files})"
 
 # ==========================================================
 # EXPERT ANALYSIS & HISTORICAL DATA
@@ -662,6 +844,50 @@ class HistoricalGrade(models.Model):
         return f"{self.student} - {self.subject} - {self.score}"
 
 
+class GradeArchiveJob(models.Model):
+    """
+    أرشفة علامات السنة المنتهية بعد تغيير السنة في الإعدادات (انظر grade_archive.py).
+    تُنفَّذ خارج حفظ الإعدادات على دفعات؛ كل دفعة تُنقل وتُحذف معاً، فالمهمة تُستأنف من حيث توقفت.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'في الانتظار'),
+        (STATUS_RUNNING, 'قيد التنفيذ'),
+        (STATUS_COMPLETED, 'مكتملة'),
+        (STATUS_FAILED, 'فشلت'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    old_year = models.CharField(max_length=20, verbose_name="السنة المؤرشفة")
+    new_year = models.CharField(max_length=20, verbose_name="السنة الجديدة")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True, verbose_name="الحالة")
+    total = models.PositiveIntegerField(default=0, verbose_name="عدد العلامات")
+    archived = models.PositiveIntegerField(default=0, verbose_name="العلامات المؤرشفة")
+    message = models.TextField(blank=True, default='', verbose_name="رسالة")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الطلب")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ البدء")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ الانتهاء")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="آخر نبضة")
+
+    class Meta:
+        verbose_name = "مهمة أرشفة العلامات"
+        verbose_name_plural = "مهام أرشفة العلامات"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['old_year'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_grade_archive_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.old_year} ({self.status} {self.archived}/{self.total})"
+
+
 class HistoricalImportFile(models.Model):
     """سجل الملفات المستوردة لنتائج السنوات السابقة (حسب السنة)."""
     historical_year = models.CharField(max_length=20, db_index=True)
@@ -680,8 +906,19 @@ class HistoricalImportFile(models.Model):
 # ----------------------------------------------------------
 # Auto-archive grades when school year changes
 # ----------------------------------------------------------
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
+from django.db import transaction
+
+
+@receiver(pre_save, sender=SchoolSettings)
+@receiver(post_save, sender=SchoolSettings)
+@receiver(post_delete, sender=SchoolSettings)
+def _invalidate_school_settings_cache(sender, **kwargs):
+    """إلغاء نسخة الإعدادات المخزنة مؤقتاً (settings_utils) قبل الحفظ وبعده وبعد الـ commit."""
+    from .settings_utils import invalidate_school_settings
+    invalidate_school_settings()
+    transaction.on_commit(invalidate_school_settings)
 
 
 @receiver(pre_save, sender=SchoolSettings)
@@ -690,9 +927,11 @@ def _archive_grades_on_year_change(sender, instance, **kwargs):
     عند تغيير السنة الدراسية في الإعدادات:
     ننقل علامات السنة القديمة من Grade إلى HistoricalGrade/HistoricalStudent (لكل الفصول)،
     ثم نحذفها من Grade حتى تبدأ السنة الجديدة نظيفة.
+    هنا نسجل السنة القديمة فقط؛ الأرشفة مهمة خلفية بعد نجاح الحفظ (انظر grade_archive.py).
 
     ملاحظة: الأرشفة تعتمد على student_id_number كمعرف ثابت.
     """
+    instance._archive_year_change = None
     if not instance.pk:
         return
     try:
@@ -703,64 +942,96 @@ def _archive_grades_on_year_change(sender, instance, **kwargs):
     new_year = (instance.academic_year or '').strip()
     if not old_year or not new_year or old_year == new_year:
         return
+    instance._archive_year_change = (old_year, new_year)
+
+
+@receiver(post_save, sender=SchoolSettings)
+def _enqueue_grade_archive(sender, instance, **kwargs):
+    change = getattr(instance, '_archive_year_change', None)
+    if not change or not Grade.objects.filter(academic_year=change[0]).exists():
+        return
+    from .grade_archive import enqueue_grade_archive
+    enqueue_grade_archive(*change)
+
+
+# ----------------------------------------------------------
+# Canteen barcode index invalidation (see canteen_utils)
+# ----------------------------------------------------------
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def _invalidate_canteen_barcode_index(sender, **kwargs):
+    from .canteen_utils import invalidate_barcode_index
+    invalidate_barcode_index()
+
+
+@receiver(post_save, sender=CanteenAttendance)
+def _mark_canteen_attendance(sender, instance, created, **kwargs):
+    if not created or not instance.student_id:
+        return
+    from .canteen_utils import mark_eaten
+    student_id, day = instance.student_id, instance.date
+    # لا نعلّم إلا بعد الـ commit حتى لا يبقى أثر لإدراج تم التراجع عنه
+    transaction.on_commit(lambda: mark_eaten(student_id, day))
+
 
-    from django.db import transaction
-    from .import_utils import standardize_subject_name
-
-    with transaction.atomic():
-        grades_qs = Grade.objects.filter(academic_year=old_year).select_related('student')
-        if not grades_qs.exists():
-            return
-
-        # 1) Ensure HistoricalStudent exists per student_id_number for old_year
-        # Build cache: student_id_number -> HistoricalStudent
-        id_nums = list(grades_qs.values_list('student__student_id_number', flat=True).distinct())
-        id_nums = [x for x in id_nums if x]
-        existing = {
-            hs.student_id_number: hs
-            for hs in HistoricalStudent.objects.filter(historical_year=old_year, student_id_number__in=id_nums)
-        }
-
-        # Create missing historical students
-        to_create = []
-        students = Student.objects.filter(student_id_number__in=id_nums)
-        for s in students:
-            sid = (s.student_id_number or '').strip()
-            if not sid or sid in existing:
-                continue
-            to_create.append(HistoricalStudent(
-                student_id_number=sid,
-                first_name=s.first_name,
-                last_name=s.last_name,
-                date_of_birth=s.date_of_birth,
-                academic_year=s.academic_year or '',
-                class_name=s.class_name or '',
-                class_code=s.class_code or None,
-                historical_year=old_year,
-            ))
-        if to_create:
-            HistoricalStudent.objects.bulk_create(to_create, ignore_conflicts=True)
-            existing = {
-                hs.student_id_number: hs
-                for hs in HistoricalStudent.objects.filter(historical_year=old_year, student_id_number__in=id_nums)
-            }
-
-        # 2) Archive grades
-        hist_grade_objs = []
-        for g in grades_qs:
-            sid = (getattr(g.student, 'student_id_number', '') or '').strip()
-            hs = existing.get(sid)
-            if not hs:
-                continue
-            hist_grade_objs.append(HistoricalGrade(
-                student=hs,
-                subject=standardize_subject_name(g.subject),
-                term=g.term,
-                score=g.score,
-                historical_year=old_year
-            ))
-        if hist_grade_objs:
-            HistoricalGrade.objects.bulk_create(hist_grade_objs, ignore_conflicts=True)
-
-        # 3) Delete archived grades from Grade
-        grades_qs.delete()
+@receiver(post_delete, sender=CanteenAttendance)
+def _unmark_canteen_attendance(sender, instance, **kwargs):
+    if not instance.student_id:
+        return
+    from .canteen_utils import unmark_eaten
+    unmark_eaten(instance.student_id, instance.date)
+
+
+# ----------------------------------------------------------
+# Library daily rollup (see library_stats)
+# ----------------------------------------------------------
+@receiver(pre_delete, sender=Student)
+def _forget_student_library_loans(sender, instance, **kwargs):
+    """إعارات التلميذ تُحذف بالتتابع (CASCADE): نطرحها من الجدول اليومي قبل ذلك."""
+    from .library_stats import forget_student_loans
+    forget_student_loans(instance.pk)
+
+
+# ----------------------------------------------------------
+# Dashboard counters invalidation (see dashboard_stats)
+# ----------------------------------------------------------
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_save, sender=CanteenAttendance)
+@receiver(post_delete, sender=CanteenAttendance)
+def _invalidate_dashboard_stats(sender, **kwargs):
+    from .dashboard_stats import invalidate_dashboard_stats
+    invalidate_dashboard_stats()
+    transaction.on_commit(invalidate_dashboard_stats)
+
+
+# ----------------------------------------------------------
+# Grade cube invalidation (see grade_cube)
+# ----------------------------------------------------------
+# لا نستمع لـ post_delete على Grade حتى لا نُفقد الحذف الجماعي سرعته؛
+# مسارات الحذف الجماعي تستدعي invalidate_grade_cube مباشرة.
+@receiver(post_save, sender=Grade)
+def _invalidate_grade_cube_on_grade(sender, instance, **kwargs):
+    from .grade_cube import invalidate_grade_cube
+    year = instance.academic_year
+    invalidate_grade_cube(year)
+    transaction.on_commit(lambda: invalidate_grade_cube(year))
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def _invalidate_grade_cube_on_student(sender, **kwargs):
+    from .grade_cube import invalidate_grade_cube
+    invalidate_grade_cube()
+    transaction.on_commit(invalidate_grade_cube)
+
+
+# ----------------------------------------------------------
+# Offline change feed tombstones (see offline_sync)
+# ----------------------------------------------------------
+@receiver(post_delete, sender=Student)
+def _record_student_tombstone(sender, instance, **kwargs):
+    from .offline_sync import record_student_tombstone
+    record_student_tombstone(instance)
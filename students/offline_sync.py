@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+المزامنة التفاضلية للنسخة المحلية (offline_bootstrap).
+
+- Student.updated_at يتغير مع كل حفظ (auto_now)؛ المسارات الجماعية (bulk_update) تضبطه بنفسها.
+- حذف تلميذ يترك أثراً في StudentTombstone (إشارة post_delete)، تُحذف الآثار بعد
+  TOMBSTONE_RETENTION_DAYS؛ مؤشر أقدم من ذلك يعني نسخة كاملة جديدة.
+- المؤشر (cursor) هو وقت الخادم عند بداية الرد؛ الطلب التالي يأخذ ما تغير منذ
+  المؤشر مع هامش FEED_OVERLAP (التحديث على العميل بالمعرّف، فالتكرار لا يضر).
+- الرد NDJSON (سطر meta، ثم سطر لكل تلميذ، ثم سطر لكل حذف) مضغوط gzip أثناء البث.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+FEED_OVERLAP = timedelta(seconds=5)
+FEED_CHUNK_SIZE = 500
+TOMBSTONE_RETENTION_DAYS = getattr(settings, 'OFFLINE_TOMBSTONE_DAYS', 90)
+
+
+def record_student_tombstone(student):
+    from .models import StudentTombstone
+
+    StudentTombstone.objects.create(student_pk=student.pk, student_id_number=student.student_id_number)
+
+
+def prune_tombstones(now=None):
+    from .models import StudentTombstone
+
+    now = now or timezone.now()
+    return StudentTombstone.objects.filter(deleted_at__lt=now - timedelta(days=TOMBSTONE_RETENTION_DAYS)).delete()[0]
+
+
+def parse_cursor(value):
+    """المؤشر المرسل من العميل (ISO) أو None لنسخة كاملة."""
+    if not value:
+        return None
+    dt = parse_datetime(str(value).strip().replace(' ', '+'))
+    if dt is None:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone.get_current_timezone())
+    return dt
+
+
+def student_change_feed(since=None, now=None):
+    """
+    مولّد قواميس: {'type': 'meta', ...} ثم {'type': 'student', 'student': {...}}
+    ثم {'type': 'deleted', 'id': ...}. since=None (أو أقدم من فترة الاحتفاظ) = نسخة كاملة.
+    """
+    from .models import Student, StudentTombstone
+    from .serializers import StudentListSerializer
+
+    now = now or timezone.now()
+    prune_tombstones(now)
+    full = since is None or since < now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+
+    students = Student.objects.order_by('id')
+    if not full:
+        students = students.filter(updated_at__gte=since - FEED_OVERLAP)
+    yield {'type': 'meta', 'full': full, 'cursor': now.isoformat(), 'generated_at': now.isoformat()}
+
+    chunk = []
+    for student in students.iterator(chunk_size=FEED_CHUNK_SIZE):
+        chunk.append(student)
+        if len(chunk) >= FEED_CHUNK_SIZE:
+            for row in StudentListSerializer(chunk, many=True).data:
+                yield {'type': 'student', 'student': row}
+            chunk = []
+    for row in StudentListSerializer(chunk, many=True).data:
+        yield {'type': 'student', 'student': row}
+
+    if not full:
+        deleted = StudentTombstone.objects.filter(deleted_at__gte=since - FEED_OVERLAP)
+        for pk in deleted.values_list('student_pk', flat=True).distinct():
+            yield {'type': 'deleted', 'id': pk}
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """ضغط gzip تدريجي لمولّد bytes (لا يُجمع الرد كاملاً في الذاكرة)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+نسخ مشتقة (مصغّرة) من صور التلاميذ: بطاقة الطباعة، القوائم، نافذة مسح المطعم.
+
+- المصدر: media/students_photos/<رقم_التعريف>.<امتداد>
+- Student.photo_hash: بصمة محتوى الصورة الأصلية (sha1)، تُحسب عند حفظ الصورة أو مزامنتها.
+- النسخ: media/students_photos/variants/<الحجم>/<البصمة>.webp (أو .jpg إن لم يدعم
+  Pillow صيغة WebP). الاسم مشتق من المحتوى، فالرابط لا يتغير ما لم تتغير الصورة،
+  ويُخدم بترويسة immutable (انظر views.photo_variant).
+- التوليد عند الحفظ (بعد الـ commit) وعند المزامنة (مجمع خيوط: Pillow وhashlib
+  يحرران الـ GIL)، وعند أول طلب لنسخة مفقودة.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PHOTO_DIR = 'students_photos'
+VARIANTS_DIR = 'variants'
+# أقصى (عرض، ارتفاع) لكل حجم
+VARIANT_SIZES = {
+    'card': (300, 400),
+    'list': (96, 128),
+    'scan': (240, 320),
+}
+VARIANT_QUALITY = 82
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+HASH_LENGTH = 20
+_HASH_CHUNK = 1024 * 1024
+
+_variant_ext = None
+
+
+def photo_dir():
+    return os.path.join(settings.MEDIA_ROOT, PHOTO_DIR)
+
+
+def safe_photo_id(student_id_number):
+    # نفس منطق student_photo_path
+    return str(student_id_number).replace('/', '_').replace('\\', '_').strip()
+
+
+def variant_ext():
+    global _variant_ext
+    if _variant_ext is None:
+        from PIL import features
+        _variant_ext = 'webp' if features.check('webp') else 'jpg'
+    return _variant_ext
+
+
+def variant_name(digest, size):
+    """المسار النسبي (داخل MEDIA_ROOT) لنسخة."""
+    return f'{PHOTO_DIR}/{VARIANTS_DIR}/{size}/{digest}.{variant_ext()}'
+
+
+def variant_url(digest, size):
+    from django.urls import reverse
+    return reverse('photo_variant', args=[size, digest, variant_ext()])
+
+
+def photo_content_hash(source):
+    """بصمة المحتوى من مسار ملف أو من FieldFile/File (بما فيها ملف مرفوع لم يُحفظ بعد)."""
+    h = hashlib.sha1()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                h.update(chunk)
+    else:
+        for chunk in source.chunks(_HASH_CHUNK):
+            h.update(chunk)
+        source.seek(0)
+    return h.hexdigest()[:HASH_LENGTH]
+
+
+def render_variant(src_path, dest_path, box):
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as im:
+        im.draft('RGB', box)  # فك JPEG بدقة مخفّضة مباشرة
+        im = ImageOps.exif_transpose(im).convert('RGB')
+        im.thumbnail(box, Image.LANCZOS)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp = f'{dest_path}.tmp'
+        im.save(tmp, 'WEBP' if variant_ext() == 'webp' else 'JPEG', quality=VARIANT_QUALITY)
+    os.replace(tmp, dest_path)
+
+
+def _render_one(src_path, digest, size):
+    try:
+        render_variant(src_path, os.path.join(settings.MEDIA_ROOT, variant_name(digest, size)), VARIANT_SIZES[size])
+        return True
+    except Exception as e:
+        logger.warning('Photo variant %s/%s failed: %s', size, digest, e)
+        return False
+
+
+def _existing_variants(size):
+    """بصمات النسخ الموجودة لحجم معيّن (قراءة المجلد مرة واحدة)."""
+    try:
+        with os.scandir(os.path.join(photo_dir(), VARIANTS_DIR, size)) as it:
+            return {os.path.splitext(e.name)[0] for e in it if e.name.endswith(f'.{variant_ext()}')}
+    except OSError:
+        return set()
+
+
+def _workers(workers=None):
+    return workers or getattr(settings, 'PHOTO_THUMB_WORKERS', None) or min(8, os.cpu_count() or 1)
+
+
+def generate_variants(sources, sizes=None, workers=None):
+    """
+    sources: {digest: src_path}. يولّد النسخ المفقودة فقط (الاسم مشتق من المحتوى،
+    فالنسخة الموجودة صحيحة دائماً). يرجع عدد النسخ المولّدة.
+    """
+    jobs = []
+    for size in sizes or VARIANT_SIZES:
+        existing = _existing_variants(size)
+        jobs.extend((src_path, digest, size) for digest, src_path in sources.items() if digest not in existing)
+    if not jobs:
+        return 0
+    if len(jobs) == 1:
+        return int(_render_one(*jobs[0]))
+    with ThreadPoolExecutor(max_workers=_workers(workers), thread_name_prefix='photo-variant') as pool:
+        return sum(pool.map(lambda job: _render_one(*job), jobs))
+
+
+def hash_files(paths, workers=None):
+    """{key: path} -> {key: digest} بالتوازي (الملفات غير المقروءة تُهمل)."""
+    def _one(item):
+        key, path = item
+        try:
+            return key, photo_content_hash(path)
+        except OSError as e:
+            logger.warning('Cannot hash photo %s: %s', path, e)
+            return key, None
+
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=_workers(workers), thread_name_prefix='photo-hash') as pool:
+        return {key: digest for key, digest in pool.map(_one, paths.items()) if digest}
+
+
+def photo_variant_url(student, size):
+    """رابط النسخة إن عُرفت بصمة الصورة، وإلا None (يستعمل المستدعي الصورة الأصلية)."""
+    digest = getattr(student, 'photo_hash', '')
+    return variant_url(digest, size) if digest else None
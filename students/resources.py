@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.utils import timezone
 from import_export import resources, fields
 from import_export.widgets import DateWidget
 from .models import Student
@@ -21,9 +23,31 @@ class StudentResource(resources.ModelResource):
 
     class Meta:
         model = Student
-        exclude = ('id',)
+        exclude = ('id', 'search_key', 'updated_at', 'photo_hash')
         import_id_fields = ('student_id_number',)
         skip_unchanged = True
         report_skipped = True
         use_bulk = True
         batch_size = 1000
+
+    def before_save_instance(self, instance, row, **kwargs):
+        # use_bulk bypasses Student.save (and bulk_update skips auto_now)
+        instance.refresh_search_key()
+        instance.updated_at = timezone.now()
+
+    def get_bulk_update_fields(self):
+        return super().get_bulk_update_fields() + ['search_key', 'updated_at']
+
+    def after_import(self, dataset, result, **kwargs):
+        # Bulk writes send no Student signals: drop the derived caches ourselves
+        if kwargs.get('dry_run') or not (result.totals.get('new') or result.totals.get('update')):
+            return
+        from .canteen_utils import invalidate_barcode_index
+        from .dashboard_stats import invalidate_dashboard_stats
+        from .grade_cube import invalidate_grade_cube
+
+        def invalidate():
+            invalidate_barcode_index()
+            invalidate_grade_cube()
+            invalidate_dashboard_stats()
+        transaction.on_commit(invalidate)
@@ -26,8 +26,8 @@ def get_current_school_year():
     السنة الحالية من إعدادات المؤسسة.
     إن لم تُحدَّد، تُرجع 2025-2026 كقيمة احتياطية.
     """
-    from .models import SchoolSettings
-    settings = SchoolSettings.objects.first()
+    from .settings_utils import get_school_settings
+    settings = get_school_settings()
     if settings and settings.academic_year:
         return str(settings.academic_year).strip()
     return "2025-2026"
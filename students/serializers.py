@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Student, CanteenAttendance, LibraryLoan, SchoolSettings, ArchiveDocument, SystemMessage, UserRole, PendingUpdate, Task, SchoolMemory
+from .photo_variants import photo_variant_url
 from django.conf import settings
 from django.core.files.base import ContentFile
 import uuid
@@ -87,6 +88,7 @@ class StudentListSerializer(serializers.ModelSerializer):
     """
     level = serializers.SerializerMethodField()
     photo_url = serializers.SerializerMethodField()
+    photo_thumb_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Student
@@ -95,7 +97,7 @@ class StudentListSerializer(serializers.ModelSerializer):
             'class_name', 'class_code', 'academic_year', 'level', 'gender', 'date_of_birth',
             'place_of_birth', 'attendance_system', 'enrollment_date',
             'enrollment_number', 'exit_date', 'guardian_name', 'mother_name',
-            'guardian_phone', 'address', 'photo', 'photo_url'
+            'guardian_phone', 'address', 'photo', 'photo_url', 'photo_thumb_url'
         ]
 
     def get_level(self, obj):
@@ -121,6 +123,10 @@ class StudentListSerializer(serializers.ModelSerializer):
             return f'{settings.MEDIA_URL}students_photos/{safe_id}.jpg'
         return None
 
+    def get_photo_thumb_url(self, obj):
+        # Small list-size variant (content-addressed, cached forever by the browser)
+        return photo_variant_url(obj, 'list')
+
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         ret['photo'] = ret['photo_url']
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+وصول مُخزَّن مؤقتاً (cache) إلى صف إعدادات المؤسسة SchoolSettings.
+
+الصف يتغير بضع مرات في السنة، بينما تقرؤه أغلب مسارات الطلبات (المطعم، السنة
+الدراسية، تسجيل الدخول...). نحفظه في ذاكرة العملية وفي ذاكرة Django المؤقتة
+المضبوطة (CACHES)، مع تحليل حقول JSON مرة واحدة، ونُلغي النسخة عند كل حفظ/حذف
+عبر إشارات SchoolSettings (انظر models.py).
+
+تنبيه: الكائن المُرجَع مشترك بين الطلبات؛ للقراءة فقط. مسارات التعديل تقرأ الصف
+من قاعدة البيانات مباشرة ثم تحفظه.
+"""
+import json
+import threading
+import time as _time
+
+from django.core.cache import cache
+from django.db import connection
+
+CACHE_KEY = 'school_settings:v1'
+# مع ذاكرة مشتركة (Redis/Memcached) الإلغاء فوري لكل العمليات؛
+# مع LocMemCache (الافتراضي) تبقى العمليات الأخرى متأخرة بحد أقصى CACHE_TIMEOUT.
+CACHE_TIMEOUT = 60
+LOCAL_TTL = 10
+
+_lock = threading.Lock()
+_local = None
+_local_at = 0.0
+
+
+def parse_json_dict(value):
+    """حقول JSON قد تُخزَّن أحياناً كنص: نرجع dict دائماً."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value) if value.strip() else {}
+        except (ValueError, TypeError):
+            value = {}
+    return value if isinstance(value, dict) else {}
+
+
+def _load():
+    from .models import SchoolSettings
+
+    obj = SchoolSettings.objects.order_by('id').first()
+    return {
+        'obj': obj,
+        'canteen_meals_by_date': parse_json_dict(obj.canteen_meals_by_date) if obj else {},
+        'subject_coefficients_by_level': parse_json_dict(obj.subject_coefficients_by_level) if obj else {},
+        'award_thresholds': parse_json_dict(obj.award_thresholds) if obj else {},
+    }
+
+
+def _get_entry():
+    global _local, _local_at
+    # داخل معاملة (transaction) قد تكون القيمة غير مؤكدة بعد: نقرأ من القاعدة ولا نخزّن
+    if connection.in_atomic_block:
+        return _load()
+
+    with _lock:
+        if _local is not None and _time.monotonic() - _local_at < LOCAL_TTL:
+            return _local
+
+    entry = cache.get(CACHE_KEY)
+    if entry is None:
+        entry = _load()
+        cache.set(CACHE_KEY, entry, CACHE_TIMEOUT)
+
+    with _lock:
+        _local = entry
+        _local_at = _time.monotonic()
+    return entry
+
+
+def get_school_settings():
+    """صف SchoolSettings (أو None) من الذاكرة المؤقتة. للقراءة فقط."""
+    return _get_entry()['obj']
+
+
+def get_canteen_meals_map():
+    """وصف الوجبات حسب التاريخ {"2026-04-21": "..."} (مُحلَّل مسبقاً)."""
+    return _get_entry()['canteen_meals_by_date']
+
+
+def get_subject_coefficients_by_level():
+    """معاملات المواد حسب المستوى (مُحلَّلة مسبقاً)."""
+    return _get_entry()['subject_coefficients_by_level']
+
+
+def get_award_thresholds():
+    """مجالات الإجازات الخام كما حُفظت (مُحلَّلة مسبقاً)."""
+    return _get_entry()['award_thresholds']
+
+
+def invalidate_school_settings(**kwargs):
+    """إلغاء النسخة المخزنة (محلياً وفي CACHES). تُستدعى من إشارات SchoolSettings."""
+    global _local
+    with _lock:
+        _local = None
+    cache.delete(CACHE_KEY)
@@ -248,6 +248,33 @@ async function tryOfflineStudentFilters(urlStr) {
 
 const OFFLINE_BOOTSTRAP_LOADER_MIN_MS = 480;
 
+/** دمج رد NDJSON (meta ثم student/deleted) مع النسخة المحفوظة؛ full=true يستبدلها */
+function applyBootstrapFeed(prevData, text) {
+    const byId = new Map();
+    let meta = null;
+    for (const line of text.split('\n')) {
+        if (!line.trim()) continue;
+        const rec = JSON.parse(line);
+        if (rec.type === 'meta') {
+            meta = rec;
+            if (!rec.full && prevData && Array.isArray(prevData.students)) {
+                prevData.students.forEach((s) => byId.set(s.id, s));
+            }
+        } else if (rec.type === 'student') {
+            byId.set(rec.student.id, rec.student);
+        } else if (rec.type === 'deleted') {
+            byId.delete(rec.id);
+        }
+    }
+    if (!meta) throw new Error('bootstrap feed without meta');
+    return {
+        generated_at: meta.generated_at,
+        cursor: meta.cursor,
+        students: Array.from(byId.values()).sort((a, b) => a.id - b.id),
+        students_truncated: false,
+    };
+}
+
 async function refreshOfflineBootstrap() {
     if (!bazaNetOk()) return;
     const showLoader = userEligibleForOfflineBootstrapUi();
@@ -256,26 +283,31 @@ async function refreshOfflineBootstrap() {
     let savedCount = 0;
     if (showLoader) setOfflineBootstrapLoaderVisible(true);
     try {
-        const r = await originalFetch('/canteen/api/offline/bootstrap/?_t=' + Date.now(), {
-            credentials: 'same-origin',
-        });
+        const prev = await db.cache.get(BOOTSTRAP_KEY);
+        const cursor = prev && prev.data && prev.data.cursor ? prev.data.cursor : '';
+        const r = await originalFetch(
+            '/canteen/api/offline/bootstrap/?since=' + encodeURIComponent(cursor) + '&_t=' + Date.now(),
+            { credentials: 'same-origin' }
+        );
         if (!r.ok) {
             console.warn('[OfflineManager] bootstrap HTTP', r.status, r.statusText);
             return;
         }
-        const data = await r.json();
-        if (Array.isArray(data.students)) {
-            await db.cache.put({ key: BOOTSTRAP_KEY, data, timestamp: Date.now() });
-            savedStudents = true;
-            savedCount = data.students.length;
-        } else {
+        const contentType = r.headers.get('content-type') || '';
+        if (contentType.includes('application/json')) {
+            // لا نسخة محلية لهذا المستخدم
             await db.cache.delete(BOOTSTRAP_KEY);
             if (showLoader) {
                 console.warn(
                     '[OfflineManager] لم تُمنح نسخة محلية (فعّل «العمل بالنسخة المحلية» من إدارة المستخدمين مع تسيير/مطعم).'
                 );
             }
+            return;
         }
+        const data = applyBootstrapFeed(prev && prev.data, await r.text());
+        await db.cache.put({ key: BOOTSTRAP_KEY, data, timestamp: Date.now() });
+        savedStudents = true;
+        savedCount = data.students.length;
     } catch (e) {
         console.warn('[OfflineManager] bootstrap failed', e);
     } finally {
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+استيراد التلاميذ الجماعي بذاكرة ثابتة تقريباً.
+
+- من القاعدة نحتفظ فقط بـ {رقم التعريف: (pk، بصمة الصف)}؛ البصمة تُحسب من قيم
+  حقول الاستيراد (values_list على دفعات، بدون كائنات Student).
+- الصف الذي تطابق بصمته بصمة القاعدة يُتجاوز. الصفوف المتغيرة تُقارن حقلاً بحقل
+  ولا يُكتب إلا ما تغير (bulk_update مجمّع حسب مجموعة الحقول المتغيرة).
+- الكتابة على دفعات ثابتة الحجم، كل دفعة في معاملة، مع تبليغ بالتقدم.
+"""
+import hashlib
+import logging
+from datetime import date
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FIELDS = (
+    'last_name', 'first_name', 'gender', 'date_of_birth', 'place_of_birth',
+    'academic_year', 'class_name', 'attendance_system', 'enrollment_number',
+    'enrollment_date', 'guardian_name', 'mother_name', 'address', 'guardian_phone',
+)
+# الحقول التي يُشتق منها search_key
+SEARCH_FIELDS = {'last_name', 'first_name'}
+BATCH_SIZE = 500
+
+
+def _norm(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def row_hash(values):
+    return hashlib.sha1('\x1f'.join(_norm(v) for v in values).encode('utf-8')).hexdigest()[:16]
+
+
+def existing_student_hashes():
+    """{student_id_number: (pk, بصمة حقول الاستيراد)}."""
+    from .models import Student
+
+    out = {}
+    rows = Student.objects.order_by().values_list('pk', 'student_id_number', *IMPORT_FIELDS)
+    for pk, sid, *values in rows.iterator(chunk_size=2000):
+        out[sid] = (pk, row_hash(values))
+    return out
+
+
+class StudentImportError(Exception):
+    """فشل دفعة أثناء الاستيراد؛ result يحمل ما كُتب فعلاً (الدفعات السابقة ثبتت في القاعدة)."""
+
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def import_students(rows, update_existing=False, batch_size=BATCH_SIZE, progress=None):
+    """
+    rows: قواميس فيها student_id_number وحقول IMPORT_FIELDS (القيم محللة مسبقاً).
+    progress(done, total): يُستدعى بعد كل دفعة.
+    يرجع {'created', 'updated', 'unchanged', 'batches'}.
+    فشل دفعة يرفع StudentImportError مع عدادات ما كُتب قبلها.
+    """
+    from .models import Student
+
+    existing = existing_student_hashes()
+    incoming = {}
+    for row in rows:
+        incoming[row['student_id_number']] = row  # آخر صف يغلب عند تكرار الرقم
+
+    to_create, changed = [], {}
+    unchanged = 0
+    for sid, row in incoming.items():
+        match = existing.get(sid)
+        if match is None:
+            s = Student(student_id_number=sid, **{f: row.get(f) for f in IMPORT_FIELDS})
+            s.refresh_search_key()
+            to_create.append(s)
+        elif update_existing and row_hash(row.get(f) for f in IMPORT_FIELDS) != match[1]:
+            changed[match[0]] = row
+        else:
+            unchanged += 1
+    del existing
+
+    total = len(to_create) + len(changed)
+    done = batches = created = updated = 0
+
+    def result():
+        return {'created': created, 'updated': updated, 'unchanged': unchanged, 'batches': batches}
+
+    try:
+        for batch in _batches(to_create, batch_size):
+            with transaction.atomic():
+                Student.objects.bulk_create(batch)
+            created += len(batch)
+            done += len(batch)
+            batches += 1
+            if progress:
+                progress(done, total)
+
+        now = timezone.now()
+        for pks in _batches(list(changed), batch_size):
+            groups = {}
+            current_rows = Student.objects.filter(pk__in=pks).values_list('pk', 'student_id_number', *IMPORT_FIELDS)
+            for pk, sid, *values in current_rows:
+                row = changed[pk]
+                fields = [f for f, old in zip(IMPORT_FIELDS, values) if _norm(old) != _norm(row.get(f))]
+                if not fields:
+                    continue
+                s = Student(pk=pk, student_id_number=sid, **{f: row.get(f) for f in IMPORT_FIELDS})
+                if SEARCH_FIELDS.intersection(fields):
+                    s.refresh_search_key()
+                    fields.append('search_key')
+                s.updated_at = now  # bulk_update skips auto_now
+                groups.setdefault(tuple(fields) + ('updated_at',), []).append(s)
+            with transaction.atomic():
+                batch_updated = 0
+                for fields, objs in groups.items():
+                    Student.objects.bulk_update(objs, list(fields))
+                    batch_updated += len(objs)
+            updated += batch_updated
+            done += len(pks)
+            batches += 1
+            if progress:
+                progress(done, total)
+    except Exception as e:
+        logger.exception('Student import failed after %d batches', batches)
+        raise StudentImportError(str(e), result()) from e
+
+    logger.info('Student import: %d created, %d updated, %d unchanged (%d batches)',
+                created, updated, unchanged, batches)
+    return result()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+البحث عن التلاميذ بالاسم أو رقم التعريف.
+
+- Student.search_key: "اللقب الاسم رقم_التعريف" بعد التوحيد (أ/إ/آ←ا، ة←ه، ى←ي، حذف
+  التشكيل والتطويل، أحرف صغيرة). يُحدَّث في Student.save وفي مسارات الاستيراد الجماعي.
+- SQLite: جدول FTS5 بمقطّع trigram (محتوى خارجي = students_student) تُبقيه المشغّلات
+  (triggers) متزامناً. إعادة بناء الجدول في ترحيل لاحق تحذف المشغّلات، لذا يُعاد
+  إنشاؤها بعد كل migrate (انظر apps.py).
+- PostgreSQL: فهرس GIN بـ gin_trgm_ops، يخدم LIKE '%...%' مباشرة.
+- search_students هي واجهة البحث الوحيدة (API التلاميذ وطباعة البطاقات).
+"""
+from django.db import connection as default_connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .utils import normalize_arabic
+
+SEARCH_TABLE = 'students_student_search'
+PG_INDEX = 'student_search_key_trgm_idx'
+# أقصر جزء يمكن لفهرس trigram أن يخدمه
+MIN_NGRAM = 3
+
+_fts_ready = {}
+
+
+def fold_search_text(text):
+    text = normalize_arabic(str(text or '')).replace('ـ', '')
+    return ' '.join(text.lower().split())
+
+
+def student_search_key(last_name, first_name, student_id_number):
+    return fold_search_text(f'{last_name or ""} {first_name or ""} {student_id_number or ""}')
+
+
+def _sqlite_statements():
+    t = SEARCH_TABLE
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {t} USING fts5("
+        f"search_key, content='students_student', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {t}_ai AFTER INSERT ON students_student BEGIN "
+        f"INSERT INTO {t}(rowid, search_key) VALUES (new.id, new.search_key); END",
+        f"CREATE TRIGGER IF NOT EXISTS {t}_ad AFTER DELETE ON students_student BEGIN "
+        f"INSERT INTO {t}({t}, rowid, search_key) VALUES ('delete', old.id, old.search_key); END",
+        f"CREATE TRIGGER IF NOT EXISTS {t}_au AFTER UPDATE OF search_key ON students_student BEGIN "
+        f"INSERT INTO {t}({t}, rowid, search_key) VALUES ('delete', old.id, old.search_key); "
+        f"INSERT INTO {t}(rowid, search_key) VALUES (new.id, new.search_key); END",
+        f"INSERT INTO {t}({t}) VALUES ('rebuild')",
+    ]
+
+
+def ensure_search_index(connection=None):
+    """إنشاء فهرس البحث (ومشغّلاته) إن لم يوجد وإعادة بنائه. آمن للتكرار."""
+    connection = connection or default_connection
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        columns = set()
+        if 'students_student' in connection.introspection.table_names(cursor):
+            columns = {c.name for c in connection.introspection.get_table_description(cursor, 'students_student')}
+    if 'search_key' not in columns:
+        return False  # الترحيل 0013 غير مطبق بعد (أو تم التراجع عنه)
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            if vendor == 'sqlite':
+                for sql in _sqlite_statements():
+                    cursor.execute(sql)
+            elif vendor == 'postgresql':
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON students_student USING gin (search_key gin_trgm_ops)'
+                )
+    except Exception:
+        # SQLite بدون FTS5/trigram، أو مستخدم PostgreSQL بدون صلاحية CREATE EXTENSION:
+        # البحث يبقى صحيحاً عبر LIKE على search_key
+        _fts_ready[connection.alias] = False
+        return False
+    _fts_ready.pop(connection.alias, None)
+    return True
+
+
+def drop_search_index(connection=None):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for suffix in ('_ai', '_ad', '_au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+    _fts_ready.pop(connection.alias, None)
+
+
+def _sqlite_fts_available(connection):
+    alias = connection.alias
+    if alias not in _fts_ready:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [SEARCH_TABLE])
+            _fts_ready[alias] = cursor.fetchone() is not None
+    return _fts_ready[alias]
+
+
+def search_students(queryset, text):
+    """
+    تصفية queryset التلاميذ: كل كلمة من النص يجب أن تظهر (كجزء) في search_key،
+    بأي ترتيب (اللقب/الاسم/رقم التعريف).
+    """
+    terms = fold_search_text(text).split()
+    if not terms:
+        return queryset
+    connection = default_connection
+    use_fts = connection.vendor == 'sqlite' and _sqlite_fts_available(connection)
+    for term in terms:
+        if use_fts and len(term) >= MIN_NGRAM:
+            phrase = '"%s"' % term.replace('"', '""')
+            queryset = queryset.filter(
+                id__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE search_key MATCH %s', (phrase,))
+            )
+        else:
+            queryset = queryset.filter(search_key__contains=term)
+    return queryset
+
@@ -80,3 +80,12 @@ def get_student_photo_url(student):
         return f'{settings.MEDIA_URL}students_photos/{safe_id}.jpg'
 
     return None
+
+@register.filter
+def get_student_photo_variant_url(student, size):
+    """
+    URL of a resized variant (card/list/scan) of the student's photo,
+    falling back to the original photo when no variant is known yet.
+    """
+    from students.photo_variants import photo_variant_url
+    return photo_variant_url(student, size) or get_student_photo_url(student)
@@ -0,0 +1,35 @@
+import pandas as pd
+from django.test import SimpleTestCase
+
+from students.analytics_utils import format_class_names, exemption_mask
+from students.management.commands.bench_analytics import (
+    legacy_exemption_mask, legacy_format_class_names, synthetic_grades, synthetic_rules,
+)
+
+
+class VectorizedAnalyticsTests(SimpleTestCase):
+    def test_format_class_names_matches_row_wise(self):
+        d = pd.DataFrame({
+            'student__academic_year': ['أولى', 'ثانية متوسط', '4', None, 'مستوى', 'أولى', 'ثالثة'],
+            'student__class_name': ['1', 'قسم 2', '03', '1', '5', None, 'أ'],
+        })
+        self.assertEqual(
+            format_class_names(d['student__academic_year'], d['student__class_name']).tolist(),
+            legacy_format_class_names(d).tolist(),
+        )
+        self.assertEqual(format_class_names(d.iloc[:0]['student__academic_year'], d.iloc[:0]['student__class_name']).tolist(), [])
+
+    def test_exemption_mask_matches_rule_loop(self):
+        d = synthetic_grades(students=60)
+        d['__class_code_effective'] = format_class_names(d['student__academic_year'], d['student__class_name'])
+        rules = synthetic_rules(count=30, students=60) + [
+            {'subject': 'رياضيات', 'scope_type': 'class', 'class_code': '1م1', 'term': ''},
+            {'subject': 'العلوم الطبيعية', 'scope_type': 'level', 'academic_year': 'رابعة متوسط', 'term': 'الفصل الأول'},
+            {'subject': 'الرياضيات', 'scope_type': 'student', 'student_id': 999999, 'term': ''},
+            {'subject': '', 'scope_type': 'school'},
+            {'subject': 'المعلوماتية', 'scope_type': 'unknown'},
+            'not a rule',
+        ]
+        expected = legacy_exemption_mask(d, rules)
+        self.assertTrue(expected.any())
+        self.assertEqual(exemption_mask(d, rules).tolist(), expected.tolist())
@@ -0,0 +1,161 @@
+from datetime import date, time
+from io import BytesIO
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from students import canteen_utils
+from students.models import CanteenAttendance, EmployeeProfile, SchoolSettings, Student
+
+
+class CanteenScanTests(TestCase):
+    def setUp(self):
+        canteen_utils.reset_canteen_index()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='canteen', password='password')
+        EmployeeProfile.objects.create(user=self.user, role='canteen', permissions=['canteen_scan'])
+        self.client.force_authenticate(user=self.user)
+
+        # Canteen open all day, every day
+        SchoolSettings.objects.create(
+            canteen_open_time=time(0, 0),
+            canteen_close_time=time(23, 59, 59),
+            canteen_days='0,1,2,3,4,5,6',
+        )
+        self.student = self._student('1000000000000001', 'نصف داخلي')
+
+    def tearDown(self):
+        canteen_utils.reset_canteen_index()
+
+    def _student(self, sid, system):
+        return Student.objects.create(
+            student_id_number=sid, last_name='Test', first_name='Student', gender='M',
+            date_of_birth='2010-01-01', place_of_birth='City', academic_year='أولى',
+            class_name='1', attendance_system=system, enrollment_number='1',
+            enrollment_date='2020-01-01',
+        )
+
+    def _scan(self, barcode):
+        return self.client.post('/canteen/scan_card/', {'barcode': barcode}, format='json')
+
+    def test_scan_records_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self._scan(self.student.student_id_number)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['student']['id'], self.student.id)
+        self.assertEqual(resp.data['student']['last_name'], 'Test')
+        self.assertTrue(canteen_utils.has_eaten(self.student.id))
+
+        resp = self._scan(self.student.student_id_number)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.data['code'], 'ALREADY_ATE')
+        self.assertEqual(CanteenAttendance.objects.count(), 1)
+
+    def test_duplicate_caught_by_constraint_when_bitset_is_stale(self):
+        self.assertEqual(self._scan(self.student.student_id_number).status_code, 201)
+        canteen_utils.unmark_eaten(self.student.id, CanteenAttendance.objects.get().date)
+
+        resp = self._scan(self.student.student_id_number)
+        self.assertEqual(resp.data['code'], 'ALREADY_ATE')
+        self.assertEqual(CanteenAttendance.objects.count(), 1)
+
+    def test_not_half_board_and_not_found(self):
+        other = self._student('1000000000000002', 'خارجي')
+        resp = self._scan(other.student_id_number)
+        self.assertEqual(resp.data['code'], 'NOT_HALF_BOARD')
+
+        resp = self._scan('9999')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.data['code'], 'NOT_FOUND')
+
+    def test_index_follows_student_changes(self):
+        canteen_utils.get_barcode_index()
+        self.student.attendance_system = 'خارجي'
+        self.student.save()
+
+        resp = self._scan(self.student.student_id_number)
+        self.assertEqual(resp.data['code'], 'NOT_HALF_BOARD')
+
+        late = self._student('1000000000000003', 'نصف داخلي')
+        self.assertEqual(self._scan(late.student_id_number).status_code, 201)
+
+    def test_batch_scan_verdicts(self):
+        other = self._student('1000000000000002', 'خارجي')
+        sid = self.student.student_id_number
+        resp = self.client.post('/canteen/scan_card/batch/', {'scans': [
+            {'barcode': sid},
+            {'barcode': sid},
+            {'barcode': other.student_id_number},
+            {'barcode': '9999'},
+            {'barcode': sid, 'timestamp': '2001-01-01T12:00:00'},
+        ]}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        codes = [r['code'] for r in resp.data['results']]
+        self.assertEqual(codes, ['OK', 'ALREADY_ATE', 'NOT_HALF_BOARD', 'NOT_FOUND', 'WRONG_DAY'])
+        self.assertEqual(resp.data['recorded'], 1)
+        self.assertEqual(CanteenAttendance.objects.filter(student=self.student).count(), 1)
+
+        # A second flush of the same scan is deduplicated against today's attendance
+        resp = self._scan(sid)
+        self.assertEqual(resp.data['code'], 'ALREADY_ATE')
+
+    def test_batch_scan_skips_rows_recorded_by_another_worker(self):
+        other = self._student('1000000000000002', 'نصف داخلي')
+        today = date.today()
+        self.assertFalse(canteen_utils.has_eaten(self.student.id, today))  # bitset loaded
+        # Recorded by another worker: bulk_create bypasses post_save, so this bitset doesn't know
+        CanteenAttendance.objects.bulk_create([CanteenAttendance(student=self.student, date=today)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post('/canteen/scan_card/batch/', {'scans': [
+                {'barcode': self.student.student_id_number},
+                {'barcode': other.student_id_number},
+            ]}, format='json')
+        self.assertEqual([r['code'] for r in resp.data['results']], ['ALREADY_ATE', 'OK'])
+        self.assertEqual(resp.data['recorded'], 1)
+        self.assertEqual(CanteenAttendance.objects.count(), 2)
+        self.assertTrue(canteen_utils.has_eaten(self.student.id, today))
+
+    def test_compact_roster_and_delta(self):
+        other = self._student('1000000000000002', 'نصف داخلي')
+        self._student('1000000000000003', 'خارجي')
+        self.assertEqual(self._scan(self.student.student_id_number).status_code, 201)
+
+        full = self.client.get('/canteen/attendance_roster/').data
+        self.assertFalse(full['delta'])
+        self.assertEqual(full['present_count'], 1)
+        self.assertEqual([p['id'] for p in full['present']], [self.student.id])
+        self.assertNotIn('photo_url', full['present'][0])
+        self.assertEqual([a['id'] for a in full['absent']], [other.id])
+
+        # Only scans since the previous poll (within the overlap window) and no absent list
+        self.assertEqual(self._scan(other.student_id_number).status_code, 201)
+        delta = self.client.get('/canteen/attendance_roster/', {'since': full['server_time']}).data
+        self.assertTrue(delta['delta'])
+        self.assertNotIn('absent', delta)
+        self.assertEqual(delta['present_count'], 2)
+        self.assertIn(other.id, [p['id'] for p in delta['present']])
+
+        CanteenAttendance.objects.update(time=time(0, 0))
+        delta = self.client.get('/canteen/attendance_roster/', {'since': delta['server_time']}).data
+        self.assertEqual(delta['present'], [])
+
+    def test_export_streams_one_sheet_per_day_in_range(self):
+        self.user.profile.permissions = ['canteen_scan', 'canteen_export']
+        self.user.profile.save()
+        other = self._student('1000000000000002', 'نصف داخلي')
+        for day, student in ((date(2025, 1, 5), self.student), (date(2025, 1, 6), self.student),
+                             (date(2025, 1, 6), other), (date(2025, 2, 1), other)):
+            CanteenAttendance.objects.create(student=student, date=day, time=time(12, 0))
+
+        resp = self.client.post('/canteen/export_canteen/', {'date_from': '2025-01-01', 'date_to': '2025-01-31'}, format='json')
+        self.assertTrue(resp.streaming)
+        wb = openpyxl.load_workbook(BytesIO(b''.join(resp.streaming_content)))
+        self.assertEqual(wb.sheetnames, ['2025-01-05', '2025-01-06'])
+        rows = list(wb['2025-01-06'].iter_rows(min_row=2, values_only=True))
+        self.assertEqual(sorted(r[3] for r in rows), [self.student.student_id_number, other.student_id_number])
+
+        resp = self.client.post('/canteen/export_canteen/', {'date_from': '2026-01-01'}, format='json')
+        self.assertIn('message', resp.data)
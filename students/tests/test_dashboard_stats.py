@@ -0,0 +1,60 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from students.dashboard_stats import compute_dashboard_stats, get_dashboard_stats
+from students.models import CanteenAttendance, EmployeeProfile, Student
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.students = []
+        for i, (level, system) in enumerate([('أولى', 'نصف داخلي'), ('أولى', 'خارجي'), ('ثانية', 'نصف داخلي'),
+                                              ('ثانية', 'نصف داخلي'), ('', 'خارجي')]):
+            self.students.append(Student.objects.create(
+                student_id_number=str(i), last_name=f'L{i}', first_name='F', gender='ذكر', date_of_birth='2012-03-04',
+                place_of_birth='C', academic_year=level, class_name='1', attendance_system=system,
+                enrollment_number=str(i), enrollment_date='2020-01-01',
+            ))
+        CanteenAttendance.objects.create(student=self.students[0])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_counters_from_one_query(self):
+        with self.assertNumQueries(1):
+            stats = compute_dashboard_stats()
+        self.assertEqual(
+            {k: stats[k] for k in ('total_students', 'half_board_count', 'ext_board_count', 'present_today', 'absent_today')},
+            {'total_students': 5, 'half_board_count': 3, 'ext_board_count': 2, 'present_today': 1, 'absent_today': 2},
+        )
+        self.assertEqual(stats['detailed_stats'], [
+            {'level': 'أولى', 'half': 1, 'ext': 1, 'total': 2},
+            {'level': 'ثانية', 'half': 2, 'ext': 0, 'total': 2},
+            {'level': 'غير محدد', 'half': 0, 'ext': 1, 'total': 1},
+        ])
+
+    def test_cached_until_attendance_or_student_changes(self):
+        self.assertEqual(get_dashboard_stats()['present_today'], 1)
+        with self.assertNumQueries(0):
+            get_dashboard_stats()
+
+        CanteenAttendance.objects.create(student=self.students[2])
+        self.assertEqual(get_dashboard_stats()['present_today'], 2)
+        self.students[4].delete()
+        self.assertEqual(get_dashboard_stats()['total_students'], 4)
+
+    def test_dashboard_render_skips_balance_api(self):
+        user = User.objects.create_user(username='director', password='password')
+        EmployeeProfile.objects.create(user=user, role='director')
+        self.client.login(username='director', password='password')
+        with mock.patch('students.ai_utils.AIService.get_openrouter_balance_info') as balance:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        balance.assert_not_called()
+        self.assertEqual(response.context['present_today'], 1)
+        self.assertIsNone(response.context['openrouter_balance'])
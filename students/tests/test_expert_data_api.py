@@ -0,0 +1,64 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from students.models import CohortExpertData, EmployeeProfile, ExpertAnalysisRun, Student, StudentExpertData
+
+
+class ExpertDataApiTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='director', password='password')
+        EmployeeProfile.objects.create(user=user, role='director')
+        self.client.login(username='director', password='password')
+
+        self.run = ExpertAnalysisRun.objects.create(academic_year='2025-2026', term='الفصل الأول', status='completed')
+        for level in ('أولى متوسط', 'ثانية متوسط'):
+            CohortExpertData.objects.create(run=self.run, academic_year_level=level)
+        for i in range(6):
+            level = 'أولى متوسط' if i < 4 else 'ثانية متوسط'
+            st = Student.objects.create(
+                student_id_number=str(i), last_name=f'L{i}', first_name='F', gender='ذكر', date_of_birth='2012-03-04',
+                place_of_birth='C', academic_year=level, class_name=str(1 + i % 2), attendance_system='خارجي',
+                enrollment_number=str(i), enrollment_date='2020-01-01',
+            )
+            StudentExpertData.objects.create(
+                run=self.run, student=st, class_name=st.class_code, academic_year_level=level,
+                residual=i - 3, current_avg=10 + i, traffic_light='red' if i % 3 == 0 else 'green',
+                status_pattern='مستقر', trend_history=[{'term': 't', 'score': 10 + i}],
+            )
+
+    def _get(self, **params):
+        return self.client.get(reverse('api_expert_data'), params)
+
+    def test_full_response_keeps_shape_without_per_row_queries(self):
+        with self.assertNumQueries(7):  # session, user, profile, run lookup x2, cohorts, students
+            data = self._get().json()
+        self.assertEqual(len(data['students']), 6)
+        self.assertEqual(len(data['cohorts']), 2)
+        row = data['students'][0]
+        self.assertEqual(row['student_name'], 'L0 F')
+        self.assertEqual(row['trend_history'], [{'term': 't', 'score': 10}])
+        self.assertNotIn('pagination', data)
+
+    def test_filter_sort_and_paginate(self):
+        data = self._get(level='أولى', traffic_light='green', sort='-current_avg', include_history=0).json()
+        self.assertEqual([s['current_avg'] for s in data['students']], [12, 11])
+        self.assertNotIn('trend_history', data['students'][0])
+        self.assertEqual([c['level'] for c in data['cohorts']], ['أولى متوسط'])
+
+        data = self._get(sort='residual', page=2, page_size=4).json()
+        self.assertEqual(data['pagination'], {'page': 2, 'page_size': 4, 'total': 6, 'pages': 2})
+        self.assertEqual([s['residual'] for s in data['students']], [1, 2])
+
+        self.assertEqual(self._get(sort='password').status_code, 400)
+
+    def test_ndjson_stream(self):
+        resp = self._get(format='ndjson', include_history=0, class_name=StudentExpertData.objects.first().class_name)
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = [json.loads(line) for line in b''.join(resp.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(lines[0]['type'], 'run')
+        self.assertEqual(lines[0]['run_info']['id'], self.run.id)
+        self.assertEqual(lines[0]['total'], len(lines) - 1)
+        self.assertTrue(all(line['type'] == 'student' and 'trend_history' not in line for line in lines[1:]))
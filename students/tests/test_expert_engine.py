@@ -0,0 +1,128 @@
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from students import expert_utils
+from students.expert_utils import run_expert_engine
+from students.models import CohortExpertData, ExpertAnalysisRun, Grade, StudentExpertData, Student
+
+YEAR = '2025-2026'
+
+
+class IncrementalExpertEngineTests(TestCase):
+    def setUp(self):
+        self.grades = {}
+        for level in ('أولى', 'ثانية'):
+            for i in range(4):
+                st = Student.objects.create(
+                    student_id_number=f'{level}{i}', last_name=f'{level}-{i}', first_name='F', gender='ذكر',
+                    date_of_birth='2012-03-04', place_of_birth='C', academic_year=level, class_name='1',
+                    attendance_system='خارجي', enrollment_number=str(i), enrollment_date='2020-01-01',
+                )
+                for subject, score in (('الرياضيات', 9 + i), ('اللغة العربية', 14 - i)):
+                    g = Grade.objects.create(student=st, subject=subject, term='الفصل الأول', score=score, academic_year=YEAR)
+                    self.grades.setdefault(level, g)
+
+    def _run(self, **kwargs):
+        with mock.patch('students.expert_utils._carry_forward_level', wraps=expert_utils._carry_forward_level) as carry:
+            self.assertTrue(run_expert_engine(YEAR, 'الفصل الأول', '2024-2025', **kwargs))
+        run = ExpertAnalysisRun.objects.order_by('-id').first()
+        carried = sorted(c.args[0].academic_year_level for c in carry.call_args_list)
+        return run, carried
+
+    def _snapshot(self, run):
+        return sorted(
+            (s.student_id, s.academic_year_level, s.current_avg, s.z_score)
+            for s in StudentExpertData.objects.filter(run=run)
+        )
+
+    def test_unchanged_levels_are_carried_forward(self):
+        first, carried = self._run()
+        self.assertEqual(carried, [])
+        self.assertEqual(first.cohort_data.count(), 2)
+
+        second, carried = self._run()
+        self.assertEqual(carried, ['أولى', 'ثانية'])
+        self.assertEqual(self._snapshot(second), self._snapshot(first))
+        self.assertEqual(second.cohort_data.count(), 2)
+
+        # Re-importing one level's grades only recomputes that level
+        g = self.grades['أولى']
+        g.score = 19
+        g.save()
+        third, carried = self._run()
+        self.assertEqual(carried, ['ثانية'])
+        self.assertEqual(third.student_data.count(), 8)
+        self.assertNotEqual(
+            [s for s in self._snapshot(third) if s[1] == 'أولى'],
+            [s for s in self._snapshot(second) if s[1] == 'أولى'],
+        )
+
+    def test_full_run_when_not_incremental(self):
+        self._run()
+        _, carried = self._run(incremental=False)
+        self.assertEqual(carried, [])
+        self.assertEqual(CohortExpertData.objects.filter(input_hashes={}).count(), 0)
+
+    def _results(self, run):
+        cohorts = sorted(
+            (c.academic_year_level, c.current_year_z_score_avg, c.ruling_subject, c.input_hashes)
+            for c in run.cohort_data.all()
+        )
+        students = sorted(
+            (s.student_id, s.academic_year_level, s.class_name, s.current_avg, s.predicted_avg, s.z_score, s.trend_history)
+            for s in run.student_data.all()
+        )
+        return cohorts, students
+
+    @override_settings(EXPERT_ENGINE_WORKERS=2, EXPERT_PARALLEL_MIN_ROWS=0)
+    def test_process_pool_matches_serial(self):
+        with override_settings(EXPERT_ENGINE_WORKERS=1):
+            serial, _ = self._run(incremental=False)
+        with mock.patch('students.expert_utils._analyze_levels_in_pool', wraps=expert_utils._analyze_levels_in_pool) as pool:
+            parallel, _ = self._run(incremental=False)
+        self.assertEqual(pool.call_args.args[1], 2)
+        self.assertEqual(self._results(parallel), self._results(serial))
+
+    @override_settings(EXPERT_ENGINE_WORKERS=2, EXPERT_PARALLEL_MIN_ROWS=0)
+    def test_serial_fallback_when_pool_breaks(self):
+        with mock.patch('students.expert_utils._analyze_levels_in_pool', side_effect=BrokenProcessPool('no fork')):
+            run, _ = self._run(incremental=False)
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(run.cohort_data.count(), 2)
+        self.assertEqual(run.student_data.count(), 8)
+
+
+class ExpertRunStorageTests(TestCase):
+    def _completed_run(self, term='الفصل الأول', status='completed'):
+        run = ExpertAnalysisRun.objects.create(academic_year=YEAR, term=term, status=status)
+        CohortExpertData.objects.create(run=run, academic_year_level='أولى متوسط')
+        return run
+
+    @override_settings(EXPERT_RUNS_TO_KEEP=2)
+    def test_prune_keeps_last_completed_runs_per_term(self):
+        old_failed = self._completed_run(status='failed: x')
+        old = [self._completed_run() for _ in range(2)]
+        kept = [self._completed_run() for _ in range(2)]
+        running = self._completed_run(status='running')
+        other_term = self._completed_run(term='الفصل الثاني')
+
+        self.assertEqual(expert_utils.prune_expert_runs(YEAR, 'الفصل الأول'), 3)
+        self.assertEqual(
+            set(ExpertAnalysisRun.objects.values_list('id', flat=True)),
+            {kept[0].id, kept[1].id, running.id, other_term.id},
+        )
+        self.assertFalse(CohortExpertData.objects.filter(run_id__in=[old_failed.id] + [r.id for r in old]).exists())
+
+    def test_level_filter_uses_exact_stored_levels(self):
+        run = self._completed_run()
+        student = Student.objects.create(
+            student_id_number='1', last_name='L', first_name='F', gender='ذكر', date_of_birth='2012-03-04',
+            place_of_birth='C', academic_year='أولى متوسط', class_name='1', attendance_system='خارجي',
+            enrollment_number='1', enrollment_date='2020-01-01',
+        )
+        for level in ('أولى متوسط', 'ثانية متوسط', 'أولى'):
+            StudentExpertData.objects.create(run=run, student=student, class_name='1', academic_year_level=level)
+        self.assertEqual(expert_utils.levels_matching(run, 'أولى'), ['أولى', 'أولى متوسط'])
+        self.assertEqual(expert_utils.levels_matching(run, 'رابعة'), [])
@@ -0,0 +1,106 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from students import expert_jobs
+from students.models import EmployeeProfile, ExpertAnalysisRun, ExpertJob, Grade, Student
+
+
+class ExpertJobTests(TestCase):
+    def setUp(self):
+        # No background threads in tests: jobs are claimed and run explicitly
+        for target in ('students.expert_jobs.kick', 'students.expert_api_views.kick'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_identical_requests_are_deduplicated(self):
+        job, created = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025', ['2023-2024'])
+        self.assertTrue(created)
+        again, created = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025', ['2023-2024'])
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+        other, created = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الثاني', '2024-2025')
+        self.assertTrue(created)
+        self.assertNotEqual(other.pk, job.pk)
+
+    def test_only_one_engine_runs_at_a_time(self):
+        first, _ = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025')
+        second, _ = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الثاني', '2024-2025')
+
+        claimed = expert_jobs.claim_next_job()
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, ExpertJob.STATUS_RUNNING)
+        self.assertIsNone(expert_jobs.claim_next_job())
+
+        # The slot is released when the job finishes, even if the engine fails
+        with mock.patch('students.expert_jobs.run_expert_engine', return_value=False):
+            self.assertEqual(expert_jobs.run_job(claimed), ExpertJob.STATUS_FAILED)
+        self.assertEqual(expert_jobs.claim_next_job().pk, second.pk)
+
+    def test_cooperative_cancellation(self):
+        job, _ = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025')
+        job = expert_jobs.claim_next_job()
+
+        def engine(*args, progress, **kwargs):
+            progress(10, 'stage one')
+            self.assertEqual(ExpertJob.objects.get(pk=job.pk).progress, 10)
+            expert_jobs.cancel_expert_job(job.pk)
+            progress(50, 'stage two')
+            self.fail('engine should have been stopped')
+
+        with mock.patch('students.expert_jobs.run_expert_engine', side_effect=engine):
+            self.assertEqual(expert_jobs.run_job(job), ExpertJob.STATUS_CANCELLED)
+        job.refresh_from_db()
+        self.assertIsNone(job.slot)
+        self.assertEqual(job.progress, 10)
+
+    def test_cancel_queued_job(self):
+        job, _ = expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025')
+        self.assertTrue(expert_jobs.cancel_expert_job(job.pk))
+        self.assertEqual(ExpertJob.objects.get(pk=job.pk).status, ExpertJob.STATUS_CANCELLED)
+        self.assertIsNone(expert_jobs.claim_next_job())
+
+    def test_engine_reports_progress_to_completion(self):
+        for i in range(3):
+            st = Student.objects.create(
+                student_id_number=str(i), last_name=f'L{i}', first_name='F', gender='ذكر',
+                date_of_birth='2012-03-04', place_of_birth='C', academic_year='أولى', class_name='1',
+                attendance_system='خارجي', enrollment_number=str(i), enrollment_date='2020-01-01',
+            )
+            for subject, score in (('الرياضيات', 10 + i), ('اللغة العربية', 12 - i)):
+                Grade.objects.create(student=st, subject=subject, term='الفصل الأول', score=score, academic_year='2025-2026')
+
+        expert_jobs.enqueue_expert_job('2025-2026', 'الفصل الأول', '2024-2025')
+        self.assertEqual(expert_jobs.run_pending_jobs(wait=False), 1)
+
+        job = ExpertJob.objects.get()
+        self.assertEqual((job.status, job.progress), (ExpertJob.STATUS_COMPLETED, 100))
+        self.assertEqual(job.run.status, 'completed')
+        self.assertEqual(job.run.student_data.count(), 3)
+
+    def test_run_and_status_api(self):
+        user = User.objects.create_user(username='director', password='password')
+        EmployeeProfile.objects.create(user=user, role='director')
+        self.client.login(username='director', password='password')
+
+        resp = self.client.post(reverse('api_expert_run'), json.dumps({'current_year': '2025-2026', 'prev_year': '2024-2025'}),
+                                content_type='application/json')
+        self.assertTrue(resp.json()['created'])
+        job_id = resp.json()['job']['id']
+        resp = self.client.post(reverse('api_expert_run'), json.dumps({'current_year': '2025-2026', 'prev_year': '2024-2025'}),
+                                content_type='application/json')
+        self.assertFalse(resp.json()['created'])
+
+        status = self.client.get(reverse('api_expert_run_status')).json()
+        self.assertTrue(status['running'])
+        self.assertEqual(status['job']['id'], job_id)
+
+        resp = self.client.post(reverse('api_expert_run_cancel'), json.dumps({'job_id': job_id}), content_type='application/json')
+        self.assertEqual(resp.json()['job']['status'], ExpertJob.STATUS_CANCELLED)
+        self.assertFalse(self.client.get(reverse('api_expert_run_status')).json()['running'])
+        self.assertFalse(ExpertAnalysisRun.objects.exists())
@@ -60,3 +60,34 @@ class LibraryTests(TestCase):
         loan.refresh_from_db()
         self.assertTrue(loan.is_returned)
         self.assertEqual(loan.actual_return_date, date.today())
+
+    def test_library_stats_from_daily_rollup(self):
+        from django.core.cache import cache
+        from students.library_stats import rebuild_library_daily_stats
+        from students.models import LibraryLoanDailyStats
+
+        cache.clear()
+        today = date.today()
+        for days_ago in (400, 200, 60, 20, 3, 0):
+            resp = self.client.post('/canteen/library/loan/', {
+                'student_id': self.student.id, 'book_title': f'Book {days_ago}',
+                'loan_date': (today - timedelta(days=days_ago)).isoformat(),
+            }, format='json')
+            self.assertEqual(resp.status_code, 201)
+            if days_ago not in (20, 0):
+                # Loan limit: return books as we go
+                self.client.post('/canteen/library/return/', {'loan_id': resp.data['id']}, format='json')
+
+        resp = self.client.get('/canteen/library/stats/')
+        self.assertEqual(resp.data['stats'], {'daily': 1, 'weekly': 2, 'monthly': 3, 'quarterly': 4, 'yearly': 5})
+        self.assertEqual(resp.data['level_distribution'], [{'student__academic_year': '1', 'count': 1}])
+        overdue = sorted(o['days_overdue'] for o in resp.data['overdue_loans'])
+        self.assertEqual(overdue, [5])  # 20-day-old loan, due after 15 days
+
+        # The incremental rollup matches a full rebuild
+        incremental = sorted(LibraryLoanDailyStats.objects.values_list('date', 'loans', 'returns'))
+        rebuild_library_daily_stats()
+        self.assertEqual(sorted(LibraryLoanDailyStats.objects.values_list('date', 'loans', 'returns')), incremental)
+
+        self.student.delete()
+        self.assertFalse(LibraryLoanDailyStats.objects.exclude(loans=0, returns=0).exists())
@@ -0,0 +1,100 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from students import grade_archive
+from students.models import Grade, GradeArchiveJob, HistoricalGrade, HistoricalStudent, SchoolSettings, Student
+
+
+class GradeArchiveJobTests(TestCase):
+    def setUp(self):
+        # No background thread in tests: jobs are claimed and run explicitly
+        patcher = mock.patch('students.grade_archive.kick')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.settings = SchoolSettings.objects.create(name='S', academic_year='2024-2025')
+        students = [
+            Student.objects.create(
+                student_id_number=sid, last_name='L', first_name='F', gender='ذكر', date_of_birth='2012-01-01',
+                place_of_birth='C', academic_year='أولى', class_name='1', attendance_system='نصف داخلي',
+                enrollment_number=sid, enrollment_date='2020-01-01',
+            )
+            for sid in ('1', '2')
+        ]
+        for s in students:
+            for subject in ('رياضيات', 'اللغه العربيه', 'التربية المدنية'):
+                Grade.objects.create(student=s, subject=subject, term='الفصل الأول', score=12, academic_year='2024-2025')
+        Grade.objects.create(student=students[0], subject='رياضيات', term='الفصل الأول', score=15, academic_year='2025-2026')
+
+    def _change_year(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.settings.academic_year = '2025-2026'
+            self.settings.save()
+
+    def test_year_change_queues_chunked_resumable_archive(self):
+        self._change_year()
+        # Saving the settings only queues the job
+        job = GradeArchiveJob.objects.get()
+        self.assertEqual((job.status, job.old_year, job.new_year), (GradeArchiveJob.STATUS_QUEUED, '2024-2025', '2025-2026'))
+        self.assertEqual(Grade.objects.filter(academic_year='2024-2025').count(), 6)
+        grade_archive.kick.assert_called_once()
+
+        # A first runner archives one chunk, then stops (process killed)
+        job = grade_archive.claim_next_job()
+        grade_archive.archive_chunk('2024-2025', grade_archive.ensure_historical_students('2024-2025'), size=4)
+        GradeArchiveJob.objects.filter(pk=job.pk).update(archived=4, heartbeat_at='2000-01-01T00:00Z')
+
+        # The stale job is resumed and finishes the remaining grades in chunks
+        job = grade_archive.claim_next_job()
+        self.assertEqual(grade_archive.run_archive_job(job, chunk_size=1), GradeArchiveJob.STATUS_COMPLETED)
+        job.refresh_from_db()
+        self.assertEqual((job.archived, job.total), (6, 6))
+
+        self.assertFalse(Grade.objects.filter(academic_year='2024-2025').exists())
+        self.assertEqual(Grade.objects.filter(academic_year='2025-2026').count(), 1)
+        self.assertEqual(HistoricalStudent.objects.filter(historical_year='2024-2025').count(), 2)
+        self.assertEqual(
+            sorted(set(HistoricalGrade.objects.values_list('subject', flat=True))),
+            ['التربية المدنية', 'الرياضيات', 'اللغة العربية'],
+        )
+        self.assertEqual(HistoricalGrade.objects.count(), 6)
+
+        data = self.client.get(reverse('grade_archive_status')).json()
+        self.assertFalse(data['running'])
+        self.assertEqual(data['job']['progress'], 100)
+
+    def test_no_job_without_grades_to_archive(self):
+        Grade.objects.filter(academic_year='2024-2025').delete()
+        self._change_year()
+        self.assertFalse(GradeArchiveJob.objects.exists())
+
+    def test_status_endpoint_resumes_orphaned_job(self):
+        self._change_year()
+        job = grade_archive.claim_next_job()
+        grade_archive.kick.reset_mock()
+        # The runner's process was restarted: the job stays running without heartbeats
+        GradeArchiveJob.objects.filter(pk=job.pk).update(heartbeat_at='2000-01-01T00:00Z')
+
+        data = self.client.get(reverse('grade_archive_status')).json()
+        self.assertTrue(data['running'])
+        self.assertEqual(data['job']['status'], GradeArchiveJob.STATUS_QUEUED)
+        grade_archive.kick.assert_called_once_with()
+
+    def test_settings_page_resumes_orphaned_job_and_polls_progress(self):
+        from django.contrib.auth.models import User
+
+        from students.models import EmployeeProfile
+
+        self._change_year()
+        job = grade_archive.claim_next_job()
+        GradeArchiveJob.objects.filter(pk=job.pk).update(heartbeat_at='2000-01-01T00:00Z')
+        grade_archive.kick.reset_mock()
+        user = User.objects.create_user(username='admin', password='p')
+        EmployeeProfile.objects.create(user=user, role='director')
+        self.client.force_login(user)
+
+        resp = self.client.get(reverse('settings'))
+        self.assertContains(resp, reverse('grade_archive_status'))
+        self.assertEqual(GradeArchiveJob.objects.get().status, GradeArchiveJob.STATUS_QUEUED)
+        grade_archive.kick.assert_called_once_with()
@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+
+import pandas as pd
+
+from django.db.models import Q
+from django.test import TestCase, override_settings
+
+from students import grade_cube
+from students.models import Grade, Student
+
+
+class GradeCubeTests(TestCase):
+    def setUp(self):
+        self.cube_dir = tempfile.mkdtemp()
+        self.override = override_settings(GRADE_CUBE_DIR=self.cube_dir)
+        self.override.enable()
+        grade_cube.invalidate_grade_cube()
+
+        self.year = '2025-2026'
+        a = self._student('1', 'Alpha', 'أولى', '1', '1م1')
+        b = self._student('2', 'Beta', 'أولى', '2', None)
+        c = self._student('3', 'Gamma', 'ثانية', '1', '2م1')
+        for st, math, arabic in ((a, 12, 15), (b, 8, 9.5), (c, 17, 11)):
+            Grade.objects.create(student=st, subject='الرياضيات', term='الفصل الأول', score=math, academic_year=self.year)
+            Grade.objects.create(student=st, subject='اللغة العربية', term='الفصل الأول', score=arabic, academic_year=self.year)
+            Grade.objects.create(student=st, subject='الرياضيات', term='الفصل الثاني', score=math + 1, academic_year=self.year)
+        Grade.objects.create(student=a, subject='الرياضيات', term='الفصل الأول', score=5, academic_year='2024-2025')
+        # save() fills class_code automatically; keep one student without it
+        Student.objects.filter(pk=b.pk).update(class_code=None)
+
+    def tearDown(self):
+        grade_cube.invalidate_grade_cube()
+        self.override.disable()
+        shutil.rmtree(self.cube_dir, ignore_errors=True)
+
+    def _student(self, sid, last_name, level, class_name, class_code):
+        return Student.objects.create(
+            student_id_number=sid, last_name=last_name, first_name='Test', gender='ذكر',
+            date_of_birth='2012-03-04', place_of_birth='City', academic_year=level,
+            class_name=class_name, class_code=class_code, attendance_system='خارجي',
+            enrollment_number=sid, enrollment_date='2020-01-01',
+        )
+
+    def _orm_rows(self, *filters):
+        qs = Grade.objects.filter(*filters, academic_year=self.year).order_by('id')
+        return [(r['student__id'], r['subject'], r['term'], r['score'], r['student__class_code'])
+                for r in qs.values('student__id', 'subject', 'term', 'score', 'student__class_code')]
+
+    def _cube_rows(self, *filters):
+        cube = grade_cube.get_grade_cube(self.year)
+        df = cube.to_frame(cube.mask(*filters))
+        df = df.astype(object).where(df.notna(), None)
+        return list(df[['student__id', 'subject', 'term', 'score', 'student__class_code']].itertuples(index=False, name=None))
+
+    def test_masks_match_orm_filters(self):
+        cases = [
+            (),
+            (Q(term__in=['الفصل الأول']),),
+            (Q(subject__icontains='رياض') | Q(subject__icontains='غير موجودة'),),
+            (Q(student__academic_year='أولى'), Q(student__class_name__endswith='2')),
+            (Q(student__class_code__in=['1م1', '2م1']) | (Q(student__academic_year__icontains='ثانية') & Q(student__class_name__icontains='1')),),
+        ]
+        for filters in cases:
+            with self.subTest(filters=filters):
+                self.assertEqual(self._cube_rows(*filters), self._orm_rows(*filters))
+
+    def test_frame_columns_and_student_fields(self):
+        cube = grade_cube.get_grade_cube(self.year)
+        df = cube.to_frame()
+        self.assertEqual(list(df.columns), list(grade_cube.FRAME_FIELDS))
+        row = df[df['student__last_name'] == 'Beta'].iloc[0]
+        self.assertTrue(pd.isna(row['student__class_code']))
+        self.assertEqual(row['student__date_of_birth'], '2012-03-04')
+        self.assertEqual(row['student__gender'], 'ذكر')
+
+    def test_persisted_and_invalidated_on_grade_save(self):
+        cube = grade_cube.get_grade_cube(self.year)
+        self.assertEqual(len(cube), 9)
+
+        # A fresh process would read the .npz from disk instead of querying
+        grade_cube._memo.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(grade_cube.get_grade_cube(self.year)), 9)
+
+        g = Grade.objects.filter(academic_year=self.year).first()
+        g.score = 20
+        g.save()
+        cube = grade_cube.get_grade_cube(self.year)
+        self.assertIn(20.0, cube.score.tolist())
+
+    def test_unsupported_lookup_raises(self):
+        cube = grade_cube.get_grade_cube(self.year)
+        with self.assertRaises(grade_cube.UnsupportedCubeFilter):
+            cube.mask(score__gte=10)
+        with self.assertRaises(grade_cube.UnsupportedCubeFilter):
+            cube.mask(~Q(term='الفصل الأول'))
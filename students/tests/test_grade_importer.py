@@ -0,0 +1,188 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from students import grade_import_jobs
+from students.grade_importer import ClassNameIndex, process_grades_file
+from students.models import EmployeeProfile, Grade, GradeImportSession, Student
+from students.school_year_utils import get_current_school_year
+
+HEADERS = ['الرقم', 'اللقب والاسم', 'تاريخ الميلاد', 'الجنس', 'الإعادة', 'الرياضيات ف 1', 'اللغة العربية ف 1', 'معدل الفصل 1']
+
+
+class GradeFileTestMixin:
+    def setUp(self):
+        self.students = [
+            Student.objects.create(
+                student_id_number=str(i), last_name=last, first_name=first, gender='ذكر',
+                date_of_birth='2012-01-01', place_of_birth='C', academic_year='أولى', class_name='1',
+                attendance_system='نصف داخلي', enrollment_number=str(i), enrollment_date='2020-01-01',
+            )
+            for i, (last, first) in enumerate([('بن علي', 'محمد'), ('قاسمي', 'سارة')], start=1)
+        ]
+        self.year = get_current_school_year()
+
+    def _file(self, rows, title='قسم: أولى متوسط 1'):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append([title])
+        for _ in range(4):
+            ws.append([''])
+        ws.append(HEADERS)
+        for row in rows:
+            ws.append(row)
+        fd, path = tempfile.mkstemp(suffix='_grades.xlsx')  # named like the preview step's temp files
+        os.close(fd)
+        wb.save(path)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))  # import sessions delete their files
+        return path
+
+
+class ProcessGradesFileTests(GradeFileTestMixin, TestCase):
+    def _scores(self):
+        return {
+            (g.student.last_name, g.subject): g.score
+            for g in Grade.objects.filter(academic_year=self.year, term='الفصل الأول').select_related('student')
+        }
+
+    def test_import_then_reimport_updates_only_changed_cells(self):
+        count, _ = process_grades_file(self._file([
+            [1, 'بن علي محمد', '', '', 'نعم', '12,5', 'غ', 11],
+            [2, 'سارة قاسمي', '', '', '0', 15, 14, 14.5],   # reversed name
+        ]), 'الفصل الأول')
+        self.assertEqual(count, 6)
+        self.assertEqual(self._scores(), {
+            ('بن علي', 'الرياضيات'): 12.5, ('بن علي', 'اللغة العربية'): -1.0, ('بن علي', 'المعدل العام'): 11.0,
+            ('قاسمي', 'الرياضيات'): 15.0, ('قاسمي', 'اللغة العربية'): 14.0, ('قاسمي', 'المعدل العام'): 14.5,
+        })
+        self.students[0].refresh_from_db()
+        self.assertTrue(self.students[0].is_repeater)
+
+        process_grades_file(self._file([
+            [1, 'بن علي محمد', '', '', '0', 13, 'غ', 11],
+            [2, 'سارة قاسمي', '', '', '0', 15, 14, 14.5],
+        ]), 'الفصل الأول')
+        self.assertEqual(Grade.objects.count(), 6)
+        self.assertEqual(self._scores()[('بن علي', 'الرياضيات')], 13.0)
+        self.students[0].refresh_from_db()
+        self.assertFalse(self.students[0].is_repeater)
+
+    def test_unmatched_names_are_reported(self):
+        _, msg = process_grades_file(self._file([
+            [1, 'بن علي محمد', '', '', '0', 12, 13, 11],
+            [2, 'مجهول فلان', '', '', '0', 15, 14, 14.5],
+        ]), 'الفصل الأول')
+        self.assertIn('1 اسم غير مطابق: مجهول فلان', msg)
+
+
+class GradeImportSessionTests(GradeFileTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # No background writer thread in tests: sessions are run explicitly
+        patcher = mock.patch('students.grade_import_jobs.kick')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user(username='analyst', password='p')
+        EmployeeProfile.objects.create(user=user, role='teacher', permissions=['access_analytics'])
+        self.client.force_login(user)
+
+    def _post_batch(self, *paths):
+        return self.client.post(reverse('upload_grades_batch_ajax'), {
+            'term': 'الفصل الأول',
+            'temp_files': json.dumps([{'name': os.path.basename(p), 'temp_file_path': p} for p in paths]),
+        })
+
+    def test_batch_upload_parses_in_worker_processes_and_reports_each_file(self):
+        good = self._file([[1, 'بن علي محمد', '', '', '0', 12, 13, 11]])
+        unknown_class = self._file([[1, 'بن علي محمد', '', '', '0', 12, 13, 11]], title='قسم: رابعة متوسط 9')
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self._post_batch(good, unknown_class)
+        session_id = resp.json()['session']['id']
+        grade_import_jobs.kick.assert_called_once_with()
+
+        self.assertEqual(grade_import_jobs.run_import_session(session_id, workers=2), GradeImportSession.STATUS_COMPLETED)
+        data = self.client.get(reverse('grade_import_session_status', args=[session_id])).json()['session']
+        self.assertEqual((data['done_files'], data['grades_count'], data['progress']), (2, 3, 100))
+        self.assertEqual([f['status'] for f in data['files']], ['done', 'failed'])
+        self.assertNotIn('path', data['files'][0])
+        self.assertEqual(Grade.objects.count(), 3)
+        self.assertFalse(os.path.exists(good))
+        self.assertIsNone(GradeImportSession.objects.get(pk=session_id).slot)
+
+    def test_batch_upload_requires_analytics_access_and_preview_temp_files(self):
+        path = self._file([[1, 'بن علي محمد', '', '', '0', 12, 13, 11]])
+        outside = os.path.abspath('manage.py')
+        self.client.logout()
+        self.assertEqual(self._post_batch(path).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='other', password='p'))
+        self.assertEqual(self._post_batch(path).status_code, 403)
+
+        self.client.force_login(User.objects.get(username='analyst'))
+        self.assertEqual(self._post_batch(outside).status_code, 400)
+        fd, other_temp = tempfile.mkstemp(prefix='other', suffix='_x.xlsx')  # not a preview file
+        os.close(fd)
+        self.addCleanup(os.remove, other_temp)
+        self.assertEqual(self._post_batch(other_temp).status_code, 400)
+        self.assertEqual(self._post_batch(os.path.join(tempfile.gettempdir(), os.path.relpath(outside, tempfile.gettempdir()))).status_code, 400)
+        self.assertFalse(GradeImportSession.objects.exists())
+        self.assertTrue(os.path.exists(outside))
+
+    def _session(self, path, **kwargs):
+        return GradeImportSession.objects.create(
+            term='الفصل الأول', total_files=1,
+            files=[{'name': 'f.xlsx', 'path': path, 'status': 'queued', 'count': 0, 'message': ''}], **kwargs
+        )
+
+    def test_one_writer_across_processes(self):
+        # A session started by another worker process holds the writer slot
+        self._session(self._file([]), status=GradeImportSession.STATUS_RUNNING, slot=1, heartbeat_at=timezone.now())
+        waiting = self._session(self._file([[1, 'بن علي محمد', '', '', '0', 12, 13, 11]]))
+        self.assertIsNone(grade_import_jobs.run_import_session(waiting.pk))
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, GradeImportSession.STATUS_QUEUED)
+        self.assertFalse(Grade.objects.exists())
+
+    def test_stale_session_fails_and_drops_its_files(self):
+        path = self._file([])
+        session = self._session(path, status=GradeImportSession.STATUS_RUNNING, slot=1,
+                                heartbeat_at=timezone.now() - timedelta(hours=1))
+        data = self.client.get(reverse('grade_import_session_status', args=[session.pk])).json()['session']
+        self.assertEqual((data['status'], data['files'][0]['status']), (GradeImportSession.STATUS_FAILED, 'failed'))
+        self.assertIsNone(GradeImportSession.objects.get(pk=session.pk).slot)
+        self.assertFalse(os.path.exists(path))
+
+
+class ClassNameIndexTests(TestCase):
+    def setUp(self):
+        self.index = ClassNameIndex([
+            SimpleNamespace(pk=1, last_name='بن علي', first_name='فاطمة الزهراء'),
+            SimpleNamespace(pk=2, last_name='قاسمي', first_name='أحمد'),
+            SimpleNamespace(pk=3, last_name='قاسمي', first_name='احمد'),
+            SimpleNamespace(pk=4, last_name='مسعودي', first_name='يوسف'),
+        ])
+
+    def _pk(self, name):
+        student = self.index.match(name)
+        return student.pk if student else None
+
+    def test_exact_reversed_and_contained_names(self):
+        self.assertEqual(self._pk('بن  علي فاطمه الزهراء'), 1)   # spaces + ta marbuta
+        self.assertEqual(self._pk('يوسف مسعودي'), 4)              # reversed
+        self.assertEqual(self._pk('علي بن'), 1)                   # "بن علي" contained
+        self.assertEqual(self._pk('مسعودي يوسف الأمين'), 4)       # student name inside file name
+        self.assertIsNone(self._pk('سعيدي مريم'))
+        self.assertEqual(self.index.unmatched, ['سعيدي مريم'])
+
+    def test_ambiguous_names_match_first_in_class_order(self):
+        self.assertEqual(self._pk('قاسمي أحمد'), 2)
+        self.assertEqual(self.index.ambiguous, ['قاسمي أحمد'])
+        self.assertIn('اسم ملتبس', self.index.report())
@@ -43,3 +43,116 @@ class ImportLogicTest(TestCase):
         self.assertFalse(result_update.has_errors())
         s1.refresh_from_db()
         self.assertEqual(s1.last_name, 'Doe Updated')
+
+    def test_student_resource_import_invalidates_derived_caches(self):
+        from unittest import mock
+
+        headers = ['student_id_number', 'last_name', 'first_name', 'gender', 'date_of_birth',
+                   'place_of_birth', 'academic_year', 'class_name', 'attendance_system',
+                   'enrollment_number', 'enrollment_date']
+        dataset = Dataset(
+            ('12345', 'Doe', 'John', 'M', date(2010, 1, 1), 'City', 'Level 1', 'Class A', 'Full', 'EN123', date(2023, 9, 1)),
+            headers=headers,
+        )
+        with mock.patch('students.canteen_utils.invalidate_barcode_index') as barcode, \
+                mock.patch('students.grade_cube.invalidate_grade_cube') as cube, \
+                mock.patch('students.dashboard_stats.invalidate_dashboard_stats') as stats:
+            with self.captureOnCommitCallbacks(execute=True):
+                StudentResource().import_data(dataset, dry_run=True)
+            cube.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                StudentResource().import_data(dataset, dry_run=False)
+        barcode.assert_called_once_with()
+        cube.assert_called_once_with()
+        stats.assert_called_once_with()
+
+
+class JsonStudentImportTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from students.models import EmployeeProfile
+
+        user = User.objects.create_user(username='importer', password='password')
+        EmployeeProfile.objects.create(user=user, role='director', permissions=['import_data'])
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def _rows(self, n, overrides=None):
+        return [dict({
+            'student_id_number': f'{1000 + i}', 'last_name': f'L{i}', 'first_name': 'F', 'gender': 'M',
+            'date_of_birth': '2010-01-01', 'place_of_birth': 'City', 'academic_year': 'أولى',
+            'class_name': '1', 'attendance_system': 'خارجي', 'enrollment_number': str(i),
+            'enrollment_date': '2023-09-01',
+        }, **(overrides or {}).get(i, {})) for i in range(n)]
+
+    def _import(self, rows):
+        resp = self.client.post('/canteen/api/import_json/', {'students': rows, 'update_existing': True}, format='json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_reimport_writes_only_changed_rows_and_fields(self):
+        result = self._import(self._rows(5))
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (5, 0, 0))
+        self.assertEqual(Student.objects.get(student_id_number='1003').search_key, 'l3 f 1003')
+
+        # Unchanged roster: one hashing pass over the existing rows, no writes
+        with self.assertNumQueries(1):
+            result = self._import(self._rows(5))
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (0, 0, 5))
+
+        before = Student.objects.get(student_id_number='1000')
+        result = self._import(self._rows(6, {2: {'last_name': 'Renamed'}, 4: {'address': 'Somewhere'}}))
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (1, 2, 3))
+        renamed = Student.objects.get(student_id_number='1002')
+        self.assertEqual((renamed.last_name, renamed.search_key), ('Renamed', 'renamed f 1002'))
+        self.assertEqual(Student.objects.get(student_id_number='1004').address, 'Somewhere')
+        self.assertEqual(Student.objects.get(student_id_number='1000').updated_at, before.updated_at)
+
+    def test_failed_batch_reports_committed_rows_and_invalidates(self):
+        from unittest import mock
+
+        from students.student_import import StudentImportError, import_students
+
+        rows = self._rows(3)
+        for row in rows:
+            row['date_of_birth'] = row['enrollment_date'] = date(2010, 1, 1)
+        real_bulk_create = Student.objects.bulk_create
+        calls = []
+
+        def second_batch_fails(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) > 1:
+                raise RuntimeError('disk full')
+            return real_bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Student.objects, 'bulk_create', side_effect=second_batch_fails):
+            with self.assertRaises(StudentImportError) as ctx:
+                import_students(rows, batch_size=2)
+        self.assertEqual((ctx.exception.result['created'], ctx.exception.result['batches']), (2, 1))
+        self.assertEqual(Student.objects.count(), 2)
+
+        partial = StudentImportError('disk full', {'created': 2, 'updated': 0, 'unchanged': 0, 'batches': 1})
+        with mock.patch('students.views.import_students', side_effect=partial), \
+                mock.patch('students.views.invalidate_grade_cube') as cube:
+            resp = self.client.post('/canteen/api/import_json/', {'students': self._rows(3)}, format='json')
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual((resp.json()['error'], resp.json()['created']), ('disk full', 2))
+        cube.assert_called_once_with()
+
+
+class SubjectStandardizationTests(TestCase):
+    def test_series_maps_each_distinct_name_once(self):
+        import numpy as np
+        import pandas as pd
+        from students import import_utils
+
+        subjects = pd.Series(['  رياضيات ', 'اللغه  العربيه', 'الأمازيغية', None, np.nan, 'الفيزياء'] * 50, dtype=object)
+        expected = [import_utils.standardize_subject_name(s) for s in subjects]
+        import_utils._standardize_subject.cache_clear()
+        result = import_utils.standardize_subject_series(subjects)
+        self.assertEqual(result.tolist(), expected)
+        self.assertEqual(result.tolist()[:6], ['الرياضيات', 'اللغة العربية', 'الامازيغيه', '', 'nan', 'ع الفيزيائية والتكنولوجيا'])
+        # 4 distinct names + NaN (None short-circuits before the cache)
+        self.assertEqual(import_utils._standardize_subject.cache_info().misses, 5)
+        self.assertTrue(result.index.equals(subjects.index))
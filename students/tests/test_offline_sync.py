@@ -0,0 +1,75 @@
+import gzip
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from students.models import EmployeeProfile, Student, StudentTombstone
+
+
+class OfflineChangeFeedTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='tablet', password='password')
+        EmployeeProfile.objects.create(
+            user=user, role='canteen', permissions=['offline_cache_students', 'access_canteen'],
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def _student(self, sid):
+        return Student.objects.create(
+            student_id_number=sid, last_name='L', first_name='F', gender='ذكر', date_of_birth='2012-03-04',
+            place_of_birth='C', academic_year='أولى', class_name='1', attendance_system='نصف داخلي',
+            enrollment_number='1', enrollment_date='2020-01-01',
+        )
+
+    def _feed(self, since=''):
+        resp = self.client.get('/canteen/api/offline/bootstrap/', {'since': since}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(resp.streaming_content)).decode('utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(records[0]['type'], 'meta')
+        return records[0], records[1:]
+
+    def _age(self, queryset, field, seconds=60):
+        queryset.update(**{field: timezone.now() - timedelta(seconds=seconds)})
+
+    def test_full_snapshot_then_deltas_with_tombstones(self):
+        a, b = self._student('1'), self._student('2')
+        meta, rows = self._feed()
+        self.assertTrue(meta['full'])
+        self.assertEqual([r['student']['id'] for r in rows], [a.id, b.id])
+        self.assertIn('photo_url', rows[0]['student'])
+
+        # Only what changed since the cursor is sent
+        self._age(Student.objects.all(), 'updated_at')
+        cursor = meta['cursor']
+        meta, rows = self._feed(cursor)
+        self.assertFalse(meta['full'])
+        self.assertEqual(rows, [])
+
+        b.first_name = 'Changed'
+        b.save(update_fields=['first_name'])
+        c = self._student('3')
+        a_id = a.id
+        a.delete()
+        meta, rows = self._feed(cursor)
+        self.assertEqual(
+            sorted((r['type'], r.get('id') or r['student']['id']) for r in rows),
+            sorted([('student', b.id), ('student', c.id), ('deleted', a_id)]),
+        )
+
+        # A cursor older than the tombstone retention gets a full snapshot again
+        self._age(StudentTombstone.objects.all(), 'deleted_at', seconds=200 * 24 * 3600)
+        meta, rows = self._feed((timezone.now() - timedelta(days=200)).isoformat())
+        self.assertTrue(meta['full'])
+        self.assertFalse(StudentTombstone.objects.exists())
+        self.assertEqual(sorted(r['student']['id'] for r in rows), [b.id, c.id])
+
+    def test_legacy_json_snapshot_without_since(self):
+        self._student('1')
+        data = self.client.get('/canteen/api/offline/bootstrap/').json()
+        self.assertEqual(len(data['students']), 1)
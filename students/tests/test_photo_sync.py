@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from students.models import Student
+from students.photo_variants import photo_content_hash, variant_name, variant_url
+from students.utils_sync import sync_photos_logic
+
+
+class PhotoSyncTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media, 'students_photos'))
+
+    def _student(self, sid):
+        return Student.objects.create(
+            student_id_number=sid, last_name='L', first_name='F', gender='ذكر', date_of_birth='2012-03-04',
+            place_of_birth='C', academic_year='أولى', class_name='1', attendance_system='خارجي',
+            enrollment_number='1', enrollment_date='2020-01-01',
+        )
+
+    def _photo(self, name, size=(1200, 1600), color='red'):
+        path = os.path.join(self.media, 'students_photos', name)
+        Image.new('RGB', size, color).save(path)
+        return path
+
+    def _variant(self, digest, size):
+        return os.path.join(self.media, variant_name(digest, size))
+
+    def test_sync_links_photos_in_bulk_and_builds_variants(self):
+        a, b, c = self._student('100'), self._student('200'), self._student('300')
+        path_a = self._photo('100.jpg')
+        self._photo('200.png')
+        self._photo('999.jpg')  # no such student
+
+        # one students query + one bulk UPDATE (savepoint + release around it in tests)
+        with self.assertNumQueries(4):
+            self.assertEqual(sync_photos_logic(thumbnails=False), 2)
+        a.refresh_from_db()
+        b.refresh_from_db()
+        c.refresh_from_db()
+        self.assertEqual((a.photo.name, b.photo.name, c.photo.name), ('students_photos/100.jpg', 'students_photos/200.png', ''))
+        self.assertEqual(a.photo_hash, photo_content_hash(path_a))
+
+        # Already linked and hashed: nothing to write, only the missing variants are rendered
+        self.assertEqual(sync_photos_logic(), 0)
+        with Image.open(self._variant(a.photo_hash, 'card')) as im:
+            self.assertEqual(im.size, (300, 400))
+        self.assertTrue(os.path.exists(self._variant(b.photo_hash, 'list')))
+        self.assertTrue(os.path.exists(self._variant(b.photo_hash, 'scan')))
+
+    def test_saved_photo_gets_variants_served_with_immutable_caching(self):
+        student = self._student('100')
+        with open(self._photo('upload.jpg', color='blue'), 'rb') as f:
+            student.photo.save('upload.jpg', ContentFile(f.read()), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            student.save()
+        digest = student.photo_hash
+        self.assertTrue(digest)
+        self.assertTrue(os.path.exists(self._variant(digest, 'scan')))
+
+        url = variant_url(digest, 'card')
+        os.remove(self._variant(digest, 'card'))  # rendered again on demand
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertTrue(os.path.exists(self._variant(digest, 'card')))
+        self.assertEqual(self.client.get(variant_url('0' * 20, 'card')).status_code, 404)
+
+        # Clearing the photo forgets the hash
+        student.photo = None
+        student.save()
+        self.assertEqual(Student.objects.get(pk=student.pk).photo_hash, '')
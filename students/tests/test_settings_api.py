@@ -1,7 +1,14 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
 from students.models import EmployeeProfile, SchoolSettings
+from students.school_year_utils import get_current_school_year
+from students.settings_utils import (
+    get_award_thresholds,
+    get_school_settings,
+    get_subject_coefficients_by_level,
+    invalidate_school_settings,
+)
 import json
 
 class SettingsAPITest(TestCase):
@@ -39,3 +46,31 @@ class SettingsAPITest(TestCase):
         self.settings.refresh_from_db()
         self.assertEqual(self.settings.name, "New Name")
         self.assertEqual(self.settings.loan_limit, 2)
+
+
+class SettingsCacheTest(TransactionTestCase):
+    """The cache is only used outside transactions, hence TransactionTestCase."""
+
+    def setUp(self):
+        invalidate_school_settings()
+        self.settings = SchoolSettings.objects.create(
+            name="Cached", academic_year="2025-2026",
+            subject_coefficients_by_level='{"أولى متوسط": {"الرياضيات": 2}}',
+        )
+
+    def tearDown(self):
+        invalidate_school_settings()
+
+    def test_cached_until_saved(self):
+        self.assertEqual(get_school_settings().name, "Cached")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_school_settings().name, "Cached")
+            self.assertEqual(get_current_school_year(), "2025-2026")
+
+        self.settings.academic_year = "2026-2027"
+        self.settings.save()
+        self.assertEqual(get_current_school_year(), "2026-2027")
+
+    def test_json_fields_are_parsed(self):
+        self.assertEqual(get_subject_coefficients_by_level(), {"أولى متوسط": {"الرياضيات": 2}})
+        self.assertEqual(get_award_thresholds(), {})
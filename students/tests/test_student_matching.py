@@ -0,0 +1,55 @@
+from datetime import date
+from types import SimpleNamespace
+
+from django.test import TestCase
+
+from students.expert_import_utils import StudentMatchIndex, find_student_advanced
+from students.management.commands.bench_student_matching import synthetic_files, synthetic_students
+
+
+def _s(pk, last_name, first_name, dob=None, gender=None):
+    return SimpleNamespace(pk=pk, last_name=last_name, first_name=first_name, date_of_birth=dob, gender=gender)
+
+
+class StudentMatchIndexTests(TestCase):
+    def setUp(self):
+        self.students = [
+            _s(1, 'بن علي', 'فاطمة الزهراء', date(2010, 1, 2), 'أنثى'),
+            _s(2, 'بن علي', 'فاطمة', date(2011, 5, 6), 'أنثى'),
+            _s(3, 'قاسمي', 'أحمد', date(2010, 3, 4), 'ذكر'),
+            _s(4, 'قاسمي', 'أحمد', date(2012, 7, 8), 'ذكر'),
+            _s(5, 'يوسف', 'مسعودي', None, None),
+            _s(6, '', 'عبد الله'),
+        ]
+        self.index = StudentMatchIndex(self.students)
+
+    def _assert_same(self, *args):
+        expected = find_student_advanced(self.students, *args)
+        self.assertIs(self.index.find(*args), expected, args)
+        return expected
+
+    def test_same_result_as_linear_scan(self):
+        cases = [
+            ('بن علي', 'فاطمة الزهراء', None, None),
+            ('بن علي', 'فاطمه الزهراء', None, None),           # تاء مربوطة
+            ('فاطمة', 'بن علي', date(2011, 5, 6), None),       # معكوس
+            ('بن علي', 'فاطمة', date(2010, 1, 2), 'أنثى'),     # احتواء + تاريخ الميلاد
+            ('قاسمي', 'احمد', date(2012, 7, 8), None),         # همزة + تاريخ الميلاد
+            ('قاسمي', 'أحمد', date(2000, 1, 1), 'ذكر'),        # تاريخ مختلف: مطابقة اسمية
+            ('مسعودي', 'يوسف', None, None),
+            ('', 'عبد الله', None, None),
+            ('سعيدي', 'مريم', None, None),                     # غير موجود
+            ('', '', None, None),
+        ]
+        self.assertEqual(self._assert_same(*cases[4]).pk, 4)
+        self.assertEqual(self._assert_same(*cases[2]).pk, 2)
+        self.assertIsNone(self._assert_same(*cases[8]))
+        for case in cases:
+            self._assert_same(*case)
+
+    def test_synthetic_import_matches_linear_scan(self):
+        students = synthetic_students(200)
+        index = StudentMatchIndex(students)
+        for sheet in synthetic_files(students, files=3, rows=40):
+            for row in sheet:
+                self.assertIs(index.find(*row), find_student_advanced(students, *row), row)
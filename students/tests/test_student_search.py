@@ -0,0 +1,80 @@
+import os
+import tempfile
+from io import StringIO
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from students.models import EmployeeProfile, Student
+from students.student_search import SEARCH_TABLE, search_students
+
+
+class StudentSearchTests(TestCase):
+    def _student(self, sid, last_name, first_name):
+        return Student.objects.create(
+            student_id_number=sid, last_name=last_name, first_name=first_name, gender='ذكر',
+            date_of_birth='2012-03-04', place_of_birth='C', academic_year='أولى', class_name='1',
+            attendance_system='خارجي', enrollment_number='1', enrollment_date='2020-01-01',
+        )
+
+    def _ids(self, text):
+        return sorted(search_students(Student.objects.all(), text).values_list('student_id_number', flat=True))
+
+    def test_folded_search_key_matches_spelling_variants(self):
+        fatima = self._student('100200300', 'بن علي', 'فاطمة')
+        self._student('100200301', 'إبراهيمي', 'أمينة')
+        self.assertEqual(fatima.search_key, 'بن علي فاطمه 100200300')
+
+        self.assertEqual(self._ids('فاطمه'), ['100200300'])
+        self.assertEqual(self._ids('فاطمة بن'), ['100200300'])  # any word order, short words too
+        self.assertEqual(self._ids('ابراهيمي امينه'), ['100200301'])
+        self.assertEqual(self._ids('2003'), ['100200300', '100200301'])
+        self.assertEqual(self._ids('سارة'), [])
+
+        # The n-gram index follows renames through the model save
+        fatima.first_name = 'سارة'
+        fatima.save(update_fields=['first_name'])
+        self.assertEqual(self._ids('سارة'), ['100200300'])
+        fatima.delete()
+        self.assertEqual(self._ids('2003'), ['100200301'])
+
+    def test_fts_index_and_api_search(self):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name LIKE %s", [SEARCH_TABLE + '%'])
+            self.assertGreaterEqual(cursor.fetchone()[0], 4)  # FTS table + 3 triggers
+
+        self._student('1', 'زهرة', 'مريم')
+        self._student('2', 'قاسمي', 'يوسف')
+        user = User.objects.create_user(username='u', password='p')
+        EmployeeProfile.objects.create(user=user, role='director')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        data = client.get('/api/students/', {'search': 'زهره'}).json()
+        rows = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([r['student_id_number'] for r in rows], ['1'])
+
+    def test_import_eleve_command_sets_search_key(self):
+        def eleve_file(first_name):
+            wb = openpyxl.Workbook()
+            wb.active.append(['100200300', 'بن علي', first_name, 'أنثى', '2012-03-04', '', '', '', '', 'C',
+                              'أولى', '1', 'خارجي', '1', '2020-01-01'])
+            fd, path = tempfile.mkstemp(suffix='.xlsx')
+            os.close(fd)
+            wb.save(path)
+            self.addCleanup(os.remove, path)
+            return path
+
+        call_command('import_eleve', file=eleve_file('فاطمة'), update_existing=True, stdout=StringIO())
+        self.assertEqual(self._ids('فاطمه'), ['100200300'])
+        Student.objects.update(updated_at='2000-01-01T00:00Z')
+
+        call_command('import_eleve', file=eleve_file('سارة'), update_existing=True, stdout=StringIO())
+        self.assertEqual(self._ids('سارة'), ['100200300'])
+        self.assertEqual(self._ids('فاطمه'), [])
+        # Updated rows move the offline change-feed cursor
+        self.assertGreater(Student.objects.get().updated_at.year, 2000)
@@ -7,14 +7,19 @@ from .models import Student, CanteenAttendance, SchoolSettings, Employee, System
 from datetime import date, datetime
 from io import StringIO
 import os
+import re
 import tempfile
 from django.conf import settings
 import openpyxl
 from tablib import Dataset
 from .resources import StudentResource
 from .import_utils import parse_student_file
-from .utils import normalize_arabic
+from .student_search import search_students
 from .utils_sync import sync_photos_logic
+from .canteen_utils import invalidate_barcode_index
+from .dashboard_stats import get_dashboard_stats
+from .grade_cube import get_grade_cube, invalidate_grade_cube, UnsupportedCubeFilter
+from .settings_utils import get_school_settings, get_award_thresholds
 from django.db.models import Q
 
 
@@ -129,57 +134,30 @@ def dashboard(request):
         if teacher_classes:
             assigned_students = Student.objects.filter(class_name__in=teacher_classes).order_by('class_name', 'last_name')
 
-    # Detailed Stats for Dashboard Table
-    from django.db.models import Count
-
-    # Group by Level and Attendance System
-    raw_stats = Student.objects.values('academic_year', 'attendance_system').annotate(count=Count('id')).order_by('academic_year')
-
-    # Pivot Data: { '1AM': {'half': 10, 'ext': 5, 'total': 15}, ... }
-    stats_map = {}
-    for item in raw_stats:
-        lvl = item['academic_year'] or 'غير محدد'
-        sys = item['attendance_system']
-        count = item['count']
-
-        if lvl not in stats_map:
-            stats_map[lvl] = {'level': lvl, 'half': 0, 'ext': 0, 'total': 0}
-
-        stats_map[lvl]['total'] += count
-        if sys == 'نصف داخلي':
-            stats_map[lvl]['half'] += count
-        else: # خارجي or others
-            stats_map[lvl]['ext'] += count
-
-    # Convert to sorted list
-    detailed_stats = sorted(stats_map.values(), key=lambda x: x['level'])
-
-    total_students = Student.objects.count()
-    half_board_count = Student.objects.filter(attendance_system='نصف داخلي').count()
-    ext_board_count = total_students - half_board_count
+    # Counters from one aggregate query, cached for a few seconds (see dashboard_stats)
+    stats = get_dashboard_stats()
+    is_director = request.user.profile.role == 'director' if hasattr(request.user, 'profile') else request.user.is_superuser
 
+    # Never call the balance API while rendering: show the last cached value (if any);
+    # the page refreshes it asynchronously through api_openrouter_balance.
     openrouter_balance = None
     openrouter_balance_info = None
-    try:
-        from students.ai_utils import AIService
-        ai = AIService()
-        openrouter_balance_info = ai.get_openrouter_balance_info()
+    if is_director:
+        from students.ai_utils import get_cached_openrouter_balance_info
+        openrouter_balance_info = get_cached_openrouter_balance_info()
         openrouter_balance = openrouter_balance_info.get('balance') if isinstance(openrouter_balance_info, dict) else None
-    except Exception as e:
-        # لا نكتم الخطأ حتى يظهر السبب في لوحة القيادة بدل N/A الغامضة
-        openrouter_balance_info = {'ok': False, 'balance': None, 'message': f'خطأ داخلي: {e}', 'key_present': False}
     context = {
-        'total_students': total_students,
-        'half_board_count': half_board_count,
-        'ext_board_count': ext_board_count,
+        'total_students': stats['total_students'],
+        'half_board_count': stats['half_board_count'],
+        'ext_board_count': stats['ext_board_count'],
         'db_status': 'متصل',
-        'present_today': CanteenAttendance.objects.filter(date=date.today()).count(),
-        'absent_today': half_board_count - CanteenAttendance.objects.filter(date=date.today()).count(),
-        'detailed_stats': detailed_stats,
+        'present_today': stats['present_today'],
+        'absent_today': stats['absent_today'],
+        'detailed_stats': stats['detailed_stats'],
         'assigned_students': assigned_students,
         'teacher_classes': teacher_classes,
         'permissions': request.user.profile.permissions if hasattr(request.user, 'profile') else [],
-        'is_director': request.user.profile.role == 'director' if hasattr(request.user, 'profile') else request.user.is_superuser,
+        'is_director': is_director,
         'openrouter_balance': openrouter_balance,
         'openrouter_balance_info': openrouter_balance_info,
     }
@@ -205,6 +183,10 @@ def settings_view(request):
     if hasattr(request.user, 'profile') and not request.user.profile.has_perm('manage_settings'):
          return redirect('dashboard')
 
+    # Resume a grade archive orphaned by a worker restart (the page then polls its progress)
+    from .grade_archive import resume_stale_jobs
+    resume_stale_jobs()
+
     context = {
         'total_students': Student.objects.count(),
         'permissions': request.user.profile.permissions if hasattr(request.user, 'profile') else [],
@@ -477,21 +459,7 @@ def print_student_cards(request):
 
              if level: qs = qs.filter(academic_year=level)
              if cls: qs = qs.filter(class_name=cls)
-             if search:
-                 norm_search = normalize_arabic(search)
-                 q_obj = Q(student_id_number__icontains=search) | \
-                         Q(first_name__icontains=search) | \
-                         Q(last_name__icontains=search)
-                 if norm_search != search:
-                     q_obj |= Q(first_name__icontains=norm_search) | \
-                              Q(last_name__icontains=norm_search)
-                 if 'ه' in search:
-                      alt = search.replace('ه', 'ة')
-                      q_obj |= Q(first_name__icontains=alt) | Q(last_name__icontains=alt)
-                 if 'ة' in search:
-                      alt = search.replace('ة', 'ه')
-                      q_obj |= Q(first_name__icontains=alt) | Q(last_name__icontains=alt)
-                 qs = qs.filter(q_obj)
+             if search: qs = search_students(qs, search)
 
              students = qs
         else:
@@ -501,7 +469,7 @@ def print_student_cards(request):
         # Fallback or empty
         students = []
 
-    settings = SchoolSettings.objects.first()
+    settings = get_school_settings()
     school_name = settings.name if settings else "اسم المؤسسة"
     from .school_year_utils import get_current_school_year
     academic_year = get_current_school_year()
@@ -1132,6 +1100,7 @@ def hr_home(request):
 
                 if edit_id:
                     Employee.objects.filter(id=edit_id).update(**data)
+                    invalidate_barcode_index()
                     messages.success(request, "تم تعديل الموظف بنجاح.")
                 else:
                     Employee.objects.create(**data)
@@ -1595,10 +1564,11 @@ def analytics_dashboard(request):
 
     from .school_year_utils import get_current_school_year
     current_school_year = get_current_school_year()
-    grades_qs = Grade.objects.filter(academic_year=current_school_year)
+    # الفلاتر تُجمع ككائنات Q ثم تُقيَّم على مكعب العلامات (grade_cube) أو عبر ORM
+    grade_filters = []
     grades_qs_for_teacher_compare = Grade.objects.filter(academic_year=current_school_year)
     if selected_terms:
-        grades_qs = grades_qs.filter(term__in=selected_terms)
+        grade_filters.append(Q(term__in=selected_terms))
 
     # Subject Filtering
     if selected_subjects:
@@ -1606,7 +1576,7 @@ def analytics_dashboard(request):
         q_subj = models.Q()
         for s in selected_subjects:
             q_subj |= models.Q(subject__icontains=s)
-        grades_qs = grades_qs.filter(q_subj)
+        grade_filters.append(q_subj)
 
     # تطبيع رمز القسم إلى صيغة 1م1 ليتطابق مع student.class_code أو academic_year+class_name
     def _normalize_class_code(raw):
@@ -1748,7 +1718,7 @@ def analytics_dashboard(request):
                          models.Q(student__academic_year__icontains=lvl_digit))
                         & models.Q(student__class_name__icontains=section_num)
                     )
-            grades_qs = grades_qs.filter(q_teacher)
+            grade_filters.append(q_teacher)
 
     # Move auto-selection logic here: عند فلترة أستاذ نفعّل مستواه وأفواجه فقط عند تفعيل الإسناد الديناميكي
     if dynamic_assignment and selected_teacher_id and teacher_classes:
@@ -1802,7 +1772,7 @@ def analytics_dashboard(request):
         for sl in selected_levels:
             q_lvl |= (models.Q(student__academic_year=sl) |
                       models.Q(student__academic_year__icontains=(sl or '').replace(' متوسط', '').strip()))
-        grades_qs = grades_qs.filter(q_lvl)
+        grade_filters.append(q_lvl)
     if selected_classes and selected_levels:
         # لا نطبق فلترة الأقسام إلا عند اختيار مستوى (الأقسام مرتبطة بالمستوى)
         import django.db.models as models
@@ -1835,7 +1805,7 @@ def analytics_dashboard(request):
                     models.Q(student__class_name__icontains=raw_class))
             else:
                 q_class |= models.Q(student__class_name=c)
-        grades_qs = grades_qs.filter(q_class)
+        grade_filters.append(q_class)
 
     effective_subject = selected_subject
     if selected_teacher_id and not effective_subject and teacher_subjects:
@@ -1850,7 +1820,17 @@ def analytics_dashboard(request):
         # عدم اختيار فلتر: الترتيب على أساس المعدل الفصلي (كل المواد، بدون فلتر مادة)
         grades_qs_for_ranking = Grade.objects.filter(academic_year=current_school_year)
 
-    settings_obj = SchoolSettings.objects.first()
+    # تغيير الفلتر = قناع منطقي على مصفوفات المكعب بدل استعلام ORM جديد
+    grades_qs = Grade.objects.filter(*grade_filters, academic_year=current_school_year)
+    try:
+        cube = get_grade_cube(current_school_year)
+        grades_qs = cube.to_frame(cube.mask(*grade_filters))
+        if grades_qs_for_ranking is not None:
+            grades_qs_for_ranking = cube.to_frame()
+    except UnsupportedCubeFilter:
+        pass
+
+    settings_obj = get_school_settings()
     exempt_subjects = list(settings_obj.analytics_exempt_subjects) if settings_obj and getattr(settings_obj, 'analytics_exempt_subjects', None) else []
     # قواعد إعفاء مادة حسب (تلميذ/فوج/مستوى/مؤسسة)
     exemption_rules = []
@@ -1878,8 +1858,8 @@ def analytics_dashboard(request):
 
     # مجالات الإجازات (تُستخدم لاحقاً في تطبيق الملاحظة على ترتيب التلاميذ وفي القالب)
     award_defaults = {'امتياز': 16, 'تهنئة': 14, 'تشجيع': 12, 'لوحة شرف': 10}
-    award_thresholds_raw = getattr(settings_obj, 'award_thresholds', None) if settings_obj else None
-    if isinstance(award_thresholds_raw, dict):
+    award_thresholds_raw = get_award_thresholds() if settings_obj else None
+    if award_thresholds_raw:
         award_thresholds = {k: award_thresholds_raw.get(k) if award_thresholds_raw.get(k) is not None else award_defaults.get(k) for k in ['امتياز', 'تهنئة', 'تشجيع', 'لوحة شرف']}
     else:
         award_thresholds = award_defaults.copy()
@@ -3168,6 +3148,7 @@ def rename_subject_ajax(request):
                 # If doing a bulk update causes a unique constraint error (e.g. merging two subjects that a student already has both of)
                 # we need to handle it gracefully.
                 Grade.objects.filter(subject=old_name).update(subject=new_name)
+                invalidate_grade_cube()
                 return JsonResponse({'success': True})
             except IntegrityError:
                 return JsonResponse({'success': False, 'error': 'لا يمكن التغيير لوجود علامات مكررة لنفس التلميذ في نفس الفصل تحت هذا الاسم (تعارض). يرجى التأكد أو حذف العلامات المكررة أولاً.'})
@@ -3194,6 +3175,7 @@ def delete_subject_ajax(request):
             from .models import Grade
             try:
                 deleted_count, _ = Grade.objects.filter(subject=subject_name).delete()
+                invalidate_grade_cube()
                 return JsonResponse({'success': True, 'deleted_count': deleted_count})
             except Exception as e:
                 return JsonResponse({'success': False, 'error': str(e)})
@@ -3319,40 +3301,136 @@ def save_award_thresholds_ajax(request):
     return JsonResponse({'success': True, 'award_thresholds': data})
 
 
-def upload_grades_ajax(request):
-    """Handles bulk uploading of multiple grade files with AJAX progress"""
-    if request.method == 'POST':
-        term = request.POST.get('term')
-        import_mode = request.POST.get('import_mode', 'local')
-        temp_file_path = request.POST.get('temp_file_path')
+def _grade_import_options(request):
+    """term, import_mode, subject_mappings (saved as SubjectAlias) and teacher_subject_links of a grades upload."""
+    term = request.POST.get('term')
+    import_mode = request.POST.get('import_mode', 'local')
+
+    # Load user subject mappings if provided
+    import json
+    subject_mappings = None
+    mappings_json = request.POST.get('subject_mappings')
+    if mappings_json:
+        try:
+            subject_mappings = json.loads(mappings_json)
+            # Save these mappings permanently to the database
+            from .models_mapping import SubjectAlias
+            for old_name, new_name in subject_mappings.items():
+                if new_name and new_name != "ignore":
+                    # Create or update alias
+                    SubjectAlias.objects.update_or_create(
+                        alias=old_name.strip(),
+                        defaults={'canonical_name': new_name.strip()}
+                    )
+        except json.JSONDecodeError:
+            pass
+
+    # Load optional teacher<->subjects links (from results subjects, not HR)
+    teacher_subject_links = None
+    links_json = request.POST.get('teacher_subject_links')
+    if links_json:
+        try:
+            teacher_subject_links = json.loads(links_json) or {}
+        except json.JSONDecodeError:
+            teacher_subject_links = None
+    return term, import_mode, subject_mappings, teacher_subject_links
 
-        # Load user subject mappings if provided
-        import json
-        subject_mappings = None
-        mappings_json = request.POST.get('subject_mappings')
-        if mappings_json:
-            try:
-                subject_mappings = json.loads(mappings_json)
-                # Save these mappings permanently to the database
-                from .models_mapping import SubjectAlias
-                for old_name, new_name in subject_mappings.items():
-                    if new_name and new_name != "ignore":
-                        # Create or update alias
-                        SubjectAlias.objects.update_or_create(
-                            alias=old_name.strip(),
-                            defaults={'canonical_name': new_name.strip()}
-                        )
-            except json.JSONDecodeError:
-                pass
 
-        # Load optional teacher<->subjects links (from results subjects, not HR)
-        teacher_subject_links = None
-        links_json = request.POST.get('teacher_subject_links')
-        if links_json:
+def _apply_grade_import_links(subject_mappings, teacher_subject_links):
+    """Applies the approved subject names and teacher<->subject links once the grades are imported."""
+    # بعد اعتماد المواد: تحديث إسناد المواد للأساتذة بناءً على المواد المعتمدة (وليس مواد الموارد البشرية الخام)
+    if subject_mappings:
+        from .models import Employee, TeacherAssignment
+        # نبني خريطة: اسم_قديم -> اسم_معتمد (مع احترام خيار "الاحتفاظ بنفس الاسم")
+        normalized_map = {}
+        for old_name, new_name in subject_mappings.items():
+            if not old_name:
+                continue
+            if new_name == "ignore":
+                continue
+            # الاحتفاظ بنفس الاسم: نستخدم الاسم كما في الملف
+            canonical = old_name if (new_name in ("--احتفاظ بنفس الاسم--", "", None)) else new_name
+            normalized_map[old_name.strip()] = canonical.strip()
+
+        if normalized_map:
+            # تحديث TeacherAssignment.subject
+            for old_name, canonical in normalized_map.items():
+                TeacherAssignment.objects.filter(subject=old_name).update(subject=canonical)
+
+            # تحديث analytics_assignments لكل أستاذ بحيث تستعمل نفس أسماء المواد المعتمدة
+            for emp in Employee.objects.exclude(analytics_assignments=None):
+                if not isinstance(emp.analytics_assignments, list):
+                    continue
+                changed = False
+                new_assignments = []
+                for a in emp.analytics_assignments or []:
+                    subj = (a.get('subject') or '').strip()
+                    if subj in normalized_map:
+                        a['subject'] = normalized_map[subj]
+                        changed = True
+                    new_assignments.append(a)
+                if changed:
+                    emp.analytics_assignments = new_assignments
+                    emp.save(update_fields=['analytics_assignments'])
+
+    # إذا اختار المستخدم ربط الأساتذة بمواد النتائج مباشرة بعد ربط المواد
+    if teacher_subject_links and isinstance(teacher_subject_links, dict):
+        from .models import Employee, TeacherAssignment
+        for tid, payload in teacher_subject_links.items():
             try:
-                teacher_subject_links = json.loads(links_json) or {}
-            except json.JSONDecodeError:
-                teacher_subject_links = None
+                emp = Employee.objects.get(id=int(tid))
+            except Exception:
+                continue
+            subjects = payload.get('subjects') if isinstance(payload, dict) else None
+            if not subjects or not isinstance(subjects, list):
+                continue
+            subjects = [str(s).strip() for s in subjects if str(s).strip()]
+            if not subjects:
+                continue
+
+            # دمج مع الإسناد الحالي: نحافظ على classes إن وُجدت لنفس المادة
+            existing = {}
+            if isinstance(emp.analytics_assignments, list):
+                for a in emp.analytics_assignments or []:
+                    s = (a.get('subject') or '').strip()
+                    if not s:
+                        continue
+                    cl = a.get('classes')
+                    existing[s] = list(cl) if isinstance(cl, list) else ([cl] if cl else [])
+
+            # إذا كانت الأقسام فارغة لمادة ما، نملأها تلقائياً من إسناد الموارد البشرية (حتى لا يلزم حفظ إسناد كل أستاذ يدوياً)
+            def _norm_subj(t):
+                t = (t or '').strip().replace('ـ', '').replace('  ', ' ')
+                if t.startswith('ال'):
+                    t = t[2:].strip()
+                return t.lower()
+
+            hr_assignments = list(TeacherAssignment.objects.filter(teacher=emp).values_list('subject', 'classes'))
+            for subj, classes in hr_assignments:
+                if not subj or str(subj).strip() == '/':
+                    continue
+                hr_subj = str(subj).strip()
+                cl_list = list(classes) if isinstance(classes, list) else ([classes] if classes else [])
+                if not cl_list:
+                    continue
+                n_hr = _norm_subj(hr_subj)
+                for s in subjects:
+                    if existing.get(s):
+                        continue
+                    n_s = _norm_subj(s)
+                    if n_hr in n_s or n_s in n_hr or hr_subj in s or s in hr_subj:
+                        existing[s] = list(cl_list)
+                        break
+
+            emp.analytics_assignments = [{'subject': s, 'classes': list(existing.get(s, []))} for s in subjects]
+            emp.save(update_fields=['analytics_assignments'])
+
+
+def upload_grades_ajax(request):
+    """Imports one grade file inside the request (see upload_grades_batch_ajax for several files)"""
+    if request.method == 'POST':
+        term, import_mode, subject_mappings, teacher_subject_links = _grade_import_options(request)
+        temp_file_path = request.POST.get('temp_file_path')
 
         import tempfile
         import os
@@ -3380,92 +3458,7 @@ def upload_grades_ajax(request):
             else:
                 count, msg = process_grades_file(temp_path, term, subject_mappings=subject_mappings)
 
-            # بعد اعتماد المواد: تحديث إسناد المواد للأساتذة بناءً على المواد المعتمدة (وليس مواد الموارد البشرية الخام)
-            if subject_mappings:
-                from .models import Employee, TeacherAssignment
-                # نبني خريطة: اسم_قديم -> اسم_معتمد (مع احترام خيار "الاحتفاظ بنفس الاسم")
-                normalized_map = {}
-                for old_name, new_name in subject_mappings.items():
-                    if not old_name:
-                        continue
-                    if new_name == "ignore":
-                        continue
-                    # الاحتفاظ بنفس الاسم: نستخدم الاسم كما في الملف
-                    canonical = old_name if (new_name in ("--احتفاظ بنفس الاسم--", "", None)) else new_name
-                    normalized_map[old_name.strip()] = canonical.strip()
-
-                if normalized_map:
-                    # تحديث TeacherAssignment.subject
-                    for old_name, canonical in normalized_map.items():
-                        TeacherAssignment.objects.filter(subject=old_name).update(subject=canonical)
-
-                    # تحديث analytics_assignments لكل أستاذ بحيث تستعمل نفس أسماء المواد المعتمدة
-                    for emp in Employee.objects.exclude(analytics_assignments=None):
-                        if not isinstance(emp.analytics_assignments, list):
-                            continue
-                        changed = False
-                        new_assignments = []
-                        for a in emp.analytics_assignments or []:
-                            subj = (a.get('subject') or '').strip()
-                            if subj in normalized_map:
-                                a['subject'] = normalized_map[subj]
-                                changed = True
-                            new_assignments.append(a)
-                        if changed:
-                            emp.analytics_assignments = new_assignments
-                            emp.save(update_fields=['analytics_assignments'])
-
-            # إذا اختار المستخدم ربط الأساتذة بمواد النتائج مباشرة بعد ربط المواد
-            if teacher_subject_links and isinstance(teacher_subject_links, dict):
-                from .models import Employee, TeacherAssignment
-                for tid, payload in teacher_subject_links.items():
-                    try:
-                        emp = Employee.objects.get(id=int(tid))
-                    except Exception:
-                        continue
-                    subjects = payload.get('subjects') if isinstance(payload, dict) else None
-                    if not subjects or not isinstance(subjects, list):
-                        continue
-                    subjects = [str(s).strip() for s in subjects if str(s).strip()]
-                    if not subjects:
-                        continue
-
-                    # دمج مع الإسناد الحالي: نحافظ على classes إن وُجدت لنفس المادة
-                    existing = {}
-                    if isinstance(emp.analytics_assignments, list):
-                        for a in emp.analytics_assignments or []:
-                            s = (a.get('subject') or '').strip()
-                            if not s:
-                                continue
-                            cl = a.get('classes')
-                            existing[s] = list(cl) if isinstance(cl, list) else ([cl] if cl else [])
-
-                    # إذا كانت الأقسام فارغة لمادة ما، نملأها تلقائياً من إسناد الموارد البشرية (حتى لا يلزم حفظ إسناد كل أستاذ يدوياً)
-                    def _norm_subj(t):
-                        t = (t or '').strip().replace('ـ', '').replace('  ', ' ')
-                        if t.startswith('ال'):
-                            t = t[2:].strip()
-                        return t.lower()
-
-                    hr_assignments = list(TeacherAssignment.objects.filter(teacher=emp).values_list('subject', 'classes'))
-                    for subj, classes in hr_assignments:
-                        if not subj or str(subj).strip() == '/':
-                            continue
-                        hr_subj = str(subj).strip()
-                        cl_list = list(classes) if isinstance(classes, list) else ([classes] if classes else [])
-                        if not cl_list:
-                            continue
-                        n_hr = _norm_subj(hr_subj)
-                        for s in subjects:
-                            if existing.get(s):
-                                continue
-                            n_s = _norm_subj(s)
-                            if n_hr in n_s or n_s in n_hr or hr_subj in s or s in hr_subj:
-                                existing[s] = list(cl_list)
-                                break
-
-                    emp.analytics_assignments = [{'subject': s, 'classes': list(existing.get(s, []))} for s in subjects]
-                    emp.save(update_fields=['analytics_assignments'])
+            _apply_grade_import_links(subject_mappings, teacher_subject_links)
 
             success = count > 0
             return JsonResponse({'success': success, 'message': msg, 'count': count})
@@ -3478,3 +3471,90 @@ def upload_grades_ajax(request):
                 except: pass
 
     return JsonResponse({'success': False, 'message': 'طلب غير صالح'})
+
+
+def _can_import_grades(user):
+    if not user.is_authenticated:
+        return False
+    if user.is_superuser or user.username == 'director':
+        return True
+    return hasattr(user, 'profile') and user.profile.has_perm('access_analytics')
+
+
+# Name given by upload_grades_preview_ajax: NamedTemporaryFile(suffix=f"_{file.name}")
+_PREVIEW_TEMP_NAME = re.compile(r'^tmp[a-z0-9_]{8}_.+$')
+
+
+def _preview_temp_path(path):
+    """The preview step's temp file for `path`, or None for any other server path (import sessions delete their files)"""
+    if not isinstance(path, str) or not path:
+        return None
+    real = os.path.realpath(path)
+    if os.path.dirname(real) != os.path.realpath(tempfile.gettempdir()):
+        return None
+    if not _PREVIEW_TEMP_NAME.match(os.path.basename(real)) or not os.path.isfile(real):
+        return None
+    return real
+
+
+def upload_grades_batch_ajax(request):
+    """
+    Queues all uploaded grade files as one import session (see grade_import_jobs) and returns at once;
+    the page polls grade_import_session_status for per-file results.
+    Files come as multiple 'files' uploads and/or 'temp_files' = [{"name", "temp_file_path"}] from the preview step.
+    """
+    if not _can_import_grades(request.user):
+        return JsonResponse({'success': False, 'message': 'ليس لديك صلاحية لاستيراد العلامات'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'طلب غير صالح'})
+    import json
+    import os
+    import tempfile
+    from .grade_import_jobs import create_import_session, session_to_dict
+
+    term, import_mode, subject_mappings, teacher_subject_links = _grade_import_options(request)
+    files = []
+    try:
+        temp_files = json.loads(request.POST.get('temp_files') or '[]')
+    except json.JSONDecodeError:
+        temp_files = []
+    for item in temp_files:
+        raw_path = item.get('temp_file_path') if isinstance(item, dict) else None
+        path = _preview_temp_path(raw_path)
+        if raw_path and path is None:
+            return JsonResponse({'success': False, 'message': 'مسار ملف مؤقت غير صالح'}, status=400)
+        if path:
+            files.append((item.get('name') or os.path.basename(path), path))
+    for file in request.FILES.getlist('files'):
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.name}") as tmp:
+                for chunk in file.chunks():
+                    tmp.write(chunk)
+            files.append((file.name, tmp.name))
+        except Exception as e:
+            return JsonResponse({'success': False, 'message': f"خطأ في حفظ الملف: {str(e)}"})
+    if not files:
+        return JsonResponse({'success': False, 'message': "الملف غير موجود."})
+
+    session = create_import_session(files, term, import_mode, subject_mappings, user=request.user)
+    _apply_grade_import_links(subject_mappings, teacher_subject_links)
+    return JsonResponse({'success': True, 'session': session_to_dict(session)})
+
+
+def grade_import_session_status(request, session_id):
+    """Polled by the import dialog: progress and per-file results of an import session"""
+    from .grade_import_jobs import kick, reap_stale_sessions, session_to_dict
+    from .models import GradeImportSession
+
+    if not _can_import_grades(request.user):
+        return JsonResponse({'success': False, 'message': 'ليس لديك صلاحية لاستيراد العلامات'}, status=403)
+
+    # A session whose process was restarted stops sending heartbeats: fail it and drop its files
+    reap_stale_sessions()
+    session = GradeImportSession.objects.filter(pk=session_id).first()
+    if session is None:
+        return JsonResponse({'success': False, 'message': 'جلسة الاستيراد غير موجودة'}, status=404)
+    if session.status == GradeImportSession.STATUS_QUEUED:
+        # Possibly orphaned (the process that queued it stopped): wake the local writer
+        kick()
+    return JsonResponse({'success': True, 'session': session_to_dict(session)})
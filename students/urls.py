@@ -1,4 +1,4 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from . import views
 from . import ui_views
 from . import auth_views
@@ -55,6 +55,7 @@ urlpatterns = [
     path('api/import_json/', views.import_students_json, name='api_import_json'),
     path('api/import/update/', views.upload_update_file, name='api_import_update'),
     path('sync/photos/', ui_views.sync_photos_view, name='sync_photos_view'),
+    re_path(r'^photos/(?P<size>[a-z]+)/(?P<digest>[0-9a-f]{8,40})\.(?P<ext>webp|jpg)$', views.photo_variant, name='photo_variant'),
     path('ui/', ui_views.canteen_home, name='canteen_home'),
     path('list/', ui_views.student_list, name='student_list'),
     path('management/', ui_views.students_management, name='students_management'),
@@ -62,10 +63,12 @@ urlpatterns = [
 
     # API Views
     path('scan_card/', views.scan_card, name='scan_card'),
+    path('scan_card/batch/', views.scan_card_batch, name='scan_card_batch'),
     path('canteen_stats/', views.get_canteen_stats, name='canteen_stats'),
     path('manual_attendance/', views.manual_attendance, name='manual_attendance'),
     path('delete_attendance/', views.delete_attendance, name='delete_attendance'),
     path('attendance_lists/', views.get_attendance_lists, name='attendance_lists'),
+    path('attendance_roster/', views.get_canteen_roster, name='attendance_roster'),
     path('export_canteen/', views.export_canteen_sheet, name='export_canteen'),
     path('meal_plans/', views.canteen_meal_plans, name='canteen_meal_plans'),
     path('daily_summary/', views.canteen_daily_summary, name='canteen_daily_summary'),
@@ -80,6 +83,7 @@ urlpatterns = [
 
     # Settings API
     path('settings/data/', views.school_settings, name='school_settings'),
+    path('settings/grade_archive/status/', views.grade_archive_status, name='grade_archive_status'),
 
     # Library UI
     path('library/', ui_views.library_home, name='library_home'),
@@ -107,6 +111,8 @@ urlpatterns = [
     path('analytics_test/', ui_views.analytics_dashboard, name='analytics_test'),
     path('analytics/upload_grades_preview_ajax/', ui_views.upload_grades_preview_ajax, name='upload_grades_preview_ajax'),
     path('analytics/upload_grades_ajax/', ui_views.upload_grades_ajax, name='upload_grades_ajax'),
+    path('analytics/upload_grades_batch_ajax/', ui_views.upload_grades_batch_ajax, name='upload_grades_batch_ajax'),
+    path('analytics/grade_import_session/<int:session_id>/', ui_views.grade_import_session_status, name='grade_import_session_status'),
     path('analytics/rename_subject_ajax/', ui_views.rename_subject_ajax, name='rename_subject_ajax'),
     path('analytics/delete_subject_ajax/', ui_views.delete_subject_ajax, name='delete_subject_ajax'),
     path('analytics/add_subject_exemption_rule_ajax/', ui_views.add_subject_exemption_rule_ajax, name='add_subject_exemption_rule_ajax'),
@@ -124,6 +130,7 @@ urlpatterns = [
     path('analytics/expert/delete/<int:run_id>/', expert_views.expert_delete_run, name='expert_delete_run'),
     path('api/expert/run/', expert_api_views.api_expert_run, name='api_expert_run'),
     path('api/expert/run_status/', expert_api_views.api_expert_run_status, name='api_expert_run_status'),
+    path('api/expert/run_cancel/', expert_api_views.api_expert_run_cancel, name='api_expert_run_cancel'),
     path('api/expert/data/', expert_api_views.api_expert_data, name='api_expert_data'),
     path('api/expert/student_term_grades/', expert_api_views.api_expert_student_term_grades, name='api_expert_student_term_grades'),
     path('analytics/expert/export/', expert_views.expert_export_excel, name='expert_export_excel'),
@@ -1,27 +1,73 @@
 import os
-from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from .models import Student
+from .photo_variants import IMAGE_EXTENSIONS, PHOTO_DIR, generate_variants, hash_files, photo_dir, safe_photo_id
 
-def sync_photos_logic():
+
+def list_photo_files():
     """
-    Core logic to link students with photos in media/students_photos.
-    Returns the count of updated records.
+    One scandir pass over media/students_photos.
+    Returns {safe_student_id: [(filename, path, mtime), ...]} ordered by IMAGE_EXTENSIONS preference.
+    """
+    found = {}
+    with os.scandir(photo_dir()) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                found.setdefault(stem, []).append((entry.name, entry.path, entry.stat().st_mtime))
+    for files in found.values():
+        files.sort(key=lambda f: IMAGE_EXTENSIONS.index(os.path.splitext(f[0])[1].lower()))
+    return found
+
+
+def sync_photos_logic(thumbnails=True):
     """
-    students = Student.objects.all()
-    count = 0
-    photo_dir = os.path.join(settings.MEDIA_ROOT, 'students_photos')
+    Core logic to link students with photos in media/students_photos.
+    The directory is listed once and joined against student_id_number in memory;
+    changes are written with a single bulk_update. Returns the count of updated records.
 
-    if not os.path.exists(photo_dir):
+    Content hashes (Student.photo_hash) are recomputed only for relinked photos, photos
+    without a hash, or files modified after the student's last update; then the missing
+    size variants (card/list/scan) are rendered.
+    """
+    if not os.path.exists(photo_dir()):
         return 0
+    files = list_photo_files()
+
+    now = timezone.now()
+    linked = {}    # student -> path of the linked file
+    to_hash = {}   # student pk -> path
+    for student in Student.objects.only('id', 'student_id_number', 'photo', 'photo_hash', 'updated_at').iterator(chunk_size=2000):
+        candidates = files.get(safe_photo_id(student.student_id_number))
+        if not candidates:
+            continue
+        by_name = {f"{PHOTO_DIR}/{name}": (path, mtime) for name, path, mtime in candidates}
+        relinked = student.photo.name not in by_name  # not linked to an existing file yet
+        if relinked:
+            student.photo = f"{PHOTO_DIR}/{candidates[0][0]}"
+        path, mtime = by_name[student.photo.name]
+        linked[student] = path
+        stale = not student.updated_at or mtime > student.updated_at.timestamp()
+        if relinked or not student.photo_hash or stale:
+            to_hash[student.pk] = path
+
+    # Every re-hashed row is written back, so its updated_at moves past the file mtime
+    digests = hash_files(to_hash)
+    changed = []
+    for student in linked:
+        if student.pk in to_hash:
+            student.photo_hash = digests.get(student.pk, '')
+            student.updated_at = now  # bulk_update skips auto_now (offline change feed)
+            changed.append(student)
+
+    if changed:
+        with transaction.atomic():
+            Student.objects.bulk_update(changed, ['photo', 'photo_hash', 'updated_at'], batch_size=500)
+        # bulk_update doesn't send post_save signals
+        from .canteen_utils import invalidate_barcode_index
+        invalidate_barcode_index()
 
-    for student in students:
-        filename = f"{student.student_id_number}.jpg"
-        file_path = os.path.join(photo_dir, filename)
-        db_path = f"students_photos/{filename}"
-
-        if os.path.exists(file_path):
-            if not student.photo or student.photo.name != db_path:
-                student.photo = db_path
-                student.save()
-                count += 1
-    return count
+    if thumbnails:
+        generate_variants({s.photo_hash: path for s, path in linked.items() if s.photo_hash})
+    return len(changed)
@@ -4,13 +4,16 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from django.db.models import Count, F, Q
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import (
     Student,
     CanteenAttendance,
     CanteenDailySummary,
     LibraryLoan,
+    LibraryLoanDailyStats,
     SchoolSettings,
     ArchiveDocument,
     EmployeeProfile,
@@ -18,15 +21,30 @@ from .models import (
     PendingUpdate,
     AttendanceRecord,
     Communication,
+    Employee,
 )
 from .serializers import StudentSerializer, StudentListSerializer, CanteenAttendanceSerializer, LibraryLoanSerializer, SchoolSettingsSerializer, ArchiveDocumentSerializer, SystemMessageSerializer, PendingUpdateSerializer
-from .utils import normalize_arabic
+from .student_search import search_students
+from .student_import import StudentImportError, import_students
+from .settings_utils import get_school_settings, get_canteen_meals_map, parse_json_dict
+from .grade_cube import invalidate_grade_cube
+from .dashboard_stats import get_dashboard_stats, invalidate_dashboard_stats
+from .photo_variants import VARIANT_SIZES, generate_variants, variant_ext, variant_name
+from .library_stats import borrower_distributions, loan_window_counts, overdue_loans, record_loan, record_return
+from .canteen_utils import (
+    HALF_BOARD,
+    KIND_EMPLOYEE,
+    resolve_barcode,
+    invalidate_barcode_index,
+    has_eaten,
+    mark_eaten,
+)
 import openpyxl
 from openpyxl.styles import Font, Alignment
-from django.http import HttpResponse, FileResponse
-from datetime import date, timedelta, datetime
-from collections import defaultdict
+from django.http import Http404, HttpResponse, FileResponse, StreamingHttpResponse
+from datetime import date, timedelta, datetime, time
 import os
+import tempfile
 from io import BytesIO
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
@@ -89,25 +107,7 @@ class StudentViewSet(viewsets.ModelViewSet):
             # We want exact match for class_name since it's just a number now
             queryset = queryset.filter(class_name=class_name)
         if search:
-            norm_search = normalize_arabic(search)
-            q_obj = Q(student_id_number__icontains=search) | \
-                    Q(first_name__icontains=search) | \
-                    Q(last_name__icontains=search)
-
-            # Add normalized search
-            if norm_search != search:
-                q_obj |= Q(first_name__icontains=norm_search) | \
-                         Q(last_name__icontains=norm_search)
-
-            # Common variations (Ha/Ta Marbuta, Alef)
-            if 'ه' in search:
-                 alt = search.replace('ه', 'ة')
-                 q_obj |= Q(first_name__icontains=alt) | Q(last_name__icontains=alt)
-            if 'ة' in search:
-                 alt = search.replace('ة', 'ه')
-                 q_obj |= Q(first_name__icontains=alt) | Q(last_name__icontains=alt)
-
-            queryset = queryset.filter(q_obj)
+            queryset = search_students(queryset, search)
 
         return queryset
 
@@ -514,16 +514,8 @@ def import_students_json(request):
     if not students_list:
         return Response({'error': 'No data provided'}, status=400)
 
-    created_count = 0
-    updated_count = 0
     errors = []
-
-    # Map existing students for fast lookup
-    existing_map = {s.student_id_number: s for s in Student.objects.all()}
-
-    to_create = []
-    to_update = []
-
+    rows = []
     for item in students_list:
         try:
             sid = str(item.get('student_id_number')).strip()
@@ -534,7 +526,7 @@ def import_students_json(request):
             enroll_date = parse_smart_date(item.get('enrollment_date'))
             if enroll_date == date(1900, 1, 1): enroll_date = date.today()
 
-            student_data = {
+            rows.append({
                 'student_id_number': sid,
                 'last_name': item.get('last_name', ''),
                 'first_name': item.get('first_name', ''),
@@ -550,41 +542,30 @@ def import_students_json(request):
                 'mother_name': item.get('mother_name', ''),
                 'address': item.get('address', ''),
                 'guardian_phone': item.get('guardian_phone', ''),
-            }
-
-            if sid in existing_map:
-                if update_existing:
-                    s = existing_map[sid]
-                    for key, val in student_data.items():
-                        if key != 'student_id_number': # Don't update PK
-                            setattr(s, key, val)
-                    to_update.append(s)
-            else:
-                to_create.append(Student(**student_data))
-
+            })
         except Exception as e:
             errors.append(f"Row error: {str(e)}")
 
+    result = None
     try:
-        if to_create:
-            Student.objects.bulk_create(to_create)
-            created_count = len(to_create)
-
-        if to_update:
-            Student.objects.bulk_update(to_update, [
-                'last_name', 'first_name', 'gender', 'date_of_birth', 'place_of_birth',
-                'academic_year', 'class_name', 'attendance_system', 'enrollment_number',
-                'enrollment_date', 'guardian_name', 'mother_name', 'address', 'guardian_phone'
-            ])
-            updated_count = len(to_update)
-
-        return Response({
-            'created': created_count,
-            'updated': updated_count,
-            'errors': errors
-        })
+        # Only new rows and changed fields are written, in fixed-size transactional batches
+        result = import_students(
+            rows, update_existing=update_existing,
+            progress=lambda done, total: logger.info("Student import: %d/%d rows written", done, total),
+        )
+        return Response({**result, 'errors': errors})
+    except StudentImportError as e:
+        # Earlier batches are committed: report what was written along with the error
+        result = e.result
+        return Response({'error': str(e), **result, 'errors': errors}, status=500)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+    finally:
+        if result and (result['created'] or result['updated']):
+            # bulk_create/bulk_update don't send post_save signals
+            invalidate_barcode_index()
+            invalidate_grade_cube()
+            invalidate_dashboard_stats()
 
 class ArchiveDocumentViewSet(viewsets.ModelViewSet):
     queryset = ArchiveDocument.objects.all().order_by('-entry_date')
@@ -654,7 +635,7 @@ def scan_library_card(request):
         active_loans = LibraryLoan.objects.filter(student=student, is_returned=False)
 
         # Check limit
-        settings_obj = SchoolSettings.objects.first()
+        settings_obj = get_school_settings()
         limit = settings_obj.loan_limit if settings_obj else 2
         limit_reached = active_loans.count() >= limit
 
@@ -688,7 +669,7 @@ def create_loan(request):
 
     # Check loan limit
     active_loans_count = LibraryLoan.objects.filter(student=student, is_returned=False).count()
-    settings_obj = SchoolSettings.objects.first()
+    settings_obj = get_school_settings()
     limit = 2
     if settings_obj:
         # Check specific level limit
@@ -714,12 +695,14 @@ def create_loan(request):
 
     expected_return = loan_date + timedelta(days=15)
 
-    loan = LibraryLoan.objects.create(
-        student=student,
-        book_title=book_title,
-        loan_date=loan_date,
-        expected_return_date=expected_return
-    )
+    with transaction.atomic():
+        loan = LibraryLoan.objects.create(
+            student=student,
+            book_title=book_title,
+            loan_date=loan_date,
+            expected_return_date=expected_return
+        )
+        record_loan(loan_date)
 
     return Response(LibraryLoanSerializer(loan).data, status=status.HTTP_201_CREATED)
 
@@ -730,7 +713,9 @@ def get_readers(request):
         if not hasattr(request.user, 'profile') or not request.user.profile.has_perm('library_readers_list'):
              return Response({'error': 'Unauthorized'}, status=403)
 
-        count = LibraryLoan.objects.all().delete()[0]
+        with transaction.atomic():
+            count = LibraryLoan.objects.all().delete()[0]
+            LibraryLoanDailyStats.objects.all().delete()
         return Response({'message': f'Deleted {count} records'})
 
     # Point 12: Include loan date and book title
@@ -755,14 +740,14 @@ def get_readers(request):
 @csrf_exempt
 @api_view(['GET', 'POST'])
 def school_settings(request):
-    settings_obj = SchoolSettings.objects.first()
-
     if request.method == 'GET':
+        settings_obj = get_school_settings()
         if settings_obj:
             return Response(SchoolSettingsSerializer(settings_obj).data)
         return Response({})
 
     elif request.method == 'POST':
+        settings_obj = SchoolSettings.objects.first()
         if settings_obj:
             serializer = SchoolSettingsSerializer(settings_obj, data=request.data, partial=True)
         else:
@@ -774,6 +759,19 @@ def school_settings(request):
         print(f"Settings Save Error: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+def grade_archive_status(request):
+    """Progress of the grade archival started by the last school-year change (see grade_archive)"""
+    from .grade_archive import archive_job_to_dict, resume_stale_jobs
+    from .models import GradeArchiveJob
+
+    # A job orphaned by a process restart stops sending heartbeats: requeue it and wake the local runner
+    resume_stale_jobs()
+    job = (GradeArchiveJob.objects.filter(status__in=GradeArchiveJob.ACTIVE_STATUSES).order_by('created_at').first()
+           or GradeArchiveJob.objects.order_by('-created_at').first())
+    return Response({'running': bool(job and job.status in GradeArchiveJob.ACTIVE_STATUSES),
+                     'job': archive_job_to_dict(job) if job else None})
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -787,9 +785,14 @@ def return_book(request):
     except LibraryLoan.DoesNotExist:
         return Response({'error': 'Loan not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    loan.is_returned = True
-    loan.actual_return_date = date.today()
-    loan.save()
+    if loan.is_returned:
+        return Response({'message': 'Book returned successfully'})
+
+    with transaction.atomic():
+        loan.is_returned = True
+        loan.actual_return_date = date.today()
+        loan.save()
+        record_return(loan.actual_return_date)
 
     return Response({'message': 'Book returned successfully'})
 
@@ -798,60 +801,39 @@ def library_stats(request):
     today = date.today()
 
     # Point 10: Stats Intervals (Daily, Weekly, Monthly, Quarterly, Yearly)
-    # Using loan_date as the metric
-    daily = LibraryLoan.objects.filter(loan_date=today).count()
-
-    week_start = today - timedelta(days=today.weekday()) # Start of week (Monday?) or just last 7 days? User said "Weekly". Let's do last 7 days.
-    # Actually "Weekly" usually means "This Week". But let's stick to simple "Last 7 days" or "This week" depending on interpretation.
-    # Let's use "This Week" (since start of week) or rolling 7 days. Rolling 7 is safer.
-    weekly = LibraryLoan.objects.filter(loan_date__gte=today - timedelta(days=7)).count()
-    monthly = LibraryLoan.objects.filter(loan_date__gte=today - timedelta(days=30)).count()
-    quarterly = LibraryLoan.objects.filter(loan_date__gte=today - timedelta(days=90)).count()
-    yearly = LibraryLoan.objects.filter(loan_date__gte=today - timedelta(days=365)).count()
+    # Loan counts per loan_date come from the daily rollup table (see library_stats)
+    stats = loan_window_counts(today)
 
-    total_students = Student.objects.count()
-    borrowers_count = LibraryLoan.objects.values('student').distinct().count()
+    total_students = get_dashboard_stats()['total_students']
+    borrowers_count, class_dist, level_dist = borrower_distributions()
 
     percentage = 0
     if total_students > 0:
         percentage = round((borrowers_count / total_students) * 100, 1)
 
-    # Overdue loans: Not returned AND expected_return < today
-    overdue_loans = LibraryLoan.objects.filter(
-        is_returned=False,
-        expected_return_date__lt=today
-    ).select_related('student')
-
-    overdue_list = []
-    for loan in overdue_loans:
-        overdue_list.append({
-            'student_name': f"{loan.student.last_name} {loan.student.first_name}",
-            'student_class': loan.student.class_name,
-            'book_title': loan.book_title,
-            'loan_date': loan.loan_date,
-            'expected_return': loan.expected_return_date,
-            'days_overdue': (today - loan.expected_return_date).days
-        })
-
-    # Distribution stats
-    class_dist = LibraryLoan.objects.values('student__class_name').annotate(count=Count('student', distinct=True)).order_by('student__class_name')
-    level_dist = LibraryLoan.objects.values('student__academic_year').annotate(count=Count('student', distinct=True)).order_by('student__academic_year')
-
     return Response({
         'borrowers_count': borrowers_count,
         'borrowers_percentage': percentage,
-        'overdue_loans': overdue_list,
-        'stats': {
-            'daily': daily,
-            'weekly': weekly,
-            'monthly': monthly,
-            'quarterly': quarterly,
-            'yearly': yearly
-        },
-        'class_distribution': list(class_dist),
-        'level_distribution': list(level_dist)
+        # Overdue loans: Not returned AND expected_return < today
+        'overdue_loans': overdue_loans(today),
+        'stats': stats,
+        'class_distribution': class_dist,
+        'level_distribution': level_dist
     })
 
+def _canteen_schedule(settings_obj):
+    """Returns (open_time, close_time, allowed_days) from SchoolSettings, with defaults."""
+    close_time = (settings_obj.canteen_close_time if settings_obj else None) or time(13, 15)
+    open_time = (settings_obj.canteen_open_time if settings_obj else None) or time(12, 0)
+
+    # Parse days (comma separated string "0,1,2")
+    allowed_days = [0, 2, 3, 6] # Default Sun, Mon, Wed, Thu
+    if settings_obj and settings_obj.canteen_days:
+        try:
+            allowed_days = [int(d) for d in settings_obj.canteen_days.split(',') if d.strip().isdigit()]
+        except: pass
+    return open_time, close_time, allowed_days
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -870,40 +852,16 @@ def scan_card(request):
         # Clean the barcode (remove spaces, etc)
         barcode = str(barcode).strip()
 
-        # Robust lookup
-        student = None
-        employee = None
-        is_employee = False
+        # In-memory lookup (students first, then employee codes)
+        entry = resolve_barcode(barcode)
+        if entry is None:
+            return Response({'error': 'Not found', 'code': 'NOT_FOUND'}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            student = Student.objects.get(student_id_number=barcode)
-        except Student.DoesNotExist:
-            try:
-                employee = Employee.objects.get(employee_code=barcode)
-                is_employee = True
-            except Employee.DoesNotExist:
-                return Response({'error': 'Not found', 'code': 'NOT_FOUND'}, status=status.HTTP_404_NOT_FOUND)
-            except Employee.MultipleObjectsReturned:
-                employee = Employee.objects.filter(employee_code=barcode).first()
-                if not employee:
-                    return Response({'error': 'Not found', 'code': 'NOT_FOUND'}, status=status.HTTP_404_NOT_FOUND)
-                is_employee = True
-        except Student.MultipleObjectsReturned:
-            student = Student.objects.filter(student_id_number=barcode).first()
-            if not student:
-                return Response({'error': 'Not found', 'code': 'NOT_FOUND'}, status=status.HTTP_404_NOT_FOUND)
+        is_employee = entry.kind == KIND_EMPLOYEE
+        student_data = entry.card if not is_employee else None
 
         # Time Restriction Logic (Dynamic)
-        settings_obj = SchoolSettings.objects.first()
-        close_time = settings_obj.canteen_close_time if settings_obj else time(13, 15)
-        open_time = settings_obj.canteen_open_time if settings_obj else time(12, 0)
-
-        # Parse days (comma separated string "0,1,2")
-        allowed_days = [0, 2, 3, 6] # Default Sun, Mon, Wed, Thu
-        if settings_obj and settings_obj.canteen_days:
-            try:
-                allowed_days = [int(d) for d in settings_obj.canteen_days.split(',') if d.strip().isdigit()]
-            except: pass
+        open_time, close_time, allowed_days = _canteen_schedule(get_school_settings())
 
         now = timezone.localtime()
         current_time = now.time()
@@ -915,7 +873,7 @@ def scan_card(request):
              return Response({
                  'error': 'المطعم مغلق اليوم',
                  'code': 'CLOSED_DAY',
-                 'student': StudentSerializer(student).data if not is_employee else None
+                 'student': student_data
              }, status=status.HTTP_403_FORBIDDEN)
 
         # Check Time
@@ -923,17 +881,15 @@ def scan_card(request):
              return Response({
                  'error': f'المطعم يفتح على الساعة {open_time.strftime("%H:%M")}',
                  'code': 'NOT_OPEN_YET',
-                 'student': StudentSerializer(student).data if not is_employee else None
+                 'student': student_data
              }, status=status.HTTP_403_FORBIDDEN)
 
+        today = date.today()
         if current_time > close_time:
-             today = date.today()
              if is_employee:
-                 attended = CanteenAttendance.objects.filter(employee=employee, date=today).exists()
-                 student_data = None
+                 attended = CanteenAttendance.objects.filter(employee_id=entry.id, date=today).exists()
              else:
-                 attended = CanteenAttendance.objects.filter(student=student, date=today).exists()
-                 student_data = StudentSerializer(student).data
+                 attended = has_eaten(entry.id, today)
 
              if attended:
                  return Response({
@@ -948,8 +904,8 @@ def scan_card(request):
                      'student': student_data
                  }, status=status.HTTP_403_FORBIDDEN)
 
-        today = date.today()
         if is_employee:
+            employee = Employee.objects.get(pk=entry.id)
             if CanteenAttendance.objects.filter(employee=employee, date=today).exists():
                 return Response({'error': 'تم تسجيل حضورك مسبقاً اليوم', 'code': 'ALREADY_ATE'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -975,37 +931,195 @@ def scan_card(request):
 
         else:
             # Check if Half-Board
-            if student.attendance_system != 'نصف داخلي':
+            if entry.attendance_system != HALF_BOARD:
                 return Response({
                     'error': 'Student is not Half-Board',
-                    'student': StudentSerializer(student).data,
+                    'student': student_data,
                     'code': 'NOT_HALF_BOARD'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Check if already attended today
-            if CanteenAttendance.objects.filter(student=student, date=today).exists():
+            # Check if already attended today (in-memory bitset)
+            if has_eaten(entry.id, today):
                 return Response({
                     'error': 'Student already took the meal',
-                    'student': StudentSerializer(student).data,
+                    'student': student_data,
                     'code': 'ALREADY_ATE'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Record attendance
-            attendance = CanteenAttendance.objects.create(
-                student=student,
-                date=today,
-                registration_method=CanteenAttendance.REG_SCAN,
-            )
+            # Record attendance: a single INSERT, the (student, date) constraint is the final judge
+            try:
+                with transaction.atomic():
+                    attendance = CanteenAttendance.objects.create(
+                        student_id=entry.id,
+                        date=today,
+                        registration_method=CanteenAttendance.REG_SCAN,
+                    )
+            except IntegrityError:
+                # Another worker recorded this student first, or the index is stale
+                if CanteenAttendance.objects.filter(student_id=entry.id, date=today).exists():
+                    mark_eaten(entry.id, today)
+                    return Response({
+                        'error': 'Student already took the meal',
+                        'student': student_data,
+                        'code': 'ALREADY_ATE'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                invalidate_barcode_index()
+                return Response({'error': 'Not found', 'code': 'NOT_FOUND'}, status=status.HTTP_404_NOT_FOUND)
+
             return Response({
                 'message': 'Attendance recorded',
-                'student': StudentSerializer(student).data,
-                'attendance': CanteenAttendanceSerializer(attendance).data
+                'student': student_data,
+                'attendance': {
+                    'id': attendance.id,
+                    'student': entry.id,
+                    'date': today.isoformat(),
+                    'time': attendance.time.strftime("%H:%M:%S"),
+                    'registration_method': attendance.registration_method,
+                }
             }, status=status.HTTP_201_CREATED)
 
     except Exception as e:
         logger.error(f"Canteen Scan Error: {e}")
         return Response({'error': f'Server Error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+MAX_BATCH_SCANS = 500
+
+
+def _parse_scan_timestamp(value):
+    """Client timestamp (ISO string or epoch milliseconds) -> aware local datetime, or None."""
+    if value in (None, ''):
+        return None
+    dt = None
+    if isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+        try:
+            dt = datetime.fromtimestamp(float(value) / 1000, tz=timezone.get_current_timezone())
+        except (OverflowError, OSError, ValueError):
+            return None
+    else:
+        dt = parse_datetime(str(value).strip())
+        if dt is None:
+            return None
+        if timezone.is_naive(dt):
+            dt = timezone.make_aware(dt)
+    return timezone.localtime(dt)
+
+
+def _insert_scan_attendance(student_ids, day, at):
+    """
+    Insert today's scan attendance for student_ids in one statement and return the ids that
+    were actually inserted. Rows already recorded (possibly by another worker: the "already ate"
+    bitset is per-process and may be stale) are skipped by the unique (student, date) constraint,
+    so each student is served at most once even when two batches race.
+    """
+    table = connection.ops.quote_name(CanteenAttendance._meta.db_table)
+    day = connection.ops.adapt_datefield_value(day)
+    at = connection.ops.adapt_timefield_value(at)
+    params = []
+    for sid in student_ids:
+        params += [sid, day, at, CanteenAttendance.REG_SCAN]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (student_id, date, time, registration_method) "
+            f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(student_ids))} "
+            f"ON CONFLICT (student_id, date) DO NOTHING RETURNING student_id",
+            params,
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def scan_card_batch(request):
+    """
+    Batch ingestion of canteen scans for scanner tablets.
+
+    Body: {"scans": [{"barcode": "...", "timestamp": "2026-04-21T12:05:00"}, ...]}
+    Each scan is checked against the canteen schedule at its client timestamp and
+    deduplicated against today's attendance; accepted scans are written with a single
+    INSERT ... ON CONFLICT DO NOTHING (see _insert_scan_attendance). Returns one verdict per scan using the scan_card codes ('OK' on success).
+    Scans from another day are rejected with WRONG_DAY (use the offline sync queue).
+    """
+    if not hasattr(request.user, 'profile') or not request.user.profile.has_perm('canteen_scan'):
+        return Response({'error': 'Unauthorized'}, status=403)
+
+    scans = request.data.get('scans') if isinstance(request.data, dict) else request.data
+    if not isinstance(scans, list) or not scans:
+        return Response({'error': 'No scans provided'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(scans) > MAX_BATCH_SCANS:
+        return Response({'error': f'Too many scans (max {MAX_BATCH_SCANS})'}, status=status.HTTP_400_BAD_REQUEST)
+
+    open_time, close_time, allowed_days = _canteen_schedule(get_school_settings())
+    now = timezone.localtime()
+    today = now.date()
+
+    results = []
+    to_create = []
+    batch_ids = set()
+    for item in scans:
+        if isinstance(item, dict):
+            barcode = str(item.get('barcode') or '').strip()
+            scanned_at = _parse_scan_timestamp(item.get('timestamp')) or now
+        else:
+            barcode = str(item or '').strip()
+            scanned_at = now
+
+        verdict = {'barcode': barcode, 'timestamp': scanned_at.isoformat()}
+        results.append(verdict)
+
+        entry = resolve_barcode(barcode) if barcode else None
+        if entry is None:
+            verdict['code'] = 'NOT_FOUND'
+            continue
+        verdict['name'] = entry.name
+        if entry.kind == KIND_EMPLOYEE:
+            # Employees consume a meal balance: they must go through scan_card
+            verdict['code'] = 'EMPLOYEE_NOT_SUPPORTED'
+            continue
+        verdict['student_id'] = entry.id
+
+        if scanned_at.date() != today:
+            verdict['code'] = 'WRONG_DAY'
+            continue
+        if scanned_at.weekday() not in allowed_days:
+            verdict['code'] = 'CLOSED_DAY'
+            continue
+        if scanned_at.time() < open_time:
+            verdict['code'] = 'NOT_OPEN_YET'
+            continue
+
+        already = entry.id in batch_ids or has_eaten(entry.id, today)
+        if scanned_at.time() > close_time:
+            verdict['code'] = 'LATE_ATE' if already else 'LATE_NOT_ATE'
+            continue
+        if entry.attendance_system != HALF_BOARD:
+            verdict['code'] = 'NOT_HALF_BOARD'
+            continue
+        if already:
+            verdict['code'] = 'ALREADY_ATE'
+            continue
+
+        verdict['code'] = 'OK'
+        batch_ids.add(entry.id)
+        to_create.append(entry.id)
+
+    recorded_ids = set()
+    if to_create:
+        with transaction.atomic():
+            recorded_ids = _insert_scan_attendance(to_create, today, now.time())
+            # A raw insert doesn't send post_save: keep the "already ate" bitset in sync ourselves
+            transaction.on_commit(lambda: [mark_eaten(sid, today) for sid in batch_ids])
+            if recorded_ids:
+                transaction.on_commit(invalidate_dashboard_stats)
+        for verdict in results:
+            if verdict['code'] == 'OK' and verdict['student_id'] not in recorded_ids:
+                verdict['code'] = 'ALREADY_ATE'
+
+    return Response({
+        'recorded': len(recorded_ids),
+        'results': results,
+    })
+
 @api_view(['GET'])
 def get_canteen_stats(request):
     today = date.today()
@@ -1033,16 +1147,7 @@ def manual_attendance(request):
         return Response({'error': 'Unauthorized'}, status=403)
 
     # Time Restriction Logic (Dynamic)
-    settings_obj = SchoolSettings.objects.first()
-    close_time = settings_obj.canteen_close_time if settings_obj else time(13, 15)
-    open_time = settings_obj.canteen_open_time if settings_obj else time(12, 0)
-
-    # Parse days
-    allowed_days = [0, 2, 3, 6]
-    if settings_obj and settings_obj.canteen_days:
-        try:
-            allowed_days = [int(d) for d in settings_obj.canteen_days.split(',') if d.strip().isdigit()]
-        except: pass
+    open_time, close_time, allowed_days = _canteen_schedule(get_school_settings())
 
     now = timezone.localtime()
     current_time = now.time()
@@ -1170,7 +1275,6 @@ def get_attendance_lists(request):
     present_attendances = CanteenAttendance.objects.filter(date=today).select_related('student')
 
     present_data = []
-    present_ids = []
     method_labels = {
         CanteenAttendance.REG_SCAN: 'مسح البطاقة',
         CanteenAttendance.REG_MANUAL: 'إدخال يدوي',
@@ -1184,15 +1288,91 @@ def get_attendance_lists(request):
             att.registration_method, att.registration_method
         )
         present_data.append(s_data)
-        present_ids.append(att.student.id)
 
-    absent_students = Student.objects.filter(attendance_system='نصف داخلي').exclude(id__in=present_ids)
+    absent_students = _canteen_absent_students(today)
 
     return Response({
         'present': present_data,
         'absent': StudentSerializer(absent_students, many=True).data
     })
 
+
+# Overlap applied to ?since= so a scan saved just before the previous poll's server_time
+# but committed after it is not missed (the client de-duplicates by attendance_id)
+ROSTER_SINCE_OVERLAP = timedelta(seconds=5)
+ROSTER_PRESENT_FIELDS = (
+    'id', 'student_id', 'student__student_id_number', 'student__last_name', 'student__first_name',
+    'student__academic_year', 'student__class_name', 'student__class_code', 'student__date_of_birth',
+    'time', 'registration_method',
+)
+ROSTER_ABSENT_FIELDS = ('id', 'student_id_number', 'last_name', 'first_name', 'academic_year', 'class_name', 'class_code')
+
+
+def _canteen_absent_students(day):
+    """Half-board students with no attendance on `day` (NOT EXISTS anti-join, no IN list)."""
+    return Student.objects.filter(attendance_system='نصف داخلي').exclude(
+        Exists(CanteenAttendance.objects.filter(student=OuterRef('pk'), date=day))
+    )
+
+
+@api_view(['GET'])
+def get_canteen_roster(request):
+    """
+    Compact present/absent roster for the canteen screen.
+
+    Without `since`: today's present rows and absent half-board students.
+    With `since=<server_time of the previous response>` (same day): only scans recorded
+    since then, and no absent list; the client applies them and compares its total
+    with `present_count` to detect deletions (then re-fetches the full roster).
+    """
+    now = datetime.now()
+    today = now.date()
+    since = parse_datetime(request.query_params.get('since') or '')
+    if since is not None and since.tzinfo is not None:
+        since = timezone.localtime(since).replace(tzinfo=None)
+    if since is not None:
+        since -= ROSTER_SINCE_OVERLAP
+    delta = since is not None and since.date() == today
+
+    method_labels = dict(CanteenAttendance.REGISTRATION_METHOD_CHOICES)
+    present_qs = CanteenAttendance.objects.filter(date=today)
+    present_count = present_qs.count()
+    if delta:
+        present_qs = present_qs.filter(time__gte=since.time())
+    present = [{
+        'attendance_id': row['id'],
+        'id': row['student_id'],
+        'student_id_number': row['student__student_id_number'],
+        'last_name': row['student__last_name'],
+        'first_name': row['student__first_name'],
+        'academic_year': row['student__academic_year'],
+        'class_name': row['student__class_name'],
+        'class_code': row['student__class_code'],
+        'date_of_birth': row['student__date_of_birth'],
+        'attendance_time': row['time'].strftime("%H:%M:%S") if row['time'] else None,
+        'registration_method': row['registration_method'],
+        'registration_method_label': method_labels.get(row['registration_method'], row['registration_method']),
+    } for row in present_qs.order_by('time', 'id').values(*ROSTER_PRESENT_FIELDS)]
+
+    data = {
+        'date': today.isoformat(),
+        'server_time': now.isoformat(),
+        'delta': delta,
+        'present_count': present_count,
+        'present': present,
+    }
+    if not delta:
+        data['absent'] = list(
+            _canteen_absent_students(today).order_by('academic_year', 'class_name', 'last_name', 'first_name')
+            .values(*ROSTER_ABSENT_FIELDS)
+        )
+    return Response(data)
+
+
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -1200,75 +1380,67 @@ def export_canteen_sheet(request):
     if not hasattr(request.user, 'profile') or not request.user.profile.has_perm('canteen_export'):
         return Response({'error': 'Unauthorized'}, status=403)
 
-    today = date.today()
-    date_str = today.strftime("%Y-%m-%d")
-
-    qs = CanteenAttendance.objects.select_related('student').order_by('date', 'student__class_name', 'student__last_name')
+    date_from = _parse_iso_date(request.data.get('date_from') or request.query_params.get('date_from'))
+    date_to = _parse_iso_date(request.data.get('date_to') or request.query_params.get('date_to'))
+    qs = CanteenAttendance.objects.all()
+    if date_from:
+        qs = qs.filter(date__gte=date_from)
+    if date_to:
+        qs = qs.filter(date__lte=date_to)
     if not qs.exists():
         return Response({'message': 'لا يوجد سجلات حضور لتصديرها'}, status=status.HTTP_200_OK)
 
-    by_date = defaultdict(list)
-    for att in qs.iterator(chunk_size=1000):
-        by_date[att.date].append(att)
-
     method_labels = {
         CanteenAttendance.REG_SCAN: 'مسح البطاقة',
         CanteenAttendance.REG_MANUAL: 'إدخال يدوي',
     }
+    headers = ["التاريخ", "التوقيت", "طريقة التسجيل", "رقم التعريف", "الاسم", "اللقب", "القسم", "الحالة"]
 
-    wb = openpyxl.Workbook()
-    first_sheet = True
-    for d in sorted(by_date.keys()):
-        title = d.strftime("%Y-%m-%d")[:31]
-        if first_sheet:
-            ws = wb.active
-            ws.title = title
-            first_sheet = False
-        else:
-            ws = wb.create_sheet(title=title)
-        ws.append(
-            [
-                "التاريخ",
-                "التوقيت",
-                "طريقة التسجيل",
-                "رقم التعريف",
-                "الاسم",
-                "اللقب",
-                "القسم",
-                "الحالة",
-            ]
-        )
-        for att in by_date[d]:
-            s = att.student
-            label = method_labels.get(att.registration_method, att.registration_method or '')
-            ws.append(
-                [
-                    str(att.date),
-                    att.time.strftime("%H:%M:%S"),
-                    label,
-                    s.student_id_number,
-                    s.first_name,
-                    s.last_name,
-                    s.class_name,
-                    "حاضر",
-                ]
-            )
-
-    output = BytesIO()
+    # Write-only workbook (rows are flushed as they are appended) fed from
+    # tuples in date order: one sheet per day, started when the date changes.
+    rows = qs.order_by('date', 'student__class_name', 'student__last_name').values_list(
+        'date', 'time', 'registration_method',
+        'student__student_id_number', 'student__first_name', 'student__last_name', 'student__class_name',
+    )
+    wb = openpyxl.Workbook(write_only=True)
+    ws, current = None, None
+    for d, t, method, id_number, first_name, last_name, class_name in rows.iterator(chunk_size=EXPORT_CHUNK_ROWS):
+        if d != current:
+            current = d
+            ws = wb.create_sheet(title=d.strftime("%Y-%m-%d")[:31])
+            ws.append(headers)
+        ws.append([
+            str(d), t.strftime("%H:%M:%S"), method_labels.get(method, method or ''),
+            id_number, first_name, last_name, class_name, "حاضر",
+        ])
+
+    # The zip is assembled in memory up to EXPORT_SPOOL_MAX_SIZE, then on disk
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
     wb.save(output)
     output.seek(0)
 
-    response = FileResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    date_str = date.today().strftime("%Y-%m-%d")
+    response = StreamingHttpResponse(
+        _iter_file_chunks(output),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
     response['Content-Disposition'] = f'attachment; filename="Canteen_Attendance_ByDay_{date_str}.xlsx"'
     return response
 
 
+def _iter_file_chunks(f, chunk_size=64 * 1024):
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
 def _canteen_meals_map():
-    settings_obj = SchoolSettings.objects.first()
-    if not settings_obj or not settings_obj.canteen_meals_by_date:
-        return {}
-    data = settings_obj.canteen_meals_by_date
-    return data if isinstance(data, dict) else {}
+    return get_canteen_meals_map()
 
 
 def _parse_iso_date(s):
@@ -1287,13 +1459,15 @@ def canteen_meal_plans(request):
     if not hasattr(request.user, 'profile') or not request.user.profile.has_perm('access_canteen'):
         return Response({'error': 'Unauthorized'}, status=403)
 
+    if request.method == 'GET':
+        if not get_school_settings():
+            return Response({'error': 'لا توجد إعدادات مؤسسة'}, status=400)
+        return Response({'meals': _canteen_meals_map()})
+
     settings_obj = SchoolSettings.objects.first()
     if not settings_obj:
         return Response({'error': 'لا توجد إعدادات مؤسسة'}, status=400)
 
-    if request.method == 'GET':
-        return Response({'meals': _canteen_meals_map()})
-
     # POST — دمج مفاتيح التواريخ المرسلة، أو استبدال كامل عند replace=true
     incoming = request.data.get('meals')
     if not isinstance(incoming, dict):
@@ -1315,7 +1489,8 @@ def canteen_meal_plans(request):
     if replace_all:
         current = _normalize_meals_dict(incoming)
     else:
-        current = dict(_canteen_meals_map())
+        # Merge into the row we are about to save, not the cached copy
+        current = dict(parse_json_dict(settings_obj.canteen_meals_by_date))
         for k, v in incoming.items():
             key = str(k).strip()[:10]
             if not key:
@@ -1650,3 +1825,28 @@ class SystemMessageViewSet(viewsets.ModelViewSet):
                 serializer.save()
         else:
             raise PermissionError("Only Director can create messages")
+
+
+PHOTO_VARIANT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def photo_variant(request, size, digest, ext):
+    """
+    Serve a size variant of a student photo. The name is the content hash of the
+    original, so a URL never changes meaning and can be cached forever. Missing
+    variants (e.g. after clearing the directory) are rendered on first request.
+    """
+    if size not in VARIANT_SIZES or ext != variant_ext():
+        raise Http404
+    path = os.path.join(settings.MEDIA_ROOT, variant_name(digest, size))
+    if not os.path.isfile(path):
+        student = Student.objects.filter(photo_hash=digest).exclude(photo='').only('photo').first()
+        if student is None or not student.photo:
+            raise Http404
+        generate_variants({digest: student.photo.path}, sizes=[size])
+        if not os.path.isfile(path):
+            raise Http404
+    response = FileResponse(open(path, 'rb'), content_type='image/webp' if ext == 'webp' else 'image/jpeg')
+    response['Cache-Control'] = PHOTO_VARIANT_CACHE_CONTROL
+    response['ETag'] = f'"{size}-{digest}"'
+    return response